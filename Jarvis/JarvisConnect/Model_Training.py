@@ -1,97 +1,5 @@
-import torch
-import torch.nn as nn
-import torch.optim as optim
-from torch.optim import lr_scheduler
-from torch.utils.data import DataLoader
-from torchvision import datasets, models, transforms
-import os
-import time
+from trainer import main
 
+# The training loop lives in trainer.py, run 'python Model_Training.py --help' for the options
 if __name__ == '__main__':
-    # 1. Define the data directory and transformations
-    data_dir = r'C:\Users\USER\Desktop\Python\train_test'  # This path should point to your 'data' folder
-
-    data_transforms = {
-        'train': transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ]),
-        'val': transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ]),
-    }
-
-    # 2. Automatically load datasets and infer the number of classes
-    image_datasets = {x: datasets.ImageFolder(os.path.join(data_dir, x), data_transforms[x]) for x in ['train', 'val']}
-    num_classes = len(image_datasets['train'].classes)
-
-    dataloaders = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=32, shuffle=True, num_workers=4) for x
-                   in ['train', 'val']}
-    dataset_sizes = {x: len(image_datasets[x]) for x in ['train', 'val']}
-
-    # 3. Load pre-trained model and modify the final layer
-    model_ft = models.resnet50(pretrained=True)
-    num_ftrs = model_ft.fc.in_features
-    model_ft.fc = nn.Linear(num_ftrs, num_classes)
-
-    # 4. Set the device to GPU if available
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    model_ft = model_ft.to(device)
-
-    # 5. Define loss, optimizer, and learning rate scheduler
-    criterion = nn.CrossEntropyLoss()
-    optimizer_ft = optim.Adam(model_ft.parameters(), lr=0.001)
-    exp_lr_scheduler = lr_scheduler.StepLR(optimizer_ft, step_size=7, gamma=0.1)
-
-    # 6. Training loop
-    num_epochs = 10
-    for epoch in range(num_epochs):
-        print(f'Epoch {epoch + 1}/{num_epochs}')
-        print('-' * 10)
-
-        for phase in ['train', 'val']:
-            if phase == 'train':
-                model_ft.train()
-            else:
-                model_ft.eval()
-
-            running_loss = 0.0
-            running_corrects = 0
-
-            # Start timer for epoch duration
-            start_time = time.time()
-
-            for inputs, labels in dataloaders[phase]:
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-
-                optimizer_ft.zero_grad()
-
-                with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model_ft(inputs)
-                    _, preds = torch.max(outputs, 1)
-                    loss = criterion(outputs, labels)
-
-                    if phase == 'train':
-                        loss.backward()
-                        optimizer_ft.step()
-
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
-
-            if phase == 'train':
-                exp_lr_scheduler.step()
-
-            epoch_loss = running_loss / dataset_sizes[phase]
-            epoch_acc = running_corrects.double() / dataset_sizes[phase]
-
-            epoch_time = time.time() - start_time
-            print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} in {epoch_time:.2f}s')
-
-    print('\nTraining complete!')
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,9 +1,18 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, stream_with_context
 from flask_cors import CORS
-from groq import Groq
 import os
 import json
+import base64
+import time
 import logging
+import threading
+from functools import lru_cache
+from conversation_store import ConversationStore, estimate_tokens
+from llm_backends import build_backend_from_env
+from metrics import (CACHE_LOOKUPS, CHAT_TOKENS, UPSTREAM_LATENCY, metrics_payload, observe_request,
+                     observe_stream_error, server_timing, span, start_trace)
+from response_cache import ResponseCache, make_cache_key
+from static_assets import StaticAssets
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,27 +26,121 @@ GROQ_API_KEY = "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"
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY environment variable is required")
 
-# Initialize Groq client
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Chat completion settings shared by the blocking and streaming endpoints
+CHAT_MODEL = os.environ.get('CHAT_MODEL', "llama-3.3-70b-versatile")  # Use current Groq model
+CHAT_TEMPERATURE = 0.7
+CHAT_MAX_TOKENS = 1024
+
+# Initialize the LLM backend (Groq by default, LLM_BACKEND=mock for offline runs), with
+# retries and failover to LLM_FALLBACK_MODELS
+llm_backend = build_backend_from_env(GROQ_API_KEY, CHAT_MODEL)
+
+# Cache of chat responses: in-process LRU, plus an optional SQLite file shared by workers
+CHAT_CACHE_SIZE = int(os.environ.get('CHAT_CACHE_SIZE', '1024'))
+CHAT_CACHE_TTL = float(os.environ.get('CHAT_CACHE_TTL', '3600'))
+CHAT_CACHE_PATH = os.environ.get('CHAT_CACHE_PATH')
+response_cache = ResponseCache(CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_CACHE_PATH) if CHAT_CACHE_SIZE > 0 else None
+
+# Server-side conversation history per chat session, bounded by a token budget
+conversation_store = ConversationStore(
+    history_tokens=int(os.environ.get('CHAT_HISTORY_TOKENS', '1536')),
+    summary_tokens=int(os.environ.get('CHAT_SUMMARY_TOKENS', '256')),
+    idle_timeout=float(os.environ.get('CHAT_SESSION_IDLE', '1800'))
+)
+
+# Face recognition model (a checkpoint written by trainer.py or a folder written by
+# export_model.py), loaded once at startup
+RECOGNITION_MODEL_PATH = os.environ.get('RECOGNITION_MODEL_PATH', os.path.join('checkpoints', 'model_final.pt'))
+RECOGNITION_BACKEND = os.environ.get('RECOGNITION_BACKEND', 'auto')
+RECOGNITION_QUANTIZED = os.environ.get('RECOGNITION_QUANTIZED', 'false').lower() == 'true'
+RECOGNITION_MAX_BATCH_SIZE = int(os.environ.get('RECOGNITION_MAX_BATCH_SIZE', '16'))
+RECOGNITION_MAX_WAIT_MS = float(os.environ.get('RECOGNITION_MAX_WAIT_MS', '5'))
+RECOGNITION_DETECTORS = int(os.environ.get('RECOGNITION_DETECTORS', '4'))
+
+# Gallery of enrolled users for open-set identification (append-only log)
+GALLERY_PATH = os.environ.get('GALLERY_PATH', os.path.join('checkpoints', 'gallery.bin'))
+GALLERY_DTYPE = os.environ.get('GALLERY_DTYPE', 'float16')
+IDENTIFY_THRESHOLD = float(os.environ.get('IDENTIFY_THRESHOLD', '0.6'))
+
+# Minified, fingerprinted and precompressed assets from `python static_assets.py`; without
+# a build the files in static/ are served as they are
+STATIC_DIST_DIR = os.environ.get('STATIC_DIST_DIR', os.path.join('static', 'dist'))
+static_assets = StaticAssets.load(STATIC_DIST_DIR)
+if static_assets:
+    logger.info(f"Serving built static assets from {STATIC_DIST_DIR}")
+
+recognizer = None
+gallery = None
+# Makes the "is this username enrolled" check and the enrollment that follows it atomic
+enroll_lock = threading.Lock()
+if os.path.exists(RECOGNITION_MODEL_PATH):
+    # Imported lazily so the chat service runs without torch/mediapipe installed
+    from recognition import FaceRecognizer, RecognizerBusy
+    from embedding_index import EmbeddingIndex
+    recognizer = FaceRecognizer(RECOGNITION_MODEL_PATH,
+                                max_batch_size=RECOGNITION_MAX_BATCH_SIZE,
+                                max_wait_ms=RECOGNITION_MAX_WAIT_MS,
+                                backend=RECOGNITION_BACKEND,
+                                quantized=RECOGNITION_QUANTIZED,
+                                num_detectors=RECOGNITION_DETECTORS)
+    logger.info(f"Face recognition model loaded from {RECOGNITION_MODEL_PATH} ({recognizer.model.name})")
+
+    os.makedirs(os.path.dirname(GALLERY_PATH) or '.', exist_ok=True)
+    gallery = EmbeddingIndex(dtype=GALLERY_DTYPE, path=GALLERY_PATH)
+    logger.info(f"Loaded {len(gallery)} enrolled embeddings from {GALLERY_PATH}")
+else:
+    logger.warning(f"No face recognition model at {RECOGNITION_MODEL_PATH}, /api/recognize is disabled")
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe the request in the latency histogram and attach its Server-Timing spans"""
+    if 'request_start' not in g:
+        return response
+    duration = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_request(route, request.method, response.status_code, duration)
+    timing = server_timing(duration)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics"""
+    body, content_type = metrics_payload()
+    return Response(body, content_type=content_type)
 
 @app.route('/')
 def index():
     """Serve the main authentication page"""
+    if static_assets:
+        return static_assets.send('index.html')
     return send_from_directory('static', 'index.html')
 
 @app.route('/chat.html')
 def chat():
     """Serve the chat page"""
+    if static_assets:
+        return static_assets.send('chat.html')
     return send_from_directory('static', 'chat.html')
 
 @app.route('/css/<path:filename>')
 def serve_css(filename):
     """Serve CSS files"""
+    if static_assets:
+        return static_assets.send(f'css/{filename}')
     return send_from_directory('static/css', filename)
 
 @app.route('/js/<path:filename>')
 def serve_js(filename):
     """Serve JavaScript files"""
+    if static_assets:
+        return static_assets.send(f'js/{filename}')
     return send_from_directory('static/js', filename)
 
 @app.route('/static/<path:filename>')
@@ -45,56 +148,109 @@ def serve_static(filename):
     """Serve static files (CSS, JS, etc.)"""
     return send_from_directory('static', filename)
 
+@lru_cache(maxsize=1024)
+def build_system_prompt(username):
+    """The JARVIS system prompt for a user, built once per username"""
+    # Create a system prompt to make the AI behave like JARVIS
+    return f"""You are JARVIS, Tony Stark's AI assistant from Iron Man. You are sophisticated, intelligent, witty, and helpful. 
+            Respond in JARVIS's characteristic style - formal yet personable, with occasional dry humor. 
+            Keep responses concise but informative. Address the user as '{username}' when appropriate.
+            Always maintain JARVIS's polite and professional demeanor."""
+
+def conversation_key(username, session_id):
+    # Both values come from the client, so the username adds no protection: only an
+    # unguessable sessionId (a random UUID from auth.js) keeps one history from being read
+    # by another client. Anyone holding the sessionId can read that history.
+    return f"{username}\x00{session_id}"
+
+def build_chat_messages(user_message, username, session_id=None):
+    """Messages sent to the LLM: the JARVIS system prompt, the session's history and the user's message"""
+    if session_id:
+        return conversation_store.build_messages(conversation_key(username, session_id),
+                                                 build_system_prompt(username), user_message)
+    return [
+        {
+            "role": "system",
+            "content": build_system_prompt(username)
+        },
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+
+def prepare_chat(user_message, username, session_id):
+    """Assemble the messages of a chat request and look them up in the response cache.
+    Returns (messages, cache key, cached response or None)"""
+    with span('context'):
+        messages = build_chat_messages(user_message, username, session_id)
+        cache_key = chat_cache_key(messages)
+    CHAT_TOKENS.labels('in').observe(sum(estimate_tokens(m['content']) for m in messages))
+    if not response_cache:
+        return messages, cache_key, None
+    with span('cache'):
+        cached_response = response_cache.get(cache_key)
+    CACHE_LOOKUPS.labels('miss' if cached_response is None else 'hit').inc()
+    return messages, cache_key, cached_response
+
+def remember_response(cache_key, username, session_id, user_message, response, cached=False):
+    """Store a completed response in the response cache and the session's history"""
+    if not cached:
+        CHAT_TOKENS.labels('out').observe(estimate_tokens(response))
+        if response_cache:
+            response_cache.set(cache_key, response)
+    if session_id:
+        conversation_store.add_exchange(conversation_key(username, session_id), user_message, response)
+
+def chat_cache_key(messages):
+    """Response cache key of a chat request with the configured backend and settings"""
+    return make_cache_key(messages, llm_backend.name, CHAT_TEMPERATURE)
+
 @app.route('/api/chat', methods=['POST'])
 def chat_endpoint():
-    """Handle chat messages and get AI response from Groq"""
+    """Handle chat messages and get AI response from the LLM backend"""
     try:
         # Get the message from the request
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
         if not data or 'message' not in data:
             return jsonify({'error': 'Message is required'}), 400
             
         user_message = data['message']
         username = data.get('username', 'User')
+        session_id = data.get('sessionId')
         
         logger.info(f"Received message from {username}: {user_message}")
         
-        # Call Groq AI to get JARVIS response
-        try:
-            # Create a system prompt to make the AI behave like JARVIS
-            system_prompt = f"""You are JARVIS, Tony Stark's AI assistant from Iron Man. You are sophisticated, intelligent, witty, and helpful. 
-            Respond in JARVIS's characteristic style - formal yet personable, with occasional dry humor. 
-            Keep responses concise but informative. Address the user as '{username}' when appropriate.
-            Always maintain JARVIS's polite and professional demeanor."""
-            
-            # Send message to Groq
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ],
-                model="llama-3.3-70b-versatile",  # Use current Groq model
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            jarvis_response = chat_completion.choices[0].message.content
-            
-            logger.info(f"Groq response generated for {username}")
-            
+        messages, cache_key, cached_response = prepare_chat(user_message, username, session_id)
+        if cached_response is not None:
+            logger.info(f"Cached response served for {username}")
+            remember_response(cache_key, username, session_id, user_message, cached_response, cached=True)
             return jsonify({
                 'success': True,
-                'response': jarvis_response
+                'response': cached_response,
+                'cached': True
             })
+        
+        # Call the LLM backend to get JARVIS response
+        try:
+            with span('llm'):
+                llm_start = time.perf_counter()
+                jarvis_response = llm_backend.complete(messages, CHAT_TEMPERATURE, CHAT_MAX_TOKENS)
+            UPSTREAM_LATENCY.labels(llm_backend.name, 'complete').observe(time.perf_counter() - llm_start)
+            
+            logger.info(f"LLM response generated for {username}")
+            if jarvis_response:
+                remember_response(cache_key, username, session_id, user_message, jarvis_response)
+            
+            with span('serialize'):
+                return jsonify({
+                    'success': True,
+                    'response': jarvis_response
+                })
             
         except Exception as e:
-            logger.error(f"Groq API call failed: {str(e)}")
+            logger.error(f"LLM call failed: {str(e)}")
             return jsonify({
                 'success': False,
                 'error': "Unable to connect to JARVIS systems. Please try again."
@@ -107,12 +263,287 @@ def chat_endpoint():
             'error': "An unexpected error occurred. Please try again."
         }), 500
 
+def sse_event(data, event=None):
+    """Format one Server-Sent Event with a JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Stream the JARVIS response as Server-Sent Events while the LLM generates it.
+
+    Every token chunk is sent as a `data: {"delta": ...}` event, followed by a final
+    `done` event, or an `error` event if the completion fails midway.
+    """
+    with span('parse'):
+        data = request.get_json(silent=True)
+    if not data or 'message' not in data:
+        return jsonify({'error': 'Message is required'}), 400
+
+    user_message = data['message']
+    username = data.get('username', 'User')
+    session_id = data.get('sessionId')
+    logger.info(f"Received streaming message from {username}: {user_message}")
+
+    messages, cache_key, cached_response = prepare_chat(user_message, username, session_id)
+    if cached_response is not None:
+        logger.info(f"Cached response served for {username}")
+        remember_response(cache_key, username, session_id, user_message, cached_response, cached=True)
+        return cached_event_stream(cached_response)
+
+    # Wait for the first delta before responding, so failures (after failover) still get a 503
+    llm_start = time.perf_counter()
+    deltas = llm_backend.stream(messages, CHAT_TEMPERATURE, CHAT_MAX_TOKENS)
+    try:
+        with span('llm_first_token'):
+            first_delta = next(deltas, None)
+        UPSTREAM_LATENCY.labels(llm_backend.name, 'first_token').observe(time.perf_counter() - llm_start)
+    except Exception as e:
+        logger.error(f"LLM call failed: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': "Unable to connect to JARVIS systems. Please try again."
+        }), 503
+
+    def generate():
+        parts = []
+        try:
+            if first_delta is not None:
+                parts.append(first_delta)
+                yield sse_event({'delta': first_delta})
+                for delta in deltas:
+                    parts.append(delta)
+                    yield sse_event({'delta': delta})
+            UPSTREAM_LATENCY.labels(llm_backend.name, 'stream').observe(time.perf_counter() - llm_start)
+            logger.info(f"LLM response streamed for {username}")
+            if parts:
+                remember_response(cache_key, username, session_id, user_message, ''.join(parts))
+            yield sse_event({'success': True}, event='done')
+        except Exception as e:
+            logger.error(f"LLM stream failed: {str(e)}")
+            # The 200 is already sent, so the request metrics cannot see this failure
+            observe_stream_error('/api/chat/stream')
+            yield sse_event({
+                'success': False,
+                'error': "Unable to connect to JARVIS systems. Please try again."
+            }, event='error')
+        finally:
+            deltas.close()
+
+    return event_stream_response(stream_with_context(generate()))
+
+def event_stream_response(events):
+    """Wrap an iterable of SSE strings in an unbuffered text/event-stream response"""
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+def cached_event_stream(response_text):
+    """A cached response sent as a single delta followed by the done event"""
+    return event_stream_response([
+        sse_event({'delta': response_text}),
+        sse_event({'success': True, 'cached': True}, event='done')
+    ])
+
+def read_uploaded_image():
+    """Return the bytes of an image sent as multipart 'image' file or as a JSON base64/data URL"""
+    if 'image' in request.files:
+        return request.files['image'].read()
+    data = request.get_json(silent=True) or {}
+    encoded = data.get('image')
+    if not encoded:
+        return None
+    if encoded.startswith('data:'):
+        encoded = encoded.split(',', 1)[-1]
+    try:
+        return base64.b64decode(encoded)
+    except ValueError:
+        return None
+
+def analyze_uploaded_image():
+    """Run the uploaded image through the recognizer. Returns (analysis, None) or (None, error response)"""
+    # 501 with configured=False, unlike the 503 of an overloaded recognizer, tells clients that
+    # this deployment has no face recognition at all
+    if recognizer is None:
+        return None, (jsonify({
+            'success': False,
+            'configured': False,
+            'error': "Face recognition is not configured."
+        }), 501)
+
+    image_bytes = read_uploaded_image()
+    if not image_bytes:
+        return None, (jsonify({'error': 'Image is required'}), 400)
+
+    try:
+        analysis = recognizer.analyze(image_bytes)
+    except RecognizerBusy as e:
+        logger.warning(f"Face recognition overloaded: {str(e)}")
+        return None, (jsonify({
+            'success': False,
+            'error': "Biometric systems are busy. Please try again."
+        }), 503)
+    except Exception as e:
+        logger.error(f"Unexpected error while analyzing image: {str(e)}")
+        return None, (jsonify({
+            'success': False,
+            'error': "An unexpected error occurred. Please try again."
+        }), 500)
+
+    if analysis is None:
+        return None, (jsonify({
+            'success': False,
+            'error': "No face detected in the image."
+        }), 422)
+    return analysis, None
+
+def uploaded_username():
+    """Username sent along with an uploaded image, as a form field or JSON property"""
+    if request.form.get('username'):
+        return request.form['username'].strip()
+    data = request.get_json(silent=True) or {}
+    return (data.get('username') or '').strip()
+
+@app.route('/api/recognize', methods=['POST'])
+def recognize_endpoint():
+    """Identify the face in an uploaded image with the trained classifier"""
+    analysis, error = analyze_uploaded_image()
+    if error:
+        return error
+
+    predictions = analysis['predictions']
+    return jsonify({
+        'success': True,
+        'identity': predictions[0]['identity'],
+        'confidence': predictions[0]['confidence'],
+        'predictions': predictions
+    })
+
+def enroll_face(username, embedding, require_match):
+    """
+    Add a face to the gallery under username, unless the username is already enrolled and
+    the face does not match it. A username can only collect more faces from someone who
+    already passes its verification, so enrolling cannot be used to take over an account.
+
+    Args:
+        username (str): Gallery label.
+        embedding (np.ndarray): Embedding of the uploaded face.
+        require_match (bool): For an enrolled username, only add faces that verify against
+                              it. When False, a verified face is not added again.
+
+    Returns:
+        tuple: (outcome, score) with outcome 'enrolled', 'verified' or 'rejected' and the
+               best similarity to the username's existing faces (None for a new username).
+    """
+    with enroll_lock:
+        score = gallery.label_score(username, embedding)
+        if score is None:
+            gallery.add(username, embedding)
+            return 'enrolled', None
+        if score < IDENTIFY_THRESHOLD:
+            return 'rejected', score
+        if require_match:
+            gallery.add(username, embedding)
+            return 'enrolled', score
+        return 'verified', score
+
+@app.route('/api/enroll', methods=['POST'])
+def enroll_endpoint():
+    """
+    Add the face in an uploaded image to the gallery under the given username. An already
+    enrolled username only accepts faces that verify against its existing embeddings.
+    """
+    username = uploaded_username()
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+
+    analysis, error = analyze_uploaded_image()
+    if error:
+        return error
+
+    outcome, score = enroll_face(username, analysis['embedding'], require_match=True)
+    if outcome == 'rejected':
+        logger.warning(f"Rejected enrollment for existing user {username} (score {score:.3f})")
+        return jsonify({
+            'success': False,
+            'error': "This username is already enrolled and the face does not match it."
+        }), 403
+
+    logger.info(f"Enrolled face for {username}")
+    return jsonify({
+        'success': True,
+        'identity': username,
+        'gallery_size': len(gallery)
+    })
+
+@app.route('/api/authenticate', methods=['POST'])
+def authenticate_endpoint():
+    """
+    Sign in with a face scan. A first-time username is enrolled with the scan; an enrolled
+    username must match its gallery embeddings. The decision is made here, not by the client.
+    """
+    username = uploaded_username()
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+
+    analysis, error = analyze_uploaded_image()
+    if error:
+        return error
+
+    outcome, score = enroll_face(username, analysis['embedding'], require_match=False)
+    if outcome == 'rejected':
+        logger.warning(f"Biometric verification failed for {username} (score {score:.3f})")
+        return jsonify({
+            'success': False,
+            'error': "Biometric scan does not match this user. Please try again."
+        }), 401
+
+    predictions = analysis['predictions']
+    return jsonify({
+        'success': True,
+        'outcome': outcome,
+        'score': round(score, 4) if score is not None else None,
+        'identity': predictions[0]['identity'],
+        'confidence': predictions[0]['confidence']
+    })
+
+@app.route('/api/identify', methods=['POST'])
+def identify_endpoint():
+    """Find the closest enrolled users to the face in an uploaded image"""
+    analysis, error = analyze_uploaded_image()
+    if error:
+        return error
+
+    embedding = analysis['embedding']
+    matches = [{'identity': label, 'score': round(score, 4)} for label, score in gallery.search(embedding, k=5)]
+
+    # When a username is given, also verify the face against that user's enrolled embeddings
+    username = uploaded_username()
+    user_score = gallery.label_score(username, embedding) if username else None
+
+    predictions = analysis['predictions']
+    return jsonify({
+        'success': True,
+        'matches': matches,
+        'enrolled': user_score is not None,
+        'verified': user_score is not None and user_score >= IDENTIFY_THRESHOLD,
+        'identity': predictions[0]['identity'],
+        'confidence': predictions[0]['confidence']
+    })
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'groq_configured': bool(GROQ_API_KEY)
+        'groq_configured': bool(GROQ_API_KEY),
+        'llm_backend': llm_backend.name,
+        'recognition_configured': recognizer is not None,
+        'gallery_size': len(gallery) if gallery is not None else 0,
+        'response_cache': response_cache.stats() if response_cache else None,
+        'conversations': conversation_store.stats()
     })
 
 if __name__ == '__main__':
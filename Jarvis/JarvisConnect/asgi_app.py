@@ -0,0 +1,339 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import wraps
+import anyio
+import httpx
+from a2wsgi import WSGIMiddleware
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+import app as flask_app
+from metrics import (QUEUE_TIME, UPSTREAM_LATENCY, observe_request, observe_stream_error, server_timing, span,
+                     start_trace)
+
+logger = logging.getLogger(__name__)
+
+# Async serving mode: the chat endpoints run on the event loop with the async side of the
+# LLM backend, whose Groq HTTP connections are pooled and shared by all requests, so a slow
+# completion only holds a coroutine. Cache and conversation store calls, which may block on
+# SQLite, run in the default thread pool. Every other route is served by the Flask app from
+# app.py.
+# Run with: uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+# Upstream calls allowed in flight at once; also the size of the shared connection pool
+CHAT_MAX_CONCURRENCY = int(os.environ.get('CHAT_MAX_CONCURRENCY', '64'))
+# Requests allowed to wait for a free slot; beyond that new requests get a 429
+CHAT_MAX_QUEUE = int(os.environ.get('CHAT_MAX_QUEUE', '256'))
+# Seconds a queued request waits for a slot before it gets a 503
+CHAT_QUEUE_TIMEOUT = float(os.environ.get('CHAT_QUEUE_TIMEOUT', '5'))
+# Seconds allowed for one Groq call
+CHAT_UPSTREAM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '30'))
+
+
+class ChatOverloaded(Exception):
+    """Raised when a chat request is shed instead of queued"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of in-flight upstream calls with a bounded wait queue in front of it.
+
+    Requests that find the queue full are rejected right away (429), and requests that
+    wait longer than queue_timeout for a slot give up (503), so latency stays predictable
+    under overload instead of growing with the backlog.
+
+    Args:
+        max_concurrency (int): Slots for concurrent upstream calls.
+        max_queue (int): Requests allowed to wait for a slot.
+        queue_timeout (float): Seconds a request may wait for a slot.
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def acquire(self):
+        # Counted before awaiting, so a burst arriving in one loop iteration is bounded too
+        if self.in_flight + self.waiting >= self.max_concurrency + self.max_queue:
+            raise ChatOverloaded(429, "Too many pending chat requests")
+        self.waiting += 1
+        start = time.perf_counter()
+        acquired = False
+        try:
+            with span('queue'):
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._semaphore.acquire()
+                    acquired = True
+        except BaseException as e:
+            # A timeout or cancellation that lands right after the acquire must not leak the permit
+            if acquired:
+                self._semaphore.release()
+            if isinstance(e, TimeoutError):
+                raise ChatOverloaded(503, "Timed out waiting for a free chat slot") from None
+            raise
+        finally:
+            self.waiting -= 1
+            QUEUE_TIME.labels('chat').observe(time.perf_counter() - start)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    Event stream that holds a limiter slot until it has been sent, failed or been abandoned.
+
+    The slot is released and the upstream stream closed around the whole ASGI call rather than
+    in the body generator, whose cleanup never runs if the client disconnects before the body
+    is iterated.
+
+    Args:
+        content: Async iterator of encoded events.
+        limiter (ConcurrencyLimiter): Limiter the caller acquired a slot from.
+        upstream: Async generator of LLM deltas, closed when the response ends.
+    """
+
+    def __init__(self, content, limiter, upstream, **kwargs):
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
+            # Shielded, so a cancelled request still closes the upstream HTTP stream
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+                await self.upstream.aclose()
+
+
+limiter = ConcurrencyLimiter(CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT)
+# Shared with the Flask routes, so both modes fill and read the same cache
+response_cache = flask_app.response_cache
+llm_backend = flask_app.llm_backend
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=CHAT_MAX_CONCURRENCY, max_keepalive_connections=CHAT_MAX_CONCURRENCY),
+        timeout=CHAT_UPSTREAM_TIMEOUT)
+    # Retries are handled by the backend's failover
+    groq_client = AsyncGroq(api_key=flask_app.GROQ_API_KEY, http_client=http_client, max_retries=0)
+    llm_backend.bind_async_client(groq_client)
+    try:
+        yield
+    finally:
+        await groq_client.close()
+
+
+def instrumented(route):
+    """Record an endpoint's latency and status like app.record_request_metrics does for Flask routes"""
+    def decorator(endpoint):
+        @wraps(endpoint)
+        async def wrapper(request):
+            start = time.perf_counter()
+            start_trace()
+            response = await endpoint(request)
+            duration = time.perf_counter() - start
+            observe_request(route, request.method, response.status_code, duration)
+            timing = server_timing(duration)
+            if timing:
+                response.headers['Server-Timing'] = timing
+            return response
+        return wrapper
+    return decorator
+
+
+def overloaded_response(error):
+    logger.warning(f"Shedding chat request: {str(error)}")
+    return JSONResponse({
+        'success': False,
+        'error': "JARVIS systems are at capacity. Please try again."
+    }, status_code=error.status_code, headers={'Retry-After': '1'})
+
+
+async def read_chat_request(request):
+    """(message, username, session id) of a chat request, or None if the body has no message"""
+    try:
+        with span('parse'):
+            data = await request.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'message' not in data:
+        return None
+    return data['message'], data.get('username', 'User'), data.get('sessionId')
+
+
+@instrumented('/api/chat')
+async def chat_endpoint(request):
+    """Async version of app.chat_endpoint with the same request and response format"""
+    chat_request = await read_chat_request(request)
+    if chat_request is None:
+        return JSONResponse({'error': 'Message is required'}, status_code=400)
+    user_message, username, session_id = chat_request
+    logger.info(f"Received message from {username}: {user_message}")
+
+    messages, cache_key, cached_response = await asyncio.to_thread(
+        flask_app.prepare_chat, user_message, username, session_id)
+    if cached_response is not None:
+        logger.info(f"Cached response served for {username}")
+        await asyncio.to_thread(flask_app.remember_response, cache_key, username, session_id, user_message,
+                                cached_response, cached=True)
+        return JSONResponse({'success': True, 'response': cached_response, 'cached': True})
+
+    try:
+        await limiter.acquire()
+    except ChatOverloaded as e:
+        return overloaded_response(e)
+    try:
+        with span('llm'):
+            llm_start = time.perf_counter()
+            jarvis_response = await llm_backend.acomplete(messages, flask_app.CHAT_TEMPERATURE,
+                                                          flask_app.CHAT_MAX_TOKENS)
+        UPSTREAM_LATENCY.labels(llm_backend.name, 'complete').observe(time.perf_counter() - llm_start)
+    except Exception as e:
+        logger.error(f"LLM call failed: {str(e)}")
+        return JSONResponse({
+            'success': False,
+            'error': "Unable to connect to JARVIS systems. Please try again."
+        }, status_code=503)
+    finally:
+        limiter.release()
+
+    logger.info(f"LLM response generated for {username}")
+    if jarvis_response:
+        await asyncio.to_thread(flask_app.remember_response, cache_key, username, session_id, user_message,
+                                jarvis_response)
+    with span('serialize'):
+        return JSONResponse({
+            'success': True,
+            'response': jarvis_response
+        })
+
+
+@instrumented('/api/chat/stream')
+async def chat_stream_endpoint(request):
+    """Async version of app.chat_stream_endpoint; the slot is held until the stream ends"""
+    chat_request = await read_chat_request(request)
+    if chat_request is None:
+        return JSONResponse({'error': 'Message is required'}, status_code=400)
+    user_message, username, session_id = chat_request
+    logger.info(f"Received streaming message from {username}: {user_message}")
+
+    messages, cache_key, cached_response = await asyncio.to_thread(
+        flask_app.prepare_chat, user_message, username, session_id)
+    if cached_response is not None:
+        logger.info(f"Cached response served for {username}")
+        await asyncio.to_thread(flask_app.remember_response, cache_key, username, session_id, user_message,
+                                cached_response, cached=True)
+        return event_stream_response(iter([
+            flask_app.sse_event({'delta': cached_response}),
+            flask_app.sse_event({'success': True, 'cached': True}, event='done')
+        ]))
+
+    try:
+        await limiter.acquire()
+    except ChatOverloaded as e:
+        return overloaded_response(e)
+    llm_start = time.perf_counter()
+    deltas = llm_backend.astream(messages, flask_app.CHAT_TEMPERATURE, flask_app.CHAT_MAX_TOKENS)
+    try:
+        with span('llm_first_token'):
+            first_delta = await anext(deltas, None)
+        UPSTREAM_LATENCY.labels(llm_backend.name, 'first_token').observe(time.perf_counter() - llm_start)
+    except BaseException as e:
+        limiter.release()
+        await deltas.aclose()
+        if not isinstance(e, Exception):
+            raise
+        logger.error(f"LLM call failed: {str(e)}")
+        return JSONResponse({
+            'success': False,
+            'error': "Unable to connect to JARVIS systems. Please try again."
+        }, status_code=503)
+
+    async def generate():
+        parts = []
+        try:
+            if first_delta is not None:
+                parts.append(first_delta)
+                yield flask_app.sse_event({'delta': first_delta})
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield flask_app.sse_event({'delta': delta})
+            UPSTREAM_LATENCY.labels(llm_backend.name, 'stream').observe(time.perf_counter() - llm_start)
+            logger.info(f"LLM response streamed for {username}")
+            if parts:
+                await asyncio.to_thread(flask_app.remember_response, cache_key, username, session_id,
+                                        user_message, ''.join(parts))
+            yield flask_app.sse_event({'success': True}, event='done')
+        except Exception as e:
+            logger.error(f"LLM stream failed: {str(e)}")
+            observe_stream_error('/api/chat/stream')
+            yield flask_app.sse_event({
+                'success': False,
+                'error': "Unable to connect to JARVIS systems. Please try again."
+            }, event='error')
+
+    return event_stream_response(generate(), limiter, deltas)
+
+
+EVENT_STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+
+def event_stream_response(events, limiter=None, upstream=None):
+    """Server-sent events response; with a limiter, its slot is released once the response ends"""
+    if limiter is not None:
+        return SlotStreamingResponse(events, limiter, upstream, media_type='text/event-stream',
+                                     headers=EVENT_STREAM_HEADERS)
+    return StreamingResponse(events, media_type='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+
+async def health_check(request):
+    """Health check endpoint, with the chat limiter's load"""
+    return JSONResponse({
+        'status': 'healthy',
+        'groq_configured': bool(flask_app.GROQ_API_KEY),
+        'llm_backend': llm_backend.name,
+        'recognition_configured': flask_app.recognizer is not None,
+        'gallery_size': len(flask_app.gallery) if flask_app.gallery is not None else 0,
+        'chat_in_flight': limiter.in_flight,
+        'chat_waiting': limiter.waiting,
+        'chat_max_concurrency': limiter.max_concurrency,
+        'response_cache': response_cache.stats() if response_cache else None,
+        'conversations': flask_app.conversation_store.stats()
+    })
+
+
+app = Starlette(routes=[
+    Route('/api/chat', chat_endpoint, methods=['POST']),
+    Route('/api/chat/stream', chat_stream_endpoint, methods=['POST']),
+    Route('/health', health_check),
+    # Pages, static files, face recognition and /metrics stay on Flask, run in a thread pool
+    Mount('/', app=WSGIMiddleware(flask_app.app)),
+], lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
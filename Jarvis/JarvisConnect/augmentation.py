@@ -2,20 +2,61 @@ import os
 import cv2
 import albumentations as A
 import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def augment_and_save(processed_folder, augmented_folder, num_augmentations_per_image=10):
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Supported output formats: extension and the OpenCV quality/compression flag
+OUTPUT_FORMATS = {
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+}
+QUALITY_FLAGS = dict(OUTPUT_FORMATS.values(), **{'.jpeg': cv2.IMWRITE_JPEG_QUALITY})
+# Valid range of each flag: JPEG/WebP quality is 0-100, PNG compression is a zlib level 0-9
+QUALITY_RANGES = {
+    cv2.IMWRITE_JPEG_QUALITY: (0, 100),
+    cv2.IMWRITE_WEBP_QUALITY: (1, 100),
+    cv2.IMWRITE_PNG_COMPRESSION: (0, 9),
+}
+
+
+def quality_params(extension, quality):
     """
-    Applies data augmentation to preprocessed images and saves them.
+    cv2.imencode parameters for a quality setting.
+
+    Quality is always on the 0-100 scale, so one setting works when a folder mixes formats.
+    For PNG, which is lossless, it is mapped to a compression level from 9 (quality 0,
+    smallest files) to 0 (quality 100, fastest encode).
 
     Args:
-        processed_folder (str): The path to the folder containing the preprocessed images.
-                                 (e.g., 'path/to/processed/dataset')
-        augmented_folder (str): The path where augmented images will be saved.
-        num_augmentations_per_image (int): The number of augmented versions to create for each original image.
+        extension (str): Output extension, e.g. '.jpg'.
+        quality (int): Quality from 0 to 100, or None for OpenCV's default.
+
+    Returns:
+        list: [flag, value], or [] for the default.
+    """
+    if quality is None or extension not in QUALITY_FLAGS:
+        return []
+    flag = QUALITY_FLAGS[extension]
+    quality = int(quality)
+    if not 0 <= quality <= 100:
+        raise ValueError(f"quality must be between 0 and 100, got {quality}")
+    if flag == cv2.IMWRITE_PNG_COMPRESSION:
+        return [flag, round((100 - quality) * 9 / 100)]
+    low, high = QUALITY_RANGES[flag]
+    return [flag, min(max(quality, low), high)]
+
+
+def build_augmentation_transforms():
+    """
+    Returns the list of geometric and photometric augmentations used for the face dataset.
+    Shared by augment_and_save and the on-the-fly AugmentedFaceDataset.
     """
-    # Define the augmentation pipeline ✨
     # These transformations are well-suited for face recognition tasks.
-    transform = A.Compose([
+    return [
         A.HorizontalFlip(p=0.5),
         A.ShiftScaleRotate(shift_limit=0.05, scale_limit=0.1, rotate_limit=15, p=0.7),
         A.RandomBrightnessContrast(brightness_limit=0.2, contrast_limit=0.2, p=0.8),
@@ -24,66 +65,216 @@ def augment_and_save(processed_folder, augmented_folder, num_augmentations_per_i
             A.GaussianBlur(p=0.5),
             A.MotionBlur(p=0.5),
         ], p=0.2),
-        # Ensure the output is always a valid image for saving
-        A.Normalize(mean=(0.485, 0.456, 0.406),std=(0.229, 0.224, 0.225)),
-        A.ToFloat(max_value=255.0)
-    ])
+    ]
+
+
+class ImageWriter:
+    """
+    Encodes and writes images on a thread pool. OpenCV releases the GIL while encoding,
+    so encodes of a batch run in parallel with the augmentation of the next one.
+
+    Args:
+        output_format (str): One of OUTPUT_FORMATS, or None to keep the extension of each output path.
+        quality (int): Quality from 0 to 100 (see quality_params). None uses OpenCV's default.
+        num_threads (int): Size of the encoding thread pool. Defaults to the number of CPUs.
+        max_pending (int): Maximum number of batches queued before submit() blocks, bounds memory use.
+    """
+
+    def __init__(self, output_format=None, quality=None, num_threads=None, max_pending=64):
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format '{output_format}', expected one of {sorted(OUTPUT_FORMATS)}")
+        # Fails here rather than on the first encode
+        quality_params('.jpg', quality)
+        self.output_format = output_format
+        self.quality = quality
+        self.max_pending = max_pending
+        self.images_written = 0
+        self._executor = ThreadPoolExecutor(max_workers=num_threads or os.cpu_count())
+        self._pending = deque()
+
+    def output_path(self, path):
+        """Apply the configured output format to a destination path"""
+        if self.output_format is None:
+            return path
+        return os.path.splitext(path)[0] + OUTPUT_FORMATS[self.output_format][0]
+
+    def submit(self, batch):
+        """Queue a list of (path, image) pairs for encoding"""
+        self._pending.append(self._executor.submit(self._write_batch, batch))
+        while len(self._pending) > self.max_pending:
+            self.images_written += self._pending.popleft().result()
+
+    def close(self):
+        """Wait for all queued batches and stop the thread pool"""
+        try:
+            while self._pending:
+                self.images_written += self._pending.popleft().result()
+        finally:
+            # After a failed batch, the batches still queued are dropped instead of written
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_batch(self, batch):
+        for path, image in batch:
+            extension = os.path.splitext(path)[1].lower()
+            success, buffer = cv2.imencode(extension, image, quality_params(extension, self.quality))
+            if not success:
+                raise RuntimeError(f"Could not encode {path}")
+            buffer.tofile(path)
+        return len(batch)
 
-    print(f"Starting augmentation. Each image will be augmented {num_augmentations_per_image} times.")
+
+def compute_augmentation_budget(class_counts, target_per_class, max_per_image=None):
+    """
+    Number of augmentations each class needs to reach target_per_class images, originals
+    included. Classes that already have that many images get none, so the dataset grows
+    with the number of classes rather than with the raw image count.
+
+    Args:
+        class_counts (dict): Number of original images per class.
+        target_per_class (int): Wanted number of images per class.
+        max_per_image (int): Optional cap on the augmentations made from a single image, so
+                             that a class with very few images is not filled with
+                             near-copies of them.
+
+    Returns:
+        dict: Number of augmentations per class.
+    """
+    budget = {}
+    for class_name, count in class_counts.items():
+        needed = max(0, target_per_class - count)
+        if max_per_image is not None:
+            needed = min(needed, count * max_per_image)
+        budget[class_name] = needed
+    return budget
+
+
+def spread_budget(num_augmentations, num_images):
+    """Split a class's augmentations over its images as evenly as possible"""
+    if num_images == 0:
+        return []
+    base, remainder = divmod(num_augmentations, num_images)
+    return [base + (i < remainder) for i in range(num_images)]
+
+
+def augment_and_save(processed_folder, augmented_folder, num_augmentations_per_image=10,
+                     output_format=None, quality=None, num_threads=None, celebrities=None,
+                     target_per_class=None, holdout=None):
+    """
+    Applies data augmentation to preprocessed images and saves them.
+
+    This materializes every augmented variant on disk. For training, prefer
+    augmented_dataset.AugmentedFaceDataset, which applies the same pipeline on the fly.
+
+    Args:
+        processed_folder (str): The path to the folder containing the preprocessed images.
+                                 (e.g., 'path/to/processed/dataset')
+        augmented_folder (str): The path where augmented images will be saved.
+        num_augmentations_per_image (int): The number of augmented versions to create for each original image.
+        output_format (str): 'jpg', 'webp' or 'png'. None keeps the extension of each source image.
+        quality (int): Quality from 0 to 100, also mapped to PNG compression. None uses OpenCV's default.
+        num_threads (int): Number of encoding threads. Defaults to the number of CPUs.
+        celebrities (list): Only augment these sub-folders.
+        target_per_class (int): Class-balanced mode. The training images of every class (those
+                                not held out) are augmented up to this many images (see
+                                compute_augmentation_budget) and
+                                num_augmentations_per_image becomes the cap per image.
+        holdout (callable): Optional predicate on source image paths. Matching images (e.g. the
+                            validation split) are copied as-is and never augmented.
+
+    Returns:
+        list: Paths of every image written (originals and augmentations).
+    """
+    # Define the augmentation pipeline ✨
+    # Everything stays in uint8 so the result can be encoded as-is
+    transform = A.Compose(build_augmentation_transforms())
+
+    if target_per_class is None:
+        print(f"Starting augmentation. Each image will be augmented {num_augmentations_per_image} times.")
+    else:
+        print(f"Starting augmentation. Each class will be augmented up to {target_per_class} images "
+              f"(at most {num_augmentations_per_image} augmentations per image).")
 
     # Ensure the main augmented directory exists
     os.makedirs(augmented_folder, exist_ok=True)
 
     total_original_images = 0
-    total_augmented_images = 0
+    written_paths = []
+    start_time = time.time()
 
-    # Iterate through each celebrity's folder in the processed dataset
-    for celebrity_folder in os.listdir(processed_folder):
-        celebrity_path_in = os.path.join(processed_folder, celebrity_folder)
-        celebrity_path_out = os.path.join(augmented_folder, celebrity_folder)
+    with ImageWriter(output_format, quality, num_threads) as writer:
+        # Iterate through each celebrity's folder in the processed dataset
+        for celebrity_folder in (os.listdir(processed_folder) if celebrities is None else celebrities):
+            celebrity_path_in = os.path.join(processed_folder, celebrity_folder)
+            celebrity_path_out = os.path.join(augmented_folder, celebrity_folder)
 
-        if not os.path.isdir(celebrity_path_in):
-            continue
+            if not os.path.isdir(celebrity_path_in):
+                continue
 
-        os.makedirs(celebrity_path_out, exist_ok=True)
+            os.makedirs(celebrity_path_out, exist_ok=True)
 
-        print(f"Processing folder: {celebrity_folder}")
+            img_files = sorted(f for f in os.listdir(celebrity_path_in) if f.lower().endswith(IMAGE_EXTENSIONS))
+            # Held-out images are copied but get no augmentations, and do not count towards the budget
+            augmented = [holdout is None or not holdout(os.path.join(celebrity_path_in, f)) for f in img_files]
+            num_augmented = sum(augmented)
+            if target_per_class is None:
+                shares = [num_augmentations_per_image] * num_augmented
+            else:
+                budget = compute_augmentation_budget({celebrity_folder: num_augmented}, target_per_class,
+                                                     num_augmentations_per_image)[celebrity_folder]
+                shares = spread_budget(budget, num_augmented)
+            shares = iter(shares)
+            augmentations = [next(shares) if is_augmented else 0 for is_augmented in augmented]
 
-        # Iterate through each preprocessed image
-        for img_file in os.listdir(celebrity_path_in):
-            img_path = os.path.join(celebrity_path_in, img_file)
+            print(f"Processing folder: {celebrity_folder} ({len(img_files)} images, "
+                  f"{sum(augmentations)} augmentations)")
 
-            # Read the image
-            image = cv2.imread(img_path)
-            if image is None:
-                continue
+            # Iterate through each preprocessed image
+            for img_file, num_augmentations in zip(img_files, augmentations):
+                img_path = os.path.join(celebrity_path_in, img_file)
 
-            total_original_images += 1
+                # Read the image
+                image = cv2.imread(img_path)
+                if image is None:
+                    continue
 
-            # --- Save the original image in the new directory ---
-            # This is good practice to have both original and augmented in one place
-            original_save_path = os.path.join(celebrity_path_out, img_file)
-            cv2.imwrite(original_save_path, image)
-            total_augmented_images += 1
+                total_original_images += 1
 
-            # --- Create and save augmented versions ---
-            for i in range(num_augmentations_per_image):
-                # Apply the transformations
-                augmented = transform(image=image)
-                augmented_image = (augmented['image'] * 255).astype('uint8')  # Convert back to uint8 for saving
+                # --- Save the original image in the new directory ---
+                # This is good practice to have both original and augmented in one place
+                original_save_path = writer.output_path(os.path.join(celebrity_path_out, img_file))
+                batch = [(original_save_path, image)]
 
-                # Create a new filename for the augmented image
+                # --- Create augmented versions, encoded together on the writer's threads ---
                 base_name, extension = os.path.splitext(img_file)
-                new_filename = f"{base_name}_aug_{i}{extension}"
-                output_path = os.path.join(celebrity_path_out, new_filename)
+                for i in range(num_augmentations):
+                    # Apply the transformations
+                    augmented_image = transform(image=image)['image']
+
+                    # Create a new filename for the augmented image
+                    new_filename = f"{base_name}_aug_{i}{extension}"
+                    output_path = writer.output_path(os.path.join(celebrity_path_out, new_filename))
+                    batch.append((output_path, augmented_image))
+
+                writer.submit(batch)
+                written_paths.extend(path for path, _ in batch)
 
-                # Save the new image
-                cv2.imwrite(output_path, augmented_image)
-                total_augmented_images += 1
+    elapsed = time.time() - start_time
+    total_augmented_images = writer.images_written
 
     print("\n--- Augmentation Complete! ---")
     print(f"Total original images processed: {total_original_images}")
     print(f"Total images in augmented dataset (originals + augmentations): {total_augmented_images}")
+    print(f"Wrote {total_augmented_images / max(elapsed, 1e-9):.1f} images/sec ({elapsed:.2f}s)")
+    return written_paths
 
 
 # --- How to use it ---
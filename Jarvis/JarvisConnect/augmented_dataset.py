@@ -0,0 +1,111 @@
+import os
+import random
+import cv2
+import numpy as np
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+from torch.utils.data import Dataset
+from augmentation import build_augmentation_transforms
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class AugmentedFaceDataset(Dataset):
+    """
+    Applies the augmentation pipeline from augmentation.py on the fly, inside the DataLoader
+    workers, instead of reading a materialized augmented_data folder.
+
+    The folder layout is the same as torchvision's ImageFolder (one sub-folder per celebrity)
+    and so are the `classes`, `class_to_idx` and `targets` attributes.
+
+    Every sample draws its augmentation from a seed derived from (seed, epoch, index), so a
+    given epoch is reproducible regardless of the number of workers or their scheduling.
+    Call `set_epoch` before iterating a new epoch (this does not reach workers that were
+    created with persistent_workers=True).
+
+    Args:
+        root (str): Folder with one sub-folder of preprocessed faces per celebrity.
+        samples_per_image (int): How many augmented samples every source image contributes per epoch.
+                                 10 matches the size of augment_and_save's output with 9 augmentations.
+        image_size (tuple): (height, width) of the produced tensors.
+        seed (int): Base seed for the augmentation stream.
+        target_per_class (int): Class-balanced mode, replaces samples_per_image. Every class
+                                contributes exactly this many samples per epoch. Small classes
+                                repeat their images under different augmentations, and large
+                                ones show a different subset every epoch. An epoch then costs
+                                the same for every class, however many raw images it has.
+    """
+
+    def __init__(self, root, samples_per_image=1, image_size=(224, 224), seed=0, target_per_class=None):
+        self.root = root
+        self.samples_per_image = samples_per_image
+        self.target_per_class = target_per_class
+        self.image_size = tuple(image_size)
+        self.seed = seed
+        self.epoch = 0
+
+        self.classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.classes)}
+        self.samples = []
+        for class_name in self.classes:
+            class_path = os.path.join(root, class_name)
+            for img_file in sorted(os.listdir(class_path)):
+                if img_file.lower().endswith(IMAGE_EXTENSIONS):
+                    self.samples.append((os.path.join(class_path, img_file), self.class_to_idx[class_name]))
+        self.targets = [label for _, label in self.samples]
+
+        if target_per_class is not None:
+            # Indices into self.samples of every class, in class order
+            self.class_samples = [[] for _ in self.classes]
+            for sample_idx, (_, label) in enumerate(self.samples):
+                self.class_samples[label].append(sample_idx)
+            empty = [self.classes[label] for label, members in enumerate(self.class_samples) if not members]
+            if empty:
+                raise ValueError(f"Classes without images cannot be balanced: {empty}")
+            self.targets = [label for label in range(len(self.classes)) for _ in range(target_per_class)]
+
+        self.transform = A.Compose(build_augmentation_transforms() + [
+            A.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+            ToTensorV2(),
+        ])
+
+    def __len__(self):
+        if self.target_per_class is not None:
+            return len(self.classes) * self.target_per_class
+        return len(self.samples) * self.samples_per_image
+
+    def set_epoch(self, epoch):
+        """Select the augmentation stream of the given epoch"""
+        self.epoch = epoch
+
+    def sample_seed(self, index):
+        """Seed of the augmentation applied to sample `index` in the current epoch"""
+        return int(np.random.SeedSequence([self.seed, self.epoch, index]).generate_state(1)[0])
+
+    def __getitem__(self, index):
+        if self.target_per_class is not None:
+            label, position = divmod(index, self.target_per_class)
+            members = self.class_samples[label]
+            # Rotating the start every epoch lets large classes cycle through all their images
+            img_path, label = self.samples[members[(self.epoch * self.target_per_class + position) % len(members)]]
+        else:
+            img_path, label = self.samples[index % len(self.samples)]
+
+        image = cv2.imread(img_path)
+        if image is None:
+            raise RuntimeError(f"Could not read image {img_path}")
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if image.shape[:2] != self.image_size:
+            image = cv2.resize(image, (self.image_size[1], self.image_size[0]))
+
+        seed = self.sample_seed(index)
+        if hasattr(self.transform, 'set_random_seed'):
+            self.transform.set_random_seed(seed)
+        else:
+            # Older albumentations draw from the global generators
+            random.seed(seed)
+            np.random.seed(seed)
+
+        return self.transform(image=image)['image'], label
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import numpy as np
+
+# Each mode runs in a fresh process so that its peak RSS is not inflated by the other one
+MODES = ('full_decode', 'reduced_decode')
+
+
+def collect_images(dataset_folder, limit=None):
+    from preprocessing import IMAGE_EXTENSIONS
+
+    paths = []
+    for root, _, files in os.walk(dataset_folder):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, file_name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_mode(mode, dataset_folder, target_size, limit=None, detection_size=None):
+    """Time process_single_image over the dataset in the current process"""
+    import preprocessing
+
+    if mode == 'full_decode':
+        detection_size = None
+    else:
+        detection_size = detection_size or preprocessing.DETECTION_SIZE
+    paths = collect_images(dataset_folder, limit)
+    preprocessing._init_face_detection()
+    face_detection = preprocessing._face_detection
+
+    # Warm up the detector so model loading is not counted as per-image latency
+    preprocessing.process_single_image(paths[0], target_size, face_detection, detection_size)
+    baseline_rss = peak_rss_mb()
+
+    latencies, faces = [], 0
+    for path in paths:
+        start = time.perf_counter()
+        face = preprocessing.process_single_image(path, target_size, face_detection, detection_size)
+        latencies.append(time.perf_counter() - start)
+        faces += face is not None
+    preprocessing._close_face_detection()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'mode': mode,
+        'images': len(paths),
+        'faces': int(faces),
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'images_per_sec': float(len(paths) / latencies_ms.sum() * 1000),
+        'rss_after_warmup_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def benchmark(dataset_folder, target_size=(224, 224), limit=None, detection_size=None, output_path=None):
+    """
+    Compare per-image latency and peak memory of preprocessing with full-resolution decoding
+    against reduced-resolution decoding for detection.
+
+    Args:
+        dataset_folder (str): Folder searched recursively for images.
+        target_size (tuple): (width, height) of the face crops.
+        limit (int): Use at most this many images.
+        detection_size (int): Override preprocessing.DETECTION_SIZE for the reduced mode.
+        output_path (str): Optional JSON file for the results.
+
+    Returns:
+        list: One result dict per mode.
+    """
+    if not collect_images(dataset_folder, limit):
+        raise ValueError(f"No images found in {dataset_folder}")
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, os.path.abspath(__file__), dataset_folder, '--worker', mode,
+                   '--target-size', str(target_size[0]), str(target_size[1])]
+        if limit:
+            command += ['--limit', str(limit)]
+        if detection_size:
+            command += ['--detection-size', str(detection_size)]
+        print(f"Running {mode}...")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<16}{'images':>8}{'faces':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'img/s':>10}"
+          f"{'peak MB':>10}")
+    for r in results:
+        print(f"{r['mode']:<16}{r['images']:>8}{r['faces']:>8}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}"
+              f"{r['p95_ms']:>10.2f}{r['images_per_sec']:>10.1f}{r['peak_rss_mb']:>10.1f}")
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark face preprocessing with full and reduced JPEG decoding.")
+    parser.add_argument('dataset_folder', help="Folder with raw images (searched recursively)")
+    parser.add_argument('--target-size', type=int, nargs=2, default=(224, 224), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--limit', type=int, default=None, help="Use at most this many images")
+    parser.add_argument('--detection-size', type=int, default=None,
+                        help="Longer side for reduced decoding (defaults to preprocessing.DETECTION_SIZE)")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--worker', choices=MODES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_mode(args.worker, args.dataset_folder, tuple(args.target_size), args.limit,
+                                  args.detection_size)))
+    else:
+        benchmark(args.dataset_folder, tuple(args.target_size), args.limit, args.detection_size, args.output)
@@ -0,0 +1,140 @@
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+
+# Rough token count without a tokenizer: about four characters per token for English text
+CHARS_PER_TOKEN = 4
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def summarize_turn(role, content, max_chars=160):
+    """One-line extractive summary of a turn: its first sentence, shortened to max_chars"""
+    first_sentence = _SENTENCE_END.split(content.strip(), 1)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars - 3].rstrip() + '...'
+    speaker = 'User' if role == 'user' else 'JARVIS'
+    return f"{speaker}: {first_sentence}"
+
+
+class Conversation:
+    """Recent turns of one session plus a bounded summary of the turns that no longer fit"""
+
+    __slots__ = ('turns', 'history_tokens', 'summary', 'last_active')
+
+    def __init__(self):
+        # (role, content, tokens) tuples, oldest first
+        self.turns = deque()
+        self.history_tokens = 0
+        self.summary = deque()
+        self.last_active = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Server-side chat history, kept per session and bounded in size and lifetime.
+
+    Every session holds its most recent turns, and their total size stays within
+    history_tokens. Older turns are folded into a short extractive summary, which is also
+    capped. The context for a request is therefore at most the system prompt, the summary,
+    history_tokens of recent turns and the new message, however long the conversation gets.
+    Sessions idle for longer than idle_timeout are dropped, and beyond max_sessions the
+    least recently active session is evicted.
+
+    Args:
+        history_tokens (int): Token budget for verbatim recent turns.
+        summary_tokens (int): Token budget for the summary of older turns.
+        max_turns (int): Upper bound on verbatim turns, whatever their size.
+        idle_timeout (float): Seconds of inactivity after which a session is dropped.
+        max_sessions (int): Sessions kept at once.
+    """
+
+    def __init__(self, history_tokens=1536, summary_tokens=256, max_turns=40, idle_timeout=1800, max_sessions=10000):
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turns = max_turns
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _get(self, session_id, create=False):
+        conversation = self._sessions.get(session_id)
+        now = time.monotonic()
+        if conversation is not None and now - conversation.last_active > self.idle_timeout:
+            del self._sessions[session_id]
+            conversation = None
+        if conversation is None and create:
+            conversation = Conversation()
+            self._sessions[session_id] = conversation
+            self._evict(now)
+        if conversation is not None:
+            conversation.last_active = now
+            self._sessions.move_to_end(session_id)
+        return conversation
+
+    def _evict(self, now):
+        # Sessions are ordered by last activity, so idle ones are at the front
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - conversation.last_active > self.idle_timeout:
+                del self._sessions[session_id]
+            else:
+                break
+
+    def build_messages(self, session_id, system_prompt, user_message):
+        """
+        Chat completion messages for a new user message: the system prompt, the summary of
+        older turns, the recent turns and the new message.
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        with self._lock:
+            conversation = self._get(session_id)
+            if conversation is not None:
+                if conversation.summary:
+                    messages.append({
+                        "role": "system",
+                        "content": "Summary of the earlier conversation:\n" + "\n".join(conversation.summary)
+                    })
+                messages.extend({"role": role, "content": content} for role, content, _ in conversation.turns)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def add_exchange(self, session_id, user_message, response):
+        """Record a user message and JARVIS's response"""
+        with self._lock:
+            conversation = self._get(session_id, create=True)
+            for role, content in (("user", user_message), ("assistant", response)):
+                tokens = estimate_tokens(content)
+                conversation.turns.append((role, content, tokens))
+                conversation.history_tokens += tokens
+            while conversation.turns and (conversation.history_tokens > self.history_tokens
+                                          or len(conversation.turns) > self.max_turns):
+                role, content, tokens = conversation.turns.popleft()
+                conversation.history_tokens -= tokens
+                self._add_to_summary(conversation, summarize_turn(role, content))
+
+    def _add_to_summary(self, conversation, line):
+        conversation.summary.append(line)
+        # Keep the newest summary lines within the summary budget
+        while sum(estimate_tokens(l) for l in conversation.summary) > self.summary_tokens:
+            conversation.summary.popleft()
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                'sessions': len(self._sessions),
+                'turns': sum(len(c.turns) for c in self._sessions.values())
+            }
@@ -0,0 +1,312 @@
+import os
+import argparse
+import time
+import cv2
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+HASH_BITS = 64
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Number of set bits for every byte value, used when np.bitwise_count is unavailable
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _pack_bits(bits):
+    """Pack 64 boolean values into a single Python int (first bit is the most significant)"""
+    return int(np.packbits(bits.ravel().astype(np.uint8)).view('>u8')[0])
+
+
+def _to_gray(image):
+    # Ensure image is uint8 for proper hashing
+    if image.dtype == np.float32:
+        image = (image * 255).astype(np.uint8)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def average_hash(image):
+    """aHash: 8x8 grayscale thumbnail thresholded at its mean"""
+    resized = cv2.resize(_to_gray(image), (8, 8))
+    return _pack_bits(resized > resized.mean())
+
+
+def difference_hash(image):
+    """dHash: sign of the horizontal gradient on a 9x8 grayscale thumbnail"""
+    resized = cv2.resize(_to_gray(image), (9, 8))
+    return _pack_bits(resized[:, 1:] > resized[:, :-1])
+
+
+def perceptual_hash(image):
+    """pHash: low-frequency 8x8 DCT coefficients thresholded at their median"""
+    resized = cv2.resize(_to_gray(image), (32, 32)).astype(np.float32)
+    low_freq = cv2.dct(resized)[:8, :8]
+    return _pack_bits(low_freq > np.median(low_freq))
+
+
+HASH_FUNCTIONS = {
+    'ahash': average_hash,
+    'dhash': difference_hash,
+    'phash': perceptual_hash,
+}
+
+
+def compute_hashes(images, method='phash'):
+    """Hash a sequence of images into a packed uint64 array"""
+    hash_fn = HASH_FUNCTIONS[method]
+    return np.fromiter((hash_fn(img) for img in images), dtype=np.uint64, count=len(images))
+
+
+def popcount64(values):
+    """Number of set bits of every element of a uint64 array"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distance(a, b):
+    """Element-wise Hamming distance between packed hashes (broadcasts like ^)"""
+    return popcount64(np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)))
+
+
+def _chunk_layout(radius):
+    """
+    Split the hash into radius + 1 disjoint bit ranges for multi-index hashing.
+
+    By the pigeonhole principle two hashes within `radius` bits of each other agree
+    exactly on at least one of the ranges, so exact lookups on the chunks find every
+    candidate.
+    """
+    num_chunks = min(radius + 1, HASH_BITS)
+    bounds = np.linspace(0, HASH_BITS, num_chunks + 1).astype(int)
+    return [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+class HashIndex:
+    """
+    Incremental multi-index hash table over packed 64-bit perceptual hashes.
+
+    Hashes are kept in a growing NumPy array; every hash is also bucketed by each of
+    its chunks so `query` only verifies a handful of candidates instead of the whole set.
+    """
+
+    def __init__(self, radius=0, capacity=1024):
+        self.radius = radius
+        self._chunks = _chunk_layout(radius)
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, value):
+        return len(self.query(value)) > 0
+
+    @property
+    def hashes(self):
+        return self._hashes[:self._size]
+
+    def add(self, value):
+        """Insert a hash and return its id"""
+        value = int(value)
+        if self._size == len(self._hashes):
+            self._hashes = np.resize(self._hashes, 2 * len(self._hashes))
+        idx = self._size
+        self._hashes[idx] = value
+        self._size += 1
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value >> shift) & mask, []).append(idx)
+        return idx
+
+    def query(self, value):
+        """Ids of all stored hashes within `radius` bits of `value`"""
+        value = int(value)
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        return ids[hamming_distance(self._hashes[ids], value) <= self.radius]
+
+
+def find_hash_pairs(hashes, radius, block_size=2048):
+    """
+    Find every pair of hashes within `radius` bits using vectorized multi-index hashing.
+
+    Args:
+        hashes (np.ndarray): Packed uint64 hashes.
+        radius (int): Maximum Hamming distance of a near-duplicate pair.
+        block_size (int): Rows compared at once inside a bucket, bounds memory use.
+
+    Returns:
+        np.ndarray: (num_pairs, 2) array of index pairs with i < j. A pair may appear more than once.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    pairs = []
+    for shift, mask in _chunk_layout(radius):
+        keys = (hashes >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+        ends = np.append(starts[1:], len(order))
+
+        # Only buckets holding at least two hashes can produce pairs
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            ids = np.sort(order[start:end])
+            bucket = hashes[ids]
+            for row in range(0, len(ids), block_size):
+                distances = hamming_distance(bucket[row:row + block_size, None], bucket[None, :])
+                i, j = np.nonzero(distances <= radius)
+                i += row
+                upper = j > i
+                pairs.append(np.stack([ids[i[upper]], ids[j[upper]]], axis=1))
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+def cosine_similarity_pairs(features, min_similarity, block_size=2048):
+    """
+    Find every pair of feature vectors with cosine similarity >= min_similarity.
+
+    The similarity matrix is computed in row blocks with a single matrix product each,
+    so memory stays at block_size x N floats.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    features = features / np.maximum(norms, 1e-12)
+
+    pairs = []
+    for row in range(0, len(features), block_size):
+        # Only compare against later rows, the matrix is symmetric
+        similarities = features[row:row + block_size] @ features[row:].T
+        i, j = np.nonzero(similarities >= min_similarity)
+        i += row
+        j += row
+        upper = j > i
+        pairs.append(np.stack([i[upper], j[upper]], axis=1))
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+def group_duplicates(num_items, pairs):
+    """Label every item with the connected component it belongs to in the duplicate graph"""
+    if len(pairs) == 0:
+        return np.arange(num_items)
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                       shape=(num_items, num_items))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def first_in_group(labels):
+    """Boolean mask keeping the first item of every duplicate group"""
+    keep = np.zeros(len(labels), dtype=bool)
+    _, first = np.unique(labels, return_index=True)
+    keep[first] = True
+    return keep
+
+
+def histogram_features(images):
+    """Stack 512-bin BGR color histograms of a sequence of images into a matrix"""
+    features = np.empty((len(images), 512), dtype=np.float32)
+    for i, img in enumerate(images):
+        # Ensure image is uint8 for histogram calculation
+        if img.dtype == np.float32:
+            img = (img * 255).astype(np.uint8)
+        features[i] = cv2.calcHist([img], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256]).ravel()
+    return features
+
+
+def dedup_dataset(dataset_folder, method='phash', radius=4, cross_class=False, min_similarity=None,
+                  celebrities=None):
+    """
+    Find near-duplicate faces in a processed dataset (one sub-folder per celebrity).
+
+    Args:
+        dataset_folder (str): The processed dataset folder.
+        method (str): Hash function, one of HASH_FUNCTIONS.
+        radius (int): Maximum Hamming distance between near-duplicate hashes.
+        cross_class (bool): Also treat matches between different celebrities as duplicates.
+                            When False they are only reported as conflicts.
+        min_similarity (float): If set, histogram cosine similarity at or above this value
+                                also marks a pair as duplicate.
+        celebrities (list): Only look at these sub-folders.
+
+    Returns:
+        dict: 'duplicates' (paths that can be removed) and 'conflicts'
+              (path pairs that look identical but are labelled as different celebrities).
+    """
+    paths, labels = [], []
+    for celebrity_folder in sorted(os.listdir(dataset_folder) if celebrities is None else celebrities):
+        celebrity_path = os.path.join(dataset_folder, celebrity_folder)
+        if not os.path.isdir(celebrity_path):
+            continue
+        for img_file in sorted(os.listdir(celebrity_path)):
+            if img_file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(celebrity_path, img_file))
+                labels.append(celebrity_folder)
+
+    # Hash (and featurize) one image at a time so the dataset never has to fit in memory
+    hash_fn = HASH_FUNCTIONS[method]
+    kept_paths, kept_labels, hashes, features = [], [], [], []
+    for path, label in zip(paths, labels):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        kept_paths.append(path)
+        kept_labels.append(label)
+        hashes.append(hash_fn(img))
+        if min_similarity is not None:
+            features.append(histogram_features([img])[0])
+    paths = kept_paths
+    labels = np.array(kept_labels)
+
+    pairs = find_hash_pairs(np.array(hashes, dtype=np.uint64), radius)
+    if min_similarity is not None and features:
+        pairs = np.concatenate([pairs, cosine_similarity_pairs(np.stack(features), min_similarity)])
+
+    same_class = labels[pairs[:, 0]] == labels[pairs[:, 1]]
+    conflicts = {(paths[i], paths[j]) for i, j in pairs[~same_class]}
+    if not cross_class:
+        pairs = pairs[same_class]
+
+    keep = first_in_group(group_duplicates(len(paths), pairs))
+    return {
+        'duplicates': [path for path, kept in zip(paths, keep) if not kept],
+        'conflicts': sorted(conflicts),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate faces in a processed dataset.")
+    parser.add_argument('dataset_folder', help="Processed dataset with one folder per celebrity")
+    parser.add_argument('--method', choices=sorted(HASH_FUNCTIONS), default='phash')
+    parser.add_argument('--radius', type=int, default=4, help="Maximum Hamming distance")
+    parser.add_argument('--min-similarity', type=float, default=None,
+                        help="Also match pairs whose histogram cosine similarity reaches this value")
+    parser.add_argument('--cross-class', action='store_true',
+                        help="Remove duplicates across celebrities instead of only reporting them")
+    parser.add_argument('--delete', action='store_true', help="Delete the duplicates that were found")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    report = dedup_dataset(args.dataset_folder, args.method, args.radius, args.cross_class, args.min_similarity)
+    print(f"Found {len(report['duplicates'])} duplicates and {len(report['conflicts'])} "
+          f"cross-celebrity conflicts in {time.time() - start_time:.2f}s")
+    for first, second in report['conflicts']:
+        print(f"  conflict: {first} <-> {second}")
+
+    if args.delete:
+        for path in report['duplicates']:
+            os.remove(path)
+        print(f"Deleted {len(report['duplicates'])} files")
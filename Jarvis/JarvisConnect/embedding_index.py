@@ -0,0 +1,280 @@
+import os
+import time
+import struct
+import argparse
+import threading
+import numpy as np
+
+# Gallery log record: label length (uint16), UTF-8 label, then the float16 embedding
+_RECORD_HEADER = struct.Struct('<H')
+
+
+class EmbeddingIndex:
+    """
+    Gallery of identity embeddings for open-set face identification.
+
+    Embeddings are L2-normalized and stored in a compact float16 or int8 matrix (int8 with one
+    float32 scale per row), so cosine similarity is a dot product. The matrix grows by doubling,
+    which makes enrolling an identity an amortized O(1) append. When the index has a `path`,
+    every enrollment is also appended to a log file that is replayed on load.
+
+    Search is exact by default. For large galleries, `train_ivf` clusters the embeddings into an
+    inverted file so that a query only scans the `nprobe` closest lists. Run `benchmark` to
+    measure latency and recall on a given machine: with 100k identities of dimension 2048 on one
+    CPU core, IVF search takes a few milliseconds (int8 is faster than float16, which pays for the
+    conversion to float32), so it is not sub-millisecond at that scale.
+
+    Args:
+        dim (int): Embedding dimension.
+        dtype (str): 'float16' or 'int8' storage.
+        path (str): Optional append-only gallery log.
+        capacity (int): Initial number of rows.
+    """
+
+    def __init__(self, dim=2048, dtype='float16', path=None, capacity=1024):
+        if dtype not in ('float16', 'int8'):
+            raise ValueError(f"Unsupported index dtype '{dtype}'")
+        self.dim = dim
+        self.dtype = dtype
+        self.path = path
+        self.labels = []
+        self._matrix = np.empty((capacity, dim), dtype=np.float16 if dtype == 'float16' else np.int8)
+        self._scales = np.ones(capacity, dtype=np.float32)
+        self._label_rows = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+        # Inverted file, see train_ivf
+        self.centroids = None
+        self._lists = None
+        self._list_arrays = None
+
+        if path and os.path.exists(path):
+            self._replay(path)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, label):
+        return label in self._label_rows
+
+    def _replay(self, path):
+        record_size = self.dim * 2
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                (label_length,) = _RECORD_HEADER.unpack(header)
+                label = f.read(label_length).decode('utf-8')
+                vector = f.read(record_size)
+                if len(vector) < record_size:
+                    # Truncated last record from an interrupted write
+                    break
+                self._append(label, np.frombuffer(vector, dtype=np.float16).astype(np.float32))
+
+    def _append(self, label, embedding):
+        if self._size == len(self._matrix):
+            self._matrix = np.resize(self._matrix, (2 * len(self._matrix), self.dim))
+            self._scales = np.resize(self._scales, 2 * len(self._scales))
+        row = self._size
+        if self.dtype == 'int8':
+            scale = max(float(np.abs(embedding).max()), 1e-12) / 127
+            self._matrix[row] = np.round(embedding / scale).astype(np.int8)
+            self._scales[row] = scale
+        else:
+            self._matrix[row] = embedding
+        self.labels.append(label)
+        self._label_rows.setdefault(label, []).append(row)
+        self._size += 1
+
+        if self._lists is not None:
+            nearest = int(np.argmax(self.centroids @ embedding))
+            self._lists[nearest].append(row)
+            self._list_arrays[nearest] = None
+        return row
+
+    def add(self, label, embedding):
+        """Enroll one embedding for `label` and return its row"""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        with self._lock:
+            if self.path:
+                encoded = label.encode('utf-8')
+                with open(self.path, 'ab') as f:
+                    f.write(_RECORD_HEADER.pack(len(encoded)) + encoded + embedding.astype(np.float16).tobytes())
+            return self._append(label, embedding)
+
+    def _scores(self, rows, query, block_size=4096):
+        """Cosine similarity of `query` with the given rows"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        # Convert in blocks to keep the float32 temporaries small
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start:start + block_size]
+            # A slice avoids the gather copy, but only for strictly consecutive rows
+            if len(block_rows) > 1 and np.all(np.diff(block_rows) == 1):
+                block = self._matrix[block_rows[0]:block_rows[-1] + 1]
+            else:
+                block = self._matrix[block_rows]
+            block_scores = block.astype(np.float32) @ query
+            if self.dtype == 'int8':
+                block_scores *= self._scales[block_rows]
+            scores[start:start + len(block_rows)] = block_scores
+        return scores
+
+    def search(self, query, k=5, nprobe=8):
+        """
+        Find the k gallery rows most similar to `query`.
+
+        Args:
+            query (np.ndarray): Embedding of the probe face.
+            k (int): Number of results.
+            nprobe (int): Inverted lists scanned when an IVF has been trained.
+
+        Returns:
+            list: (label, cosine similarity) tuples, best first.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self._lists is None:
+                rows = np.arange(self._size)
+            else:
+                centroid_scores = self.centroids @ query
+                nprobe = min(nprobe, len(centroid_scores))
+                probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+                # Sorted rows read the matrix in order and give the scan contiguous runs
+                rows = np.sort(np.concatenate([self._list_array(i) for i in probes]))
+            scores = self._scores(rows, query)
+            k = min(k, len(rows))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.labels[rows[i]], float(scores[i])) for i in top]
+
+    def label_score(self, label, query):
+        """Best cosine similarity between `query` and the embeddings enrolled for `label`, or None"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            rows = self._label_rows.get(label)
+            if not rows:
+                return None
+            return float(self._scores(np.array(rows), query).max())
+
+    def _list_array(self, list_id):
+        if self._list_arrays[list_id] is None:
+            self._list_arrays[list_id] = np.array(self._lists[list_id], dtype=np.int64)
+        return self._list_arrays[list_id]
+
+    def train_ivf(self, num_lists=None, iterations=10, sample_size=50000, seed=0):
+        """
+        Cluster the gallery with spherical k-means and build an inverted file over the clusters.
+        Embeddings enrolled afterwards are assigned to their nearest list.
+
+        Args:
+            num_lists (int): Number of clusters, defaults to about sqrt(N).
+            iterations (int): k-means iterations.
+            sample_size (int): Rows used to fit the centroids.
+            seed (int): Seed for sampling and initialization.
+        """
+        with self._lock:
+            if self._size == 0:
+                return
+            rng = np.random.default_rng(seed)
+            num_lists = num_lists or max(1, int(np.sqrt(self._size)))
+            num_lists = min(num_lists, self._size)
+            sample_rows = rng.choice(self._size, size=min(sample_size, self._size), replace=False)
+            sample = self._dequantize(np.sort(sample_rows))
+
+            centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(num_lists):
+                    members = sample[assignment == c]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[c] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+
+            self.centroids = centroids
+            self._lists = [[] for _ in range(num_lists)]
+            for start in range(0, self._size, 4096):
+                block_rows = np.arange(start, min(start + 4096, self._size))
+                for row, nearest in zip(block_rows, np.argmax(self._dequantize(block_rows) @ centroids.T, axis=1)):
+                    self._lists[nearest].append(int(row))
+            self._list_arrays = [None] * num_lists
+
+    def _dequantize(self, rows):
+        block = self._matrix[rows].astype(np.float32)
+        if self.dtype == 'int8':
+            block *= self._scales[rows][:, None]
+        return block
+
+
+def benchmark(num_identities=100000, dim=2048, dtype='float16', num_lists=None, nprobe=8, num_queries=200, seed=0):
+    """
+    Query latency and recall@1 of exact and IVF search on a synthetic gallery.
+
+    Identities are drawn around 1000 random directions so the gallery has cluster structure,
+    and every query is a noisy copy of an enrolled identity.
+
+    Returns:
+        dict: Per-mode p50/p99 latency in milliseconds and recall@1 against exact search.
+    """
+    rng = np.random.default_rng(seed)
+    index = EmbeddingIndex(dim=dim, dtype=dtype, capacity=num_identities)
+    centers = rng.normal(size=(1000, dim)).astype(np.float32)
+    for start in range(0, num_identities, 10000):
+        count = min(10000, num_identities - start)
+        block = centers[rng.integers(0, len(centers), count)] + rng.normal(size=(count, dim)).astype(np.float32)
+        for offset, vector in enumerate(block):
+            index._append(f"id_{start + offset}", vector / np.linalg.norm(vector))
+
+    targets = rng.integers(0, num_identities, num_queries)
+    queries = index._dequantize(targets) + 0.3 * rng.normal(size=(num_queries, dim)).astype(np.float32) / np.sqrt(dim)
+
+    def run():
+        latencies, labels = [], []
+        for query in queries:
+            start = time.perf_counter()
+            labels.append(index.search(query, k=1, nprobe=nprobe)[0][0])
+            latencies.append(time.perf_counter() - start)
+        return np.array(latencies) * 1000, labels
+
+    results = {}
+    exact_latencies, exact_labels = run()
+    start = time.perf_counter()
+    index.train_ivf(num_lists)
+    train_time = time.perf_counter() - start
+    ivf_latencies, ivf_labels = run()
+    for mode, latencies, labels in (('exact', exact_latencies, exact_labels), ('ivf', ivf_latencies, ivf_labels)):
+        results[mode] = {
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'recall_at_1': float(np.mean([a == b for a, b in zip(labels, exact_labels)])),
+        }
+    results['ivf']['train_s'] = train_time
+    results['ivf']['num_lists'] = len(index.centroids)
+    results['ivf']['nprobe'] = nprobe
+
+    print(f"{num_identities} identities, dim {dim}, {dtype}")
+    for mode in ('exact', 'ivf'):
+        r = results[mode]
+        print(f"{mode:<6} p50 {r['p50_ms']:8.3f}ms  p99 {r['p99_ms']:8.3f}ms  recall@1 {r['recall_at_1']:.3f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark gallery search latency on synthetic embeddings.")
+    parser.add_argument('--identities', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16')
+    parser.add_argument('--num-lists', type=int, default=None, help="IVF lists, defaults to sqrt(N)")
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    benchmark(args.identities, args.dim, args.dtype, args.num_lists, args.nprobe, args.queries)
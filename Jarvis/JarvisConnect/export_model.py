@@ -0,0 +1,116 @@
+import os
+import json
+import argparse
+import time
+import torch
+import torch.nn as nn
+from torch.fx.experimental.optimization import fuse as fuse_conv_bn
+from trainer import load_trained_model
+
+EXPORT_META = 'export_meta.json'
+INPUT_SIZE = (224, 224)
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class EmbeddingClassifier(nn.Module):
+    """Wraps the fine-tuned ResNet-50 so that one forward pass returns (pooled embedding, class logits)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.head = model.fc
+        model.fc = nn.Identity()
+        self.backbone = model
+
+    def forward(self, x):
+        embedding = self.backbone(x)
+        return embedding, self.head(embedding)
+
+
+def prepare_model(checkpoint_path, fuse=True):
+    """Load a trainer.py checkpoint as an eval-mode EmbeddingClassifier. Returns (model, class names)"""
+    model, classes = load_trained_model(checkpoint_path)
+    model = EmbeddingClassifier(model).eval()
+    if fuse:
+        # Fold every BatchNorm into the convolution before it
+        model.backbone = fuse_conv_bn(model.backbone)
+    return model, classes
+
+
+def export_model(checkpoint_path, output_dir, quantize=True, onnx=True):
+    """
+    Export a trained checkpoint to deployable artifacts.
+
+    Writes a frozen TorchScript model, an ONNX model with a dynamic batch axis and, with
+    `quantize`, their dynamic int8 variants. PyTorch's dynamic quantization covers the Linear
+    head only; ONNX Runtime's also quantizes the convolutions. Every artifact returns
+    (embedding, logits). export_meta.json records the classes, the input preprocessing and
+    the artifact files for inference_runtime.InferenceModel.
+
+    Args:
+        checkpoint_path (str): Checkpoint written by trainer.py or feature_cache.py.
+        output_dir (str): Destination folder.
+        quantize (bool): Also write int8 artifacts.
+        onnx (bool): Also export to ONNX.
+
+    Returns:
+        dict: The export metadata.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model, classes = prepare_model(checkpoint_path)
+    example = torch.randn(1, 3, *INPUT_SIZE)
+    artifacts = {}
+    start_time = time.time()
+
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+        traced.save(os.path.join(output_dir, 'model.ts'))
+        artifacts['torchscript'] = 'model.ts'
+
+        if quantize:
+            quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+            torch.jit.freeze(torch.jit.trace(quantized, example)).save(os.path.join(output_dir, 'model_int8.ts'))
+            artifacts['torchscript_int8'] = 'model_int8.ts'
+
+    if onnx:
+        onnx_path = os.path.join(output_dir, 'model.onnx')
+        torch.onnx.export(model, (example,), onnx_path,
+                          input_names=['input'], output_names=['embedding', 'logits'],
+                          dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}, 'logits': {0: 'batch'}},
+                          opset_version=17, dynamo=False)
+        artifacts['onnx'] = 'model.onnx'
+
+        if quantize:
+            try:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+            except ImportError:
+                print("onnxruntime is not installed, skipping the int8 ONNX model")
+            else:
+                quantize_dynamic(onnx_path, os.path.join(output_dir, 'model_int8.onnx'), weight_type=QuantType.QInt8)
+                artifacts['onnx_int8'] = 'model_int8.onnx'
+
+    meta = {
+        'source': os.path.abspath(checkpoint_path),
+        'classes': classes,
+        'input_size': list(INPUT_SIZE),
+        'mean': IMAGENET_MEAN,
+        'std': IMAGENET_STD,
+        'outputs': ['embedding', 'logits'],
+        'artifacts': artifacts,
+    }
+    with open(os.path.join(output_dir, EXPORT_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Exported {', '.join(sorted(artifacts))} to {output_dir} in {time.time() - start_time:.2f}s")
+    return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a trained face model to TorchScript and ONNX.")
+    parser.add_argument('checkpoint', help="Checkpoint written by trainer.py (e.g. checkpoints/model_final.pt)")
+    parser.add_argument('output_dir', help="Folder for the exported artifacts")
+    parser.add_argument('--no-quantize', dest='quantize', action='store_false', help="Skip the int8 artifacts")
+    parser.add_argument('--no-onnx', dest='onnx', action='store_false', help="Skip the ONNX export")
+    args = parser.parse_args()
+
+    export_model(args.checkpoint, args.output_dir, args.quantize, args.onnx)
@@ -0,0 +1,254 @@
+import os
+import json
+import argparse
+import time
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+from torchvision import models
+from hashing import content_hash
+from trainer import build_model, save_checkpoint
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+EMBEDDING_DIM = 2048
+BACKBONE_WEIGHTS = models.ResNet50_Weights.DEFAULT
+# Names the architecture and the exact weights file, e.g. 'resnet50/resnet50-11ad3fa6'. Part
+# of every cache key, so embeddings of another backbone or weights version are never reused.
+BACKBONE_ID = 'resnet50/' + os.path.splitext(os.path.basename(BACKBONE_WEIGHTS.url))[0]
+
+
+def embedding_key(path, backbone_id=BACKBONE_ID):
+    """Cache key of an image's embedding: the backbone that computes it and the image's content"""
+    return f"{backbone_id}:{content_hash(path)}"
+
+
+class FeatureCache:
+    """
+    Append-only on-disk store of pooled backbone embeddings, keyed by embedding_key.
+
+    Every update writes a new chunk: chunk_NNNNN.npy (float16, N x 2048) followed by
+    chunk_NNNNN.json with the N keys. The JSON file is written last, so a chunk without
+    one is an interrupted write and is ignored.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._chunks = []
+        self._rows = {}
+        for name in sorted(os.listdir(cache_dir)):
+            if name.startswith('chunk_') and name.endswith('.json'):
+                with open(os.path.join(cache_dir, name), 'r', encoding='utf-8') as f:
+                    keys = json.load(f)
+                chunk = len(self._chunks)
+                self._chunks.append(os.path.join(cache_dir, name[:-len('.json')] + '.npy'))
+                for row, key in enumerate(keys):
+                    self._rows[key] = (chunk, row)
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def add(self, keys, embeddings):
+        """Append a batch of embeddings as a new chunk"""
+        if len(keys) == 0:
+            return
+        name = f"chunk_{len(self._chunks):05d}"
+        npy_path = os.path.join(self.cache_dir, name + '.npy')
+        np.save(npy_path, np.asarray(embeddings, dtype=np.float16))
+        with open(os.path.join(self.cache_dir, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(keys), f)
+        chunk = len(self._chunks)
+        self._chunks.append(npy_path)
+        for row, key in enumerate(keys):
+            self._rows[key] = (chunk, row)
+
+    def get(self, keys):
+        """Embeddings of the given keys as a float32 (N, 2048) array"""
+        result = np.empty((len(keys), EMBEDDING_DIM), dtype=np.float32)
+        for i, key in enumerate(keys):
+            chunk, row = self._rows[key]
+            if chunk not in self._arrays:
+                self._arrays[chunk] = np.load(self._chunks[chunk], mmap_mode='r')
+            result[i] = self._arrays[chunk][row]
+        return result
+
+
+class _ImagePathDataset(Dataset):
+    """Loads 224x224 faces as normalized tensors for the backbone"""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.mean = np.array(IMAGENET_MEAN, dtype=np.float32)
+        self.std = np.array(IMAGENET_STD, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        image = cv2.imread(self.paths[index])
+        if image is None:
+            raise RuntimeError(f"Could not read image {self.paths[index]}")
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if image.shape[:2] != (224, 224):
+            image = cv2.resize(image, (224, 224))
+        image = (image.astype(np.float32) / 255 - self.mean) / self.std
+        return torch.from_numpy(image.transpose(2, 0, 1).copy())
+
+
+def build_backbone():
+    """Pretrained ResNet-50 that outputs the 2048-d pooled embedding instead of class scores"""
+    model = models.resnet50(weights=BACKBONE_WEIGHTS)
+    model.fc = nn.Identity()
+    return model.eval().to(memory_format=torch.channels_last)
+
+
+def update_cache(cache_dir, image_paths, batch_size=64, num_workers=4):
+    """
+    Run the backbone over every image whose content is not cached yet.
+
+    Args:
+        cache_dir (str): FeatureCache directory.
+        image_paths (list): Images to make sure are cached (e.g. the paths returned by
+                            preprocess_celebrity_images).
+        batch_size (int): Backbone batch size.
+        num_workers (int): DataLoader workers used for decoding.
+
+    Returns:
+        FeatureCache: The updated cache.
+    """
+    cache = FeatureCache(cache_dir)
+    _embed_missing(cache, [embedding_key(path) for path in image_paths], image_paths, batch_size, num_workers)
+    return cache
+
+
+def _embed_missing(cache, keys, image_paths, batch_size=64, num_workers=4):
+    """Add the embeddings of the images whose key is not in the cache yet"""
+    missing = {}
+    for key, path in zip(keys, image_paths):
+        if key not in cache and key not in missing:
+            missing[key] = path
+    if not missing:
+        return
+
+    print(f"Computing embeddings for {len(missing)} new images...")
+    start_time = time.time()
+    backbone = build_backbone()
+    loader = DataLoader(_ImagePathDataset(list(missing.values())), batch_size=batch_size, num_workers=num_workers)
+    embeddings = []
+    with torch.inference_mode():
+        for inputs in loader:
+            embeddings.append(backbone(inputs.to(memory_format=torch.channels_last)).numpy())
+    cache.add(list(missing.keys()), np.concatenate(embeddings))
+
+    elapsed = time.time() - start_time
+    print(f"Cached {len(missing)} embeddings in {elapsed:.2f}s ({len(missing) / max(elapsed, 1e-9):.1f} images/sec)")
+
+
+def _list_images(image_folder, classes=None):
+    """(paths, labels, classes) of an ImageFolder-style directory"""
+    if classes is None:
+        classes = sorted(entry.name for entry in os.scandir(image_folder) if entry.is_dir())
+    paths, labels = [], []
+    for label, class_name in enumerate(classes):
+        class_path = os.path.join(image_folder, class_name)
+        if not os.path.isdir(class_path):
+            continue
+        for img_file in sorted(os.listdir(class_path)):
+            if img_file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_path, img_file))
+                labels.append(label)
+    return paths, labels, classes
+
+
+def train_head(cache_dir, data_dir, output_path, epochs=50, lr=0.001, batch_size=256, num_workers=4):
+    """
+    Train only the `fc` head of ResNet-50 on cached embeddings.
+
+    The backbone runs once for images that are not cached yet; every epoch afterwards is a
+    few matrix multiplications. The result is saved in the same format as trainer.py's
+    final model, with the pretrained backbone and the new head.
+
+    Args:
+        cache_dir (str): FeatureCache directory.
+        data_dir (str): Folder with 'train' and 'val' sub-folders in ImageFolder layout.
+        output_path (str): Where to save the model checkpoint.
+        epochs (int): Passes over the cached training embeddings.
+        lr (float): Adam learning rate.
+        batch_size (int): Embeddings per optimizer step.
+        num_workers (int): DataLoader workers used for decoding images that are not cached yet.
+    """
+    train_paths, train_labels, classes = _list_images(os.path.join(data_dir, 'train'))
+    val_paths, val_labels, _ = _list_images(os.path.join(data_dir, 'val'), classes)
+    train_keys = [embedding_key(path) for path in train_paths]
+    val_keys = [embedding_key(path) for path in val_paths]
+    cache = FeatureCache(cache_dir)
+    _embed_missing(cache, train_keys + val_keys, train_paths + val_paths, num_workers=num_workers)
+
+    features = {
+        'train': torch.from_numpy(cache.get(train_keys)),
+        'val': torch.from_numpy(cache.get(val_keys)),
+    }
+    labels = {'train': torch.tensor(train_labels), 'val': torch.tensor(val_labels)}
+
+    head = nn.Linear(EMBEDDING_DIM, len(classes))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+
+    start_time = time.time()
+    num_train = len(train_labels)
+    for epoch in range(epochs):
+        order = torch.randperm(num_train)
+        for start in range(0, num_train, batch_size):
+            batch = order[start:start + batch_size]
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(head(features['train'][batch]), labels['train'][batch])
+            loss.backward()
+            optimizer.step()
+
+    with torch.no_grad():
+        for phase in ['train', 'val']:
+            if len(labels[phase]) == 0:
+                continue
+            outputs = head(features[phase])
+            phase_loss = criterion(outputs, labels[phase]).item()
+            phase_acc = (outputs.argmax(1) == labels[phase]).double().mean().item()
+            print(f'{phase} Loss: {phase_loss:.4f} Acc: {phase_acc:.4f}')
+    print(f"Trained head for {epochs} epochs in {time.time() - start_time:.2f}s")
+
+    model = build_model(len(classes), pretrained=True)
+    model.fc.load_state_dict(head.state_dict())
+    save_checkpoint(output_path, model, None, None, epochs - 1, classes, {'head_only': True, 'cache_dir': cache_dir})
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cache backbone embeddings and retrain only the classifier head.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help="Cache embeddings of every image in a folder")
+    update_parser.add_argument('image_folder', help="Folder with one sub-folder of images per class")
+    update_parser.add_argument('--cache-dir', required=True)
+
+    head_parser = subparsers.add_parser('train-head', help="Train the fc head from cached embeddings")
+    head_parser.add_argument('data_dir', help="Folder with 'train' and 'val' sub-folders")
+    head_parser.add_argument('--cache-dir', required=True)
+    head_parser.add_argument('--output', default=os.path.join('checkpoints', 'model_head.pt'))
+    head_parser.add_argument('--epochs', type=int, default=50)
+    head_parser.add_argument('--lr', type=float, default=0.001)
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        paths, _, _ = _list_images(args.image_folder)
+        cache = update_cache(args.cache_dir, paths)
+        print(f"Cache holds {len(cache)} embeddings")
+    else:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        train_head(args.cache_dir, args.data_dir, args.output, args.epochs, args.lr)
@@ -0,0 +1,10 @@
+import hashlib
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """SHA-1 of a file's bytes, read in chunks so large files are never fully in memory"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,208 @@
+import os
+import json
+import argparse
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torchvision import datasets
+from export_model import EXPORT_META, prepare_model
+from trainer import build_eval_transform
+
+BACKENDS = ('onnxruntime', 'torchscript', 'eager')
+# Timed forward passes per candidate when backend='auto' picks the faster one
+AUTO_TIMING_RUNS = 5
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class InferenceModel:
+    """
+    Runs the face model on CPU with the fastest available backend.
+
+    Calling the model with a float32 NCHW batch (normalized like the training images) returns
+    NumPy (embeddings, logits).
+
+    Args:
+        path (str): Folder written by export_model.py, or a trainer.py checkpoint for the eager backend.
+        backend (str): 'auto', 'onnxruntime', 'torchscript' or 'eager'. 'auto' loads every available
+                       export backend, times a few forward passes on this machine and keeps the
+                       fastest; a checkpoint always runs eagerly.
+        quantized (bool): Use the int8 artifacts of the export.
+        num_threads (int): Intra-op threads, defaults to the backend's own choice.
+    """
+
+    def __init__(self, path, backend='auto', quantized=False, num_threads=None):
+        self.path = path
+        self.quantized = quantized
+
+        if not os.path.isdir(path):
+            if backend not in ('auto', 'eager'):
+                raise ValueError(f"Backend '{backend}' needs an export folder, got checkpoint {path}")
+            self.backend = 'eager'
+            self.model, self.classes = prepare_model(path, fuse=False)
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            return
+
+        with open(os.path.join(path, EXPORT_META), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.classes = self.meta['classes']
+        artifacts = self.meta['artifacts']
+        suffix = '_int8' if quantized else ''
+        self.timings_ms = {}
+
+        if backend == 'auto':
+            candidates = [name for name, artifact in (('onnxruntime', 'onnx'), ('torchscript', 'torchscript'))
+                          if artifact + suffix in artifacts and (name != 'onnxruntime' or onnxruntime_available())]
+            if not candidates:
+                raise ValueError(f"No {'int8' if quantized else 'fp32'} artifacts in {path}")
+            self._fastest_backend(candidates, artifacts, suffix, num_threads)
+            return
+        if backend == 'eager':
+            backend = 'torchscript'
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        self._load(backend, artifacts, suffix, num_threads)
+
+    def _load(self, backend, artifacts, suffix, num_threads):
+        self.backend = backend
+        if backend == 'onnxruntime':
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(os.path.join(self.path, artifacts['onnx' + suffix]), options,
+                                                providers=['CPUExecutionProvider'])
+        else:
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.model = torch.jit.load(os.path.join(self.path, artifacts['torchscript' + suffix]),
+                                        map_location='cpu')
+
+    def _fastest_backend(self, candidates, artifacts, suffix, num_threads):
+        """Load every candidate, time single-image forward passes and keep the fastest one"""
+        height, width = self.meta['input_size']
+        sample = np.zeros((1, 3, height, width), dtype=np.float32)
+        loaded = {}
+        for backend in candidates:
+            self.session = self.model = None
+            self._load(backend, artifacts, suffix, num_threads)
+            # The first call pays for lazy initialization
+            self(sample)
+            latencies = []
+            for _ in range(AUTO_TIMING_RUNS):
+                start = time.perf_counter()
+                self(sample)
+                latencies.append(time.perf_counter() - start)
+            self.timings_ms[backend] = float(np.median(latencies) * 1000)
+            loaded[backend] = (self.session, self.model)
+        fastest = min(self.timings_ms, key=self.timings_ms.get)
+        self.backend = fastest
+        self.session, self.model = loaded[fastest]
+
+    @property
+    def name(self):
+        return f"{self.backend} {'int8' if self.quantized else 'fp32'}"
+
+    def __call__(self, inputs):
+        inputs = np.ascontiguousarray(inputs, dtype=np.float32)
+        if self.backend == 'onnxruntime':
+            embeddings, logits = self.session.run(None, {'input': inputs})
+            return embeddings, logits
+        with torch.inference_mode():
+            tensor = torch.from_numpy(inputs).contiguous(memory_format=torch.channels_last)
+            embeddings, logits = self.model(tensor)
+        return embeddings.numpy(), logits.numpy()
+
+
+def benchmark(export_dir, checkpoint_path, data_dir, batch_size=16, max_batches=None, output_path=None):
+    """
+    Compare latency and accuracy of every available backend against the eager fp32 model
+    on the validation split.
+
+    Args:
+        export_dir (str): Folder written by export_model.py.
+        checkpoint_path (str): The checkpoint the export was made from (eager fp32 baseline).
+        data_dir (str): Folder with a 'val' sub-folder in ImageFolder layout.
+        batch_size (int): Images per forward pass.
+        max_batches (int): Limit the number of validation batches.
+        output_path (str): Optional JSON file for the results.
+
+    Returns:
+        list: One result dict per model.
+    """
+    val_dataset = datasets.ImageFolder(os.path.join(data_dir, 'val'), build_eval_transform())
+    batches = []
+    for inputs, labels in DataLoader(val_dataset, batch_size=batch_size):
+        batches.append((inputs.numpy(), labels.numpy()))
+        if max_batches and len(batches) >= max_batches:
+            break
+
+    models = [InferenceModel(checkpoint_path, backend='eager')]
+    with open(os.path.join(export_dir, EXPORT_META), 'r', encoding='utf-8') as f:
+        artifacts = json.load(f)['artifacts']
+    for backend, artifact in [('torchscript', 'torchscript'), ('onnxruntime', 'onnx')]:
+        if backend == 'onnxruntime' and not onnxruntime_available():
+            continue
+        for quantized in (False, True):
+            if artifact + ('_int8' if quantized else '') in artifacts:
+                models.append(InferenceModel(export_dir, backend=backend, quantized=quantized))
+
+    results = []
+    reference = None
+    for model in models:
+        # Warm up allocators and lazy initialization
+        model(batches[0][0])
+        latencies, predictions = [], []
+        for inputs, _ in batches:
+            start = time.perf_counter()
+            _, logits = model(inputs)
+            latencies.append(time.perf_counter() - start)
+            predictions.append(logits.argmax(1))
+        predictions = np.concatenate(predictions)
+        labels = np.concatenate([labels for _, labels in batches])
+        if reference is None:
+            reference = predictions
+
+        latencies_ms = np.array(latencies) * 1000
+        results.append({
+            'model': model.name,
+            'batch_size': batch_size,
+            'mean_ms': float(latencies_ms.mean()),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95)),
+            'images_per_sec': float(len(labels) / latencies_ms.sum() * 1000),
+            'accuracy': float((predictions == labels).mean()),
+            'agreement_with_eager': float((predictions == reference).mean()),
+        })
+
+    print(f"{'model':<18}{'mean ms':>10}{'p95 ms':>10}{'img/s':>10}{'acc':>8}{'agree':>8}")
+    for r in results:
+        print(f"{r['model']:<18}{r['mean_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['images_per_sec']:>10.1f}"
+              f"{r['accuracy']:>8.4f}{r['agreement_with_eager']:>8.4f}")
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark exported face models against the eager fp32 model.")
+    parser.add_argument('export_dir', help="Folder written by export_model.py")
+    parser.add_argument('--checkpoint', required=True, help="Checkpoint the export was made from")
+    parser.add_argument('--data-dir', required=True, help="Folder with a 'val' split")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-batches', type=int, default=None)
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    benchmark(args.export_dir, args.checkpoint, args.data_dir, args.batch_size, args.max_batches, args.output)
@@ -0,0 +1,433 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Attempts a hedged request has in flight at most: the slow one and its backup
+HEDGE_FAN_OUT = 2
+
+
+class LLMBackendError(Exception):
+    """Raised when every backend and retry failed to produce a completion"""
+
+
+class LLMBackend(ABC):
+    """
+    A chat completion provider.
+
+    complete/acomplete return the whole response text. stream/astream are (async) generators
+    of text deltas; they raise on the first iteration if the stream cannot be opened.
+    """
+
+    name = 'backend'
+
+    @abstractmethod
+    def complete(self, messages, temperature=0.7, max_tokens=1024):
+        """Whole response text"""
+
+    @abstractmethod
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        """Generator of text deltas"""
+
+    @abstractmethod
+    async def acomplete(self, messages, temperature=0.7, max_tokens=1024):
+        """Whole response text"""
+
+    @abstractmethod
+    def astream(self, messages, temperature=0.7, max_tokens=1024):
+        """Async generator of text deltas, implemented with `async def` and `yield`"""
+
+    def bind_async_client(self, client):
+        """Use `client` (an AsyncGroq sharing the server's connection pool) for async calls"""
+
+
+class GroqBackend(LLMBackend):
+    """
+    One Groq model.
+
+    Args:
+        model (str): Groq model name.
+        client (groq.Groq): Client for the synchronous calls.
+        async_client (groq.AsyncGroq): Client for the async calls, see bind_async_client.
+        timeout (float): Seconds allowed for a request (for streams, until the first bytes).
+    """
+
+    def __init__(self, model, client=None, async_client=None, timeout=30.0):
+        self.model = model
+        self.name = f"groq:{model}"
+        self.client = client
+        self.async_client = async_client
+        self.timeout = timeout
+
+    def bind_async_client(self, client):
+        self.async_client = client
+
+    def complete(self, messages, temperature=0.7, max_tokens=1024):
+        chat_completion = self.client.chat.completions.create(
+            messages=messages, model=self.model, temperature=temperature, max_tokens=max_tokens, timeout=self.timeout)
+        return chat_completion.choices[0].message.content
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        stream = self.client.chat.completions.create(
+            messages=messages, model=self.model, temperature=temperature, max_tokens=max_tokens,
+            timeout=self.timeout, stream=True)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+    async def acomplete(self, messages, temperature=0.7, max_tokens=1024):
+        chat_completion = await self.async_client.chat.completions.create(
+            messages=messages, model=self.model, temperature=temperature, max_tokens=max_tokens, timeout=self.timeout)
+        return chat_completion.choices[0].message.content
+
+    async def astream(self, messages, temperature=0.7, max_tokens=1024):
+        stream = await self.async_client.chat.completions.create(
+            messages=messages, model=self.model, temperature=temperature, max_tokens=max_tokens,
+            timeout=self.timeout, stream=True)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+
+_MOCK_WORDS = (
+    "certainly", "sir", "the", "systems", "are", "operating", "within", "normal", "parameters", "I", "have",
+    "taken", "the", "liberty", "of", "running", "a", "diagnostic", "suit", "power", "at", "percent", "shall",
+    "render", "using", "proposed", "specifications", "may", "I", "suggest", "a", "more", "cautious", "approach",
+)
+
+
+class MockBackend(LLMBackend):
+    """
+    Deterministic local stand-in for load tests and offline development.
+
+    The response depends only on the last user message (and the seed), so repeated runs
+    are comparable. It arrives after latency_ms and then streams at tokens_per_sec.
+
+    Args:
+        latency_ms (float): Time to the first token.
+        tokens_per_sec (float): Streaming rate after the first token.
+        response_tokens (int): Words per response.
+        failure_rate (float): Fraction of requests that fail, drawn from a seeded generator.
+        seed (int): Seed of the responses and failures.
+    """
+
+    def __init__(self, latency_ms=300.0, tokens_per_sec=80.0, response_tokens=60, failure_rate=0.0, seed=0,
+                 name='mock'):
+        self.latency = latency_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.name = name
+        self._failures = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _tokens(self, messages):
+        if self.failure_rate:
+            with self._lock:
+                if self._failures.random() < self.failure_rate:
+                    raise LLMBackendError(f"{self.name}: simulated failure")
+        last_user = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        digest = hashlib.sha1(f"{self.seed}:{last_user}".encode('utf-8')).digest()
+        rng = random.Random(digest)
+        words = [rng.choice(_MOCK_WORDS) for _ in range(self.response_tokens)]
+        words[0] = words[0].capitalize()
+        return [word + ('.' if i == len(words) - 1 else ' ') for i, word in enumerate(words)]
+
+    def complete(self, messages, temperature=0.7, max_tokens=1024):
+        tokens = self._tokens(messages)[:max_tokens]
+        time.sleep(self.latency + self.token_interval * len(tokens))
+        return ''.join(tokens)
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        tokens = self._tokens(messages)[:max_tokens]
+        time.sleep(self.latency)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_interval)
+            yield token
+
+    async def acomplete(self, messages, temperature=0.7, max_tokens=1024):
+        tokens = self._tokens(messages)[:max_tokens]
+        await asyncio.sleep(self.latency + self.token_interval * len(tokens))
+        return ''.join(tokens)
+
+    async def astream(self, messages, temperature=0.7, max_tokens=1024):
+        tokens = self._tokens(messages)[:max_tokens]
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield token
+
+
+def _open_stream(backend, messages, temperature, max_tokens):
+    """Start a stream and wait for its first delta. Returns (generator, first delta or None)"""
+    deltas = backend.stream(messages, temperature, max_tokens)
+    return deltas, next(deltas, None)
+
+
+async def _aopen_stream(backend, messages, temperature, max_tokens):
+    deltas = backend.astream(messages, temperature, max_tokens)
+    try:
+        return deltas, await anext(deltas, None)
+    except BaseException:
+        # Timed out or cancelled while waiting for the first delta
+        await deltas.aclose()
+        raise
+
+
+# Discard tasks still running, the event loop only keeps weak references to tasks
+_discards = set()
+
+
+def _discard_when_done(task, discard):
+    """Pass the result of an abandoned task to the async `discard` once it finishes, e.g. to close a stream"""
+    def callback(finished):
+        if not finished.cancelled() and finished.exception() is None:
+            cleanup = asyncio.ensure_future(discard(finished.result()))
+            _discards.add(cleanup)
+            cleanup.add_done_callback(_discards.discard)
+    task.add_done_callback(callback)
+
+
+def _abandon(future, discard):
+    """Cancel an attempt that lost or timed out; if it already runs, discard its result when it ends"""
+    if future.cancel() or discard is None:
+        return
+    future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+
+class FailoverBackend(LLMBackend):
+    """
+    Tries a list of backends in order, with retries, backoff and optional request hedging.
+
+    Every backend gets 1 + retries attempts, with exponential backoff between failures,
+    before the next backend is tried. An attempt that has not answered within
+    attempt_timeout counts as failed, whatever the backend's own timeouts. With hedge_after
+    set, an attempt that has not answered within that many seconds gets a backup: the next
+    attempt starts in parallel and the first to succeed wins. Streams fail over only until
+    their first delta arrives, and attempt_timeout applies to that first delta.
+
+    Synchronous attempts run on a thread pool whenever either timer is set. Python threads
+    cannot be interrupted, so an abandoned attempt that already started runs to completion
+    in the background (a stream is closed as soon as it opens); one still queued never starts.
+
+    Args:
+        backends (list): LLMBackend instances, primary first.
+        retries (int): Extra attempts per backend.
+        backoff (float): Seconds before the first retry, doubled after every failure.
+        hedge_after (float): Seconds before a slow attempt is hedged, None to disable.
+        attempt_timeout (float): Seconds an attempt may take before the next one is tried,
+                                 None to rely on the backends' own timeouts.
+        max_requests (int): Synchronous requests expected in flight at once. Timed or hedged
+                            synchronous calls run on a thread pool with HEDGE_FAN_OUT threads
+                            per request.
+    """
+
+    def __init__(self, backends, retries=1, backoff=0.1, hedge_after=None, attempt_timeout=None, max_requests=64):
+        self.backends = list(backends)
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.attempt_timeout = attempt_timeout
+        self.name = ' -> '.join(backend.name for backend in self.backends)
+        self._executor = None
+        if hedge_after or attempt_timeout:
+            self._executor = ThreadPoolExecutor(max_workers=max_requests * HEDGE_FAN_OUT,
+                                                thread_name_prefix='llm-hedge')
+
+    def bind_async_client(self, client):
+        for backend in self.backends:
+            backend.bind_async_client(client)
+
+    def _attempts(self):
+        return [backend for backend in self.backends for _ in range(self.retries + 1)]
+
+    def _run(self, call, discard=None):
+        """Run call(backend) over the attempts and return the first result"""
+        attempts = self._attempts()
+        errors = []
+        if self._executor is None:
+            for i, backend in enumerate(attempts):
+                if errors:
+                    time.sleep(self.backoff * 2 ** (len(errors) - 1))
+                try:
+                    return call(backend)
+                except Exception as e:
+                    logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                    errors.append(e)
+            raise LLMBackendError(f"All LLM backends failed: {errors[-1]}")
+
+        # future -> (backend, start time)
+        pending = {}
+        next_attempt = 0
+        try:
+            while True:
+                if not pending:
+                    if next_attempt == len(attempts):
+                        raise LLMBackendError(f"All LLM backends failed: {errors[-1]}")
+                    if errors:
+                        time.sleep(self.backoff * 2 ** (len(errors) - 1))
+                    pending[self._executor.submit(call, attempts[next_attempt])] = (attempts[next_attempt],
+                                                                                   time.monotonic())
+                    next_attempt += 1
+                can_hedge = self.hedge_after and len(pending) == 1 and next_attempt < len(attempts)
+                now = time.monotonic()
+                timers = []
+                if self.attempt_timeout:
+                    timers.append(min(started for _, started in pending.values()) + self.attempt_timeout - now)
+                if can_hedge:
+                    timers.append(next(iter(pending.values()))[1] + self.hedge_after - now)
+                done, _ = wait(pending, timeout=max(0.0, min(timers)) if timers else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    backend, _ = pending.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                        errors.append(e)
+                if done:
+                    continue
+
+                now = time.monotonic()
+                for future, (backend, started) in list(pending.items()):
+                    if self.attempt_timeout and now - started >= self.attempt_timeout:
+                        del pending[future]
+                        logger.warning(f"LLM backend {backend.name} timed out after {self.attempt_timeout}s")
+                        errors.append(TimeoutError(f"{backend.name} did not answer within {self.attempt_timeout}s"))
+                        _abandon(future, discard)
+                if can_hedge and pending:
+                    logger.info(f"Hedging slow LLM request with {attempts[next_attempt].name}")
+                    pending[self._executor.submit(call, attempts[next_attempt])] = (attempts[next_attempt],
+                                                                                   time.monotonic())
+                    next_attempt += 1
+        finally:
+            # Losing hedges and timed-out attempts must not start, or leak what they opened
+            for future in pending:
+                _abandon(future, discard)
+
+    async def _timed(self, call, backend):
+        """Await call(backend), failing with TimeoutError after attempt_timeout"""
+        if not self.attempt_timeout:
+            return await call(backend)
+        try:
+            return await asyncio.wait_for(call(backend), self.attempt_timeout)
+        except TimeoutError:
+            raise TimeoutError(f"{backend.name} did not answer within {self.attempt_timeout}s") from None
+
+    async def _arun(self, call, discard=None):
+        """Async version of _run"""
+        attempts = self._attempts()
+        errors = []
+        pending = {}
+        next_attempt = 0
+        try:
+            while True:
+                if not pending:
+                    if next_attempt == len(attempts):
+                        raise LLMBackendError(f"All LLM backends failed: {errors[-1]}")
+                    if errors:
+                        await asyncio.sleep(self.backoff * 2 ** (len(errors) - 1))
+                    pending[asyncio.ensure_future(self._timed(call, attempts[next_attempt]))] = attempts[next_attempt]
+                    next_attempt += 1
+                can_hedge = self.hedge_after and len(pending) == 1 and next_attempt < len(attempts)
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging slow LLM request with {attempts[next_attempt].name}")
+                    pending[asyncio.ensure_future(self._timed(call, attempts[next_attempt]))] = attempts[next_attempt]
+                    next_attempt += 1
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                        errors.append(e)
+        finally:
+            # Losing hedges, and every attempt when the caller is cancelled, must not keep running
+            for task in pending:
+                task.cancel()
+                if discard:
+                    # A hedged stream may have opened just before it was cancelled
+                    _discard_when_done(task, discard)
+
+    def complete(self, messages, temperature=0.7, max_tokens=1024):
+        return self._run(lambda backend: backend.complete(messages, temperature, max_tokens))
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        deltas, first = self._run(lambda backend: _open_stream(backend, messages, temperature, max_tokens),
+                                  discard=lambda opened: opened[0].close())
+        try:
+            if first is not None:
+                yield first
+                yield from deltas
+        finally:
+            deltas.close()
+
+    async def acomplete(self, messages, temperature=0.7, max_tokens=1024):
+        return await self._arun(lambda backend: backend.acomplete(messages, temperature, max_tokens))
+
+    async def astream(self, messages, temperature=0.7, max_tokens=1024):
+        deltas, first = await self._arun(lambda backend: _aopen_stream(backend, messages, temperature, max_tokens),
+                                         discard=lambda opened: opened[0].aclose())
+        try:
+            if first is not None:
+                yield first
+                async for delta in deltas:
+                    yield delta
+        finally:
+            await deltas.aclose()
+
+
+def build_backend_from_env(api_key, model):
+    """
+    Chat backend configured by environment variables.
+
+    LLM_BACKEND          'groq' (default) or 'mock'
+    LLM_FALLBACK_MODELS  Comma-separated Groq models tried after `model`
+    LLM_RETRIES          Extra attempts per model (default 1)
+    LLM_TIMEOUT          Seconds per attempt, for any backend (default 30)
+    LLM_HEDGE_AFTER      Seconds before a slow request is hedged (default off)
+    LLM_MAX_REQUESTS     Synchronous requests in flight at once, sizes the hedging thread pool (default 64)
+    MOCK_LATENCY_MS, MOCK_TOKENS_PER_SEC, MOCK_RESPONSE_TOKENS, MOCK_FAILURE_RATE
+    """
+    kind = os.environ.get('LLM_BACKEND', 'groq').lower()
+    timeout = float(os.environ.get('LLM_TIMEOUT', '30'))
+    if kind == 'mock':
+        backends = [MockBackend(
+            latency_ms=float(os.environ.get('MOCK_LATENCY_MS', '300')),
+            tokens_per_sec=float(os.environ.get('MOCK_TOKENS_PER_SEC', '80')),
+            response_tokens=int(os.environ.get('MOCK_RESPONSE_TOKENS', '60')),
+            failure_rate=float(os.environ.get('MOCK_FAILURE_RATE', '0'))
+        )]
+    elif kind == 'groq':
+        from groq import Groq
+        # Retries are handled by FailoverBackend, so they can move on to the next model
+        client = Groq(api_key=api_key, max_retries=0)
+        fallback_models = [m.strip() for m in os.environ.get('LLM_FALLBACK_MODELS', '').split(',') if m.strip()]
+        backends = [GroqBackend(name, client, timeout=timeout) for name in [model] + fallback_models]
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND '{kind}', expected 'groq' or 'mock'")
+
+    hedge_after = float(os.environ.get('LLM_HEDGE_AFTER', '0')) or None
+    return FailoverBackend(backends, retries=int(os.environ.get('LLM_RETRIES', '1')), hedge_after=hedge_after,
+                           attempt_timeout=timeout or None, max_requests=int(os.environ.get('LLM_MAX_REQUESTS', '64')))
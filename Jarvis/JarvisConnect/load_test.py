@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import httpx
+import numpy as np
+
+SCENARIOS = ('chat', 'chat_stream', 'health', 'static')
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, env_overrides):
+    """
+    Start app.py (Flask, threaded) or asgi_app.py (uvicorn) against the mock LLM backend
+    and wait until /health answers.
+    """
+    env = dict(os.environ, LLM_BACKEND='mock', **env_overrides)
+    if mode == 'flask':
+        command = [sys.executable, '-c',
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with code {process.returncode}")
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/health', timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{mode} server did not start within 60s")
+
+
+async def run_request(client, scenario, index, unique_messages):
+    """Send one request. Returns (status, latency, time to first byte of the body)"""
+    start = time.perf_counter()
+    if scenario == 'health':
+        response = await client.get('/health')
+        return response.status_code, time.perf_counter() - start, None
+    if scenario == 'static':
+        response = await client.get('/js/chat.js')
+        return response.status_code, time.perf_counter() - start, None
+
+    payload = {'message': f"Status report number {index % unique_messages}", 'username': 'LoadTest'}
+    if scenario == 'chat':
+        response = await client.post('/api/chat', json=payload)
+        return response.status_code, time.perf_counter() - start, None
+
+    first_byte = None
+    body = []
+    async with client.stream('POST', '/api/chat/stream', json=payload) as response:
+        async for chunk in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            body.append(chunk)
+        status = response.status_code
+    if status == 200:
+        # A stream can fail after its 200 status was sent, only a final `done` event is a success
+        event = final_event(b''.join(body).decode('utf-8', errors='replace'))
+        if event == 'error':
+            status = 'stream_error'
+        elif event != 'done':
+            status = 'stream_incomplete'
+    return status, time.perf_counter() - start, first_byte
+
+
+def final_event(body):
+    """Event name of the last Server-Sent Event in a response body ('message' if unnamed), or None"""
+    events = [block for block in body.replace('\r\n', '\n').split('\n\n') if block.strip()]
+    if not events:
+        return None
+    for line in events[-1].split('\n'):
+        if line.startswith('event:'):
+            return line[len('event:'):].strip()
+    return 'message'
+
+
+async def run_scenario(base_url, scenario, num_requests, concurrency, unique_messages, timeout):
+    """Issue num_requests requests with `concurrency` in flight and collect per-request samples"""
+    samples = []
+    next_index = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal next_index
+            while next_index < num_requests:
+                index = next_index
+                next_index += 1
+                try:
+                    samples.append(await run_request(client, scenario, index, unique_messages))
+                except httpx.HTTPError as e:
+                    samples.append((type(e).__name__, None, None))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def summarize(scenario, samples, elapsed, concurrency):
+    latencies = np.array([latency for status, latency, _ in samples if status == 200]) * 1000
+    first_bytes = np.array([fb for status, _, fb in samples if status == 200 and fb is not None]) * 1000
+    status_counts = {}
+    for status, _, _ in samples:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+
+    def percentiles(values):
+        if len(values) == 0:
+            return None
+        return {
+            'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())
+        }
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'duration_s': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'error_rate': 1 - len(latencies) / len(samples) if samples else 0.0,
+        'status_counts': status_counts,
+        'latency_ms': percentiles(latencies),
+        'first_byte_ms': percentiles(first_bytes)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the JARVIS service against the mock LLM backend.")
+    parser.add_argument('--url', default=None, help="Test an already running server instead of starting one")
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask', help="Server to start")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per scenario and concurrency level")
+    parser.add_argument('--concurrency', default='1,10,50', help="Comma-separated concurrency levels")
+    parser.add_argument('--unique-messages', type=int, default=1000000,
+                        help="Distinct chat prompts; lower values exercise the response cache")
+    parser.add_argument('--mock-latency-ms', type=float, default=200)
+    parser.add_argument('--mock-tokens-per-sec', type=float, default=200)
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache enabled on the server")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', default='load_test_results.json', help="JSON results file")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"Unknown scenario '{scenario}'")
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        env = {
+            'MOCK_LATENCY_MS': str(args.mock_latency_ms),
+            'MOCK_TOKENS_PER_SEC': str(args.mock_tokens_per_sec),
+            'CHAT_MAX_QUEUE': str(max(concurrency_levels) * 2),
+        }
+        if not args.cache:
+            env['CHAT_CACHE_SIZE'] = '0'
+        print(f"Starting {args.server} server on port {port} with the mock LLM backend...")
+        process = start_server(args.server, port, env)
+        base_url = f'http://127.0.0.1:{port}'
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for concurrency in concurrency_levels:
+                samples, elapsed = asyncio.run(run_scenario(
+                    base_url, scenario, args.requests, concurrency, args.unique_messages, args.timeout))
+                summary = summarize(scenario, samples, elapsed, concurrency)
+                results.append(summary)
+                latency = summary['latency_ms'] or {'p50': float('nan'), 'p95': float('nan'), 'p99': float('nan')}
+                print(f"{scenario:<12} c={concurrency:<4} {summary['throughput_rps']:8.1f} req/s  "
+                      f"p50 {latency['p50']:8.1f}ms  p95 {latency['p95']:8.1f}ms  p99 {latency['p99']:8.1f}ms  "
+                      f"errors {summary['error_rate']:.2%}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'target': args.url or args.server,
+        'config': {
+            'requests': args.requests,
+            'unique_messages': args.unique_messages,
+            'mock_latency_ms': args.mock_latency_ms,
+            'mock_tokens_per_sec': args.mock_tokens_per_sec,
+            'cache': args.cache
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
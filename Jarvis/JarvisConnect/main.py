@@ -1,57 +1,54 @@
-import os
 import sys
-from preprocessing import preprocess_celebrity_images
-from augmentation import augment_and_save
+from pipeline import PipelineError, is_augmented, load_pipeline_config, run_pipeline
+from feature_cache import update_cache
 
 sys.path.append(r'C:\Users\USER\Desktop\Python')
 
 def main():
-    # Define paths
+    # Define paths. The stages themselves live in pipeline.py (python pipeline.py --help)
     dataset_folder = r'C:\Users\USER\Desktop\Python\Dataset'
     processed_folder = r'C:\Users\USER\Desktop\Python\processed_dataset'
     augmented_folder = r'C:\Users\USER\Desktop\Python\augmented_data' # Define this path
+    work_dir = r'C:\Users\USER\Desktop\Python\pipeline_output'
+
+    # Augmentation runs on the fly during training (augmented_dataset.py).
+    # Set to True to also write the augmented images to augmented_folder.
+    materialize_augmentations = False
+    # When materializing, augment every celebrity up to this many images instead of
+    # augmenting each image the same number of times (None)
+    target_images_per_class = None
+
+    # Backbone embeddings of newly processed faces are cached here for head-only
+    # retraining (python feature_cache.py train-head). None disables the cache.
+    feature_cache_folder = r'C:\Users\USER\Desktop\Python\feature_cache'
+
+    stages = ['preprocess', 'dedup'] + (['augment'] if materialize_augmentations else [])
+    config = load_pipeline_config(overrides={
+        'dataset_folder': dataset_folder,
+        'processed_folder': processed_folder,
+        'augmented_folder': augmented_folder,
+        'work_dir': work_dir,
+        'stages': stages,
+        'target_per_class': target_images_per_class,
+    })
 
     try:
-        # 1. RUN PREPROCESSING
-        print("Starting celebrity image preprocessing...")
-        processed_data_info = preprocess_celebrity_images(
-            dataset_folder=dataset_folder,
-            output_folder=processed_folder,
-            target_size=(224, 224)
-        )
-        print(f"Preprocessing complete. Found {len(processed_data_info)} unique images.")
-
-        # 2. RUN AUGMENTATION
-        print("\nStarting augmentation...")
-        # This function doesn't need to return anything.
-        augment_and_save(
-            processed_folder=processed_folder,
-            augmented_folder=augmented_folder,
-            num_augmentations_per_image=9
-        )
-
-        # 3. GENERATE THE FINAL SUMMARY CORRECTLY
-        print("\n--- Final Summary ---")
-        print(f"Total unique images processed: {len(processed_data_info)}")
-
-        celebrity_counts = {}
-        total_augmented_images = 0
-        # Scan the final output folder to get counts
-        for celebrity_folder in os.listdir(augmented_folder):
-            celebrity_path = os.path.join(augmented_folder, celebrity_folder)
-            if os.path.isdir(celebrity_path):
-                num_images = len(os.listdir(celebrity_path))
-                celebrity_counts[celebrity_folder] = num_images
-                total_augmented_images += num_images
-
-        print(f"Total images in final augmented dataset: {total_augmented_images}")
-        print("\nImages per celebrity:")
-        for celebrity, count in celebrity_counts.items():
-            print(f"  {celebrity}: {count} images")
-
-    except Exception as e:
-        # Use a more specific error message
-        print(f"\nAn error occurred in the main process: {e}")
+        # Unchanged celebrity folders are skipped, failed ones are reported without losing the rest
+        report = run_pipeline(config)
+    except PipelineError as e:
+        print(f"\n{e}")
+        return
+
+    if feature_cache_folder:
+        # Only images whose content is not cached yet go through the backbone
+        update_cache(feature_cache_folder, [path for paths in report['images'].values() for path in paths
+                                            if not is_augmented(path)])
+
+    print("\n--- Final Summary ---")
+    print(f"Total images in final dataset: {sum(report['counts'].values())}")
+    print("\nImages per celebrity:")
+    for celebrity, count in report['counts'].items():
+        print(f"  {celebrity}: {count} images")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
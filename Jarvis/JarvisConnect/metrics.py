@@ -0,0 +1,104 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+    METRICS_AVAILABLE = True
+except ImportError:
+    # Without prometheus_client the metrics are no-ops and /metrics reports it is disabled
+    METRICS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = 'text/plain; charset=utf-8'
+
+    class _NoOpMetric:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def labels(self, *args, **kwargs):
+            return self
+
+        def observe(self, value):
+            pass
+
+        def inc(self, amount=1):
+            pass
+
+    Counter = Histogram = _NoOpMetric
+
+    def generate_latest():
+        return b"# prometheus_client is not installed\n"
+
+# Status label of streams that failed after their 200 response had started
+STREAM_ERROR_STATUS = 'stream_error'
+
+# Per-request timing spans, sent back in a Server-Timing header when enabled
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', 'false').lower() == 'true'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+REQUEST_LATENCY = Histogram(
+    'jarvis_request_seconds', "Time to produce the response (to the first byte for streams)",
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS)
+UPSTREAM_LATENCY = Histogram(
+    'jarvis_llm_seconds', "LLM backend latency: whole completion, first streamed delta or whole stream",
+    ['backend', 'phase'], buckets=LATENCY_BUCKETS)
+QUEUE_TIME = Histogram(
+    'jarvis_queue_seconds', "Time spent waiting for a chat slot or a recognition batch",
+    ['queue'], buckets=LATENCY_BUCKETS)
+CHAT_TOKENS = Histogram(
+    'jarvis_chat_tokens', "Estimated tokens per chat request", ['direction'], buckets=TOKEN_BUCKETS)
+ERRORS = Counter('jarvis_errors_total', "Responses with status >= 400, and streams that failed midway",
+                 ['route', 'status'])
+CACHE_LOOKUPS = Counter('jarvis_response_cache_total', "Response cache lookups", ['result'])
+
+_spans = contextvars.ContextVar('jarvis_spans', default=None)
+
+
+def start_trace():
+    """Begin collecting spans for the current request (a no-op unless REQUEST_TIMING is set)"""
+    if REQUEST_TIMING:
+        _spans.set([])
+
+
+@contextmanager
+def span(name):
+    """Time a block as a named span of the current request"""
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - start))
+
+
+def server_timing(total=None):
+    """Server-Timing header value of the current request's spans, or None"""
+    spans = _spans.get()
+    if spans is None:
+        return None
+    entries = [f"{name};dur={duration * 1000:.2f}" for name, duration in spans]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    _spans.set(None)
+    return ', '.join(entries)
+
+
+def observe_request(route, method, status, duration):
+    REQUEST_LATENCY.labels(route, method, str(status)).observe(duration)
+    if status >= 400:
+        ERRORS.labels(route, str(status)).inc()
+
+
+def observe_stream_error(route):
+    """Count a streamed response that failed after its status was sent"""
+    ERRORS.labels(route, STREAM_ERROR_STATUS).inc()
+
+
+def metrics_payload():
+    """(body, content type) of the Prometheus exposition"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,542 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import trainer
+from augmentation import augment_and_save
+from dedup import dedup_dataset
+from hashing import content_hash
+from preprocessing import IMAGE_EXTENSIONS, MANIFEST_VERSION, face_detection_pool, preprocess_celebrity_images
+from shards import INDEX_NAME, pack_dataset
+
+STAGES = ('preprocess', 'dedup', 'augment', 'pack', 'train')
+# Stages that run per celebrity folder; pack and train see the whole dataset
+CLASS_STAGES = ('preprocess', 'dedup', 'augment')
+STATE_NAME = 'pipeline_state.json'
+PROFILE_NAME = 'pipeline_profile.json'
+STATE_VERSION = 1
+# Seconds between state saves while celebrity folders are being processed
+STATE_SAVE_INTERVAL = 30
+
+DEFAULT_CONFIG = {
+    # Folder with one sub-folder of raw images per celebrity
+    'dataset_folder': None,
+    # Everything the pipeline writes goes here, unless a folder is set below
+    'work_dir': 'pipeline_output',
+    'processed_folder': None,
+    'augmented_folder': None,
+    'stages': list(STAGES),
+    # (width, height) of the face crops
+    'target_size': [224, 224],
+    # Face detection processes shared by all celebrity folders, None uses every CPU
+    'num_workers': None,
+    # Celebrity folders moving through preprocess, dedup and augment at the same time
+    'class_concurrency': 4,
+    'dedup_method': 'phash',
+    'dedup_radius': 4,
+    'augmentations_per_image': 9,
+    # Class-balanced augmentation: augment the training images of every class up to this many,
+    # with augmentations_per_image as the cap per image. None augments every image equally.
+    'target_per_class': None,
+    'augment_format': None,
+    # 0-100 for every format, PNG outputs map it to a compression level (see augmentation.quality_params)
+    'augment_quality': None,
+    # Encoding threads of each augmenting folder
+    'augment_threads': 2,
+    # Share of every class held out for validation. The split is made on the deduplicated
+    # originals before augmentation, and validation images are never augmented.
+    'val_fraction': 0.2,
+    # Classes with fewer training images than this fail; validation gives images back to reach it
+    'min_train_per_class': 1,
+    'shard_size': 4096,
+    # Training options, see trainer.DEFAULT_CONFIG. shard_dir and checkpoint_dir are set by the pipeline.
+    'train': {},
+    # Stages to run even if their inputs have not changed
+    'force': [],
+}
+
+_AUGMENTED_SUFFIX = re.compile(r'_aug_\d+$')
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+def load_pipeline_config(config_path=None, overrides=None):
+    """
+    Build the pipeline configuration: DEFAULT_CONFIG, then the JSON file at config_path,
+    then any non-None value from overrides.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown pipeline options in {config_path}: {sorted(unknown)}")
+        config.update(file_config)
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = value
+
+    if not config['dataset_folder']:
+        raise ValueError("dataset_folder is required")
+    unknown = set(config['stages']) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, expected a subset of {STAGES}")
+    if 'train' in config['stages'] and 'pack' not in config['stages']:
+        raise ValueError("The train stage reads the shards written by the pack stage")
+    unknown = set(config['train']) - set(trainer.DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown training options: {sorted(unknown)}")
+    if config['train'].get('target_per_class') is not None:
+        raise ValueError("The train stage reads shards, balance classes with the pipeline's target_per_class instead")
+    return config
+
+
+def _list_images(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _original_name(path):
+    """File name without extension or augmentation suffix, shared by an image and its variants"""
+    return _AUGMENTED_SUFFIX.sub('', os.path.splitext(os.path.basename(path))[0])
+
+
+def _split_score(path):
+    return int(hashlib.sha1(_original_name(path).encode('utf-8')).hexdigest()[:8], 16) / 2 ** 32
+
+
+def is_augmented(path):
+    """Whether an image was written by the augment stage rather than preprocessing"""
+    return _AUGMENTED_SUFFIX.search(os.path.splitext(os.path.basename(path))[0]) is not None
+
+
+def validation_names(paths, val_fraction, min_train=1):
+    """
+    Deterministic train/val split of one class, made on the names of its original images.
+
+    An image goes to validation when the hash of its name falls below val_fraction, except that
+    the class always keeps at least min_train training images.
+
+    Args:
+        paths (list): Images of the class; augmented variants are ignored.
+        val_fraction (float): Share of the originals held out for validation.
+        min_train (int): Minimum number of training images.
+
+    Returns:
+        set: Original names (see _original_name) of the validation images.
+    """
+    originals = sorted({_original_name(path) for path in paths if not is_augmented(path)})
+    if len(originals) < min_train:
+        raise PipelineError(f"{len(originals)} images, at least {min_train} training images are required")
+    scored = sorted((_split_score(name), name) for name in originals)
+    held_out = [name for score, name in scored if score < val_fraction]
+    return set(held_out[:len(originals) - min_train])
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class StageProfile:
+    """Thread-safe record of how long every stage took on every celebrity folder"""
+
+    def __init__(self):
+        self.tasks = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, name, start, end, items_in, items_out, skipped=False, error=None):
+        with self._lock:
+            self.tasks.append({
+                'stage': stage, 'name': name, 'start': start, 'end': end, 'seconds': end - start,
+                'items_in': items_in, 'items_out': items_out, 'skipped': skipped, 'error': error,
+            })
+
+    def summary(self):
+        """Per-stage totals: busy time (summed over folders), wall time, items and throughput"""
+        stages = []
+        for stage in STAGES:
+            tasks = [t for t in self.tasks if t['stage'] == stage]
+            if not tasks:
+                continue
+            busy = sum(t['seconds'] for t in tasks)
+            items_in = sum(t['items_in'] for t in tasks)
+            # Throughput only counts the folders the stage actually worked on
+            executed = [t for t in tasks if not t['skipped']]
+            executed_busy = sum(t['seconds'] for t in executed)
+            stages.append({
+                'stage': stage,
+                'tasks': len(tasks),
+                'skipped': sum(t['skipped'] for t in tasks),
+                'failed': sum(t['error'] is not None for t in tasks),
+                'busy_s': busy,
+                'wall_s': max(t['end'] for t in tasks) - min(t['start'] for t in tasks),
+                'items_in': items_in,
+                'items_out': sum(t['items_out'] for t in tasks),
+                'items_per_sec': sum(t['items_in'] for t in executed) / executed_busy if executed_busy else 0.0,
+            })
+        return stages
+
+
+class Pipeline:
+    """
+    Runs preprocess -> dedup -> augment -> pack -> train with content-hashed stage caching.
+
+    Every stage records a key made of its options and the content hashes of its input files.
+    A stage whose key is unchanged and whose outputs still exist is skipped, so a rerun
+    only redoes the celebrity folders (and downstream stages) whose images changed. The
+    per-folder stages run for several folders at once: one folder can be augmenting while
+    another is still waiting for face detection on the shared process pool.
+
+    Args:
+        config (dict): Options from load_pipeline_config.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.stages = [stage for stage in STAGES if stage in config['stages']]
+        work_dir = config['work_dir']
+        self.folders = {
+            'preprocess': config['processed_folder'] or os.path.join(work_dir, 'processed'),
+            'dedup': os.path.join(work_dir, 'deduped'),
+            'augment': config['augmented_folder'] or os.path.join(work_dir, 'augmented'),
+            'pack': os.path.join(work_dir, 'shards'),
+            'train': os.path.join(work_dir, 'checkpoints'),
+        }
+        self.state_path = os.path.join(work_dir, STATE_NAME)
+        self.profile = StageProfile()
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._pool = None
+        self._last_save = 0.0
+        self._seen_files = set()
+        os.makedirs(os.path.join(work_dir, 'manifests'), exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get('version') == STATE_VERSION:
+                    return state
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable pipeline state {self.state_path}: {e}")
+        return {'version': STATE_VERSION, 'files': {}, 'stages': {stage: {} for stage in STAGES}}
+
+    def _save_state(self, force=True):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < STATE_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            if force:
+                # Forget the content hashes of files that no longer take part in the pipeline
+                self.state['files'] = {path: value for path, value in self.state['files'].items()
+                                       if path in self._seen_files}
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def file_hash(self, path):
+        """Content hash of a file, recomputed only when its size or modification time changes"""
+        stat = os.stat(path)
+        with self._lock:
+            self._seen_files.add(path)
+            cached = self.state['files'].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = content_hash(path)
+        with self._lock:
+            self.state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def fingerprint(self, paths):
+        # The class folder is part of the key, as it is the label of every image in it
+        return _digest([[os.path.basename(os.path.dirname(path)), os.path.basename(path), self.file_hash(path)]
+                        for path in paths])
+
+    def _stage_options(self, stage):
+        config = self.config
+        if stage == 'preprocess':
+            return {'target_size': list(config['target_size']), 'manifest_version': MANIFEST_VERSION}
+        if stage == 'dedup':
+            return {'method': config['dedup_method'], 'radius': config['dedup_radius']}
+        if stage == 'augment':
+            return {'count': config['augmentations_per_image'], 'format': config['augment_format'],
+                    'quality': config['augment_quality'], 'target_per_class': config['target_per_class'],
+                    'val_fraction': config['val_fraction'], 'min_train': config['min_train_per_class']}
+        if stage == 'pack':
+            return {'val_fraction': config['val_fraction'], 'min_train': config['min_train_per_class'],
+                    'shard_size': config['shard_size'], 'target_size': list(config['target_size'])}
+        return config['train']
+
+    def _cached_outputs(self, stage, name, key):
+        """Outputs recorded for an unchanged stage, or None if it has to run"""
+        if stage in self.config['force']:
+            return None
+        with self._lock:
+            entry = self.state['stages'][stage].get(name)
+        if entry is None or entry['key'] != key or not all(os.path.exists(path) for path in entry['outputs']):
+            return None
+        return entry['outputs']
+
+    def _record(self, stage, name, key, outputs):
+        with self._lock:
+            self.state['stages'][stage][name] = {'key': key, 'outputs': outputs}
+
+    def _face_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = face_detection_pool(self.config['num_workers'] or os.cpu_count() or 1)
+            return self._pool
+
+    def run(self):
+        """
+        Run the configured stages.
+
+        Returns:
+            dict: 'images' (final images per celebrity), 'counts' and 'profile' (per-stage summary).
+        """
+        config = self.config
+        start = time.perf_counter()
+        dataset_folder = config['dataset_folder']
+        classes = sorted(entry.name for entry in os.scandir(dataset_folder) if entry.is_dir())
+        self._drop_removed_classes(classes)
+        class_stages = [stage for stage in self.stages if stage in CLASS_STAGES]
+        final_folder = self.folders[class_stages[-1]] if class_stages else dataset_folder
+
+        images, failures = {}, {}
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, config['class_concurrency'])) as executor:
+                futures = {name: executor.submit(self._run_class, name, class_stages) for name in classes}
+                for name, future in futures.items():
+                    try:
+                        images[name] = future.result()
+                    except Exception as e:
+                        failures[name] = e
+                        print(f"Celebrity folder {name} failed: {e}")
+
+            if failures:
+                raise PipelineError(f"{len(failures)} of {len(classes)} celebrity folders failed "
+                                    f"({', '.join(sorted(failures))}), pack and train were not run")
+
+            if 'pack' in self.stages:
+                pack_key = self._run_pack(final_folder, images)
+                if 'train' in self.stages:
+                    self._run_train(pack_key)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            self._save_state()
+            wall_time = time.perf_counter() - start
+            self._write_profile(wall_time)
+
+        return {
+            'images': images,
+            'counts': {name: len(paths) for name, paths in images.items()},
+            'profile': self.profile.summary(),
+            'wall_time_s': wall_time,
+        }
+
+    def _drop_removed_classes(self, classes):
+        """Delete the outputs and state of celebrity folders that are gone from the dataset"""
+        for stage in CLASS_STAGES:
+            for name in list(self.state['stages'][stage]):
+                if name not in classes:
+                    del self.state['stages'][stage][name]
+                    shutil.rmtree(os.path.join(self.folders[stage], name), ignore_errors=True)
+        manifest_dir = self._manifest_dir()
+        if os.path.isdir(manifest_dir):
+            for file_name in os.listdir(manifest_dir):
+                if os.path.splitext(file_name)[0] not in classes:
+                    os.remove(os.path.join(manifest_dir, file_name))
+
+    def _manifest_dir(self):
+        return os.path.join(self.config['work_dir'], 'manifests')
+
+    def _run_class(self, name, class_stages):
+        """Take one celebrity folder through the per-folder stages. Returns its final images"""
+        input_root = self.config['dataset_folder']
+        outputs = _list_images(os.path.join(input_root, name))
+        for stage in class_stages:
+            start = time.perf_counter()
+            inputs = _list_images(os.path.join(input_root, name))
+            key = _digest([stage, self._stage_options(stage), self.fingerprint(inputs)])
+            outputs = self._cached_outputs(stage, name, key)
+            skipped = outputs is not None
+            try:
+                if not skipped:
+                    outputs = getattr(self, '_' + stage)(name, input_root, self.folders[stage])
+                    self._record(stage, name, key, outputs)
+            except Exception as e:
+                self.profile.record(stage, name, start, time.perf_counter(), len(inputs), 0, error=str(e))
+                raise
+            self.profile.record(stage, name, start, time.perf_counter(), len(inputs), len(outputs), skipped)
+            print(f"[{stage}] {name}: {len(inputs)} -> {len(outputs)} images"
+                  f"{' (unchanged, skipped)' if skipped else ''}")
+            self._save_state(force=False)
+            input_root = self.folders[stage]
+        return outputs
+
+    def _preprocess(self, name, input_root, output_root):
+        processed = preprocess_celebrity_images(
+            input_root, output_root, target_size=tuple(self.config['target_size']),
+            manifest_path=os.path.join(self._manifest_dir(), f"{name}.json"),
+            celebrities=[name], pool=self._face_pool())
+        return sorted(info['path'] for info in processed)
+
+    def _dedup(self, name, input_root, output_root):
+        report = dedup_dataset(input_root, self.config['dedup_method'], self.config['dedup_radius'],
+                               celebrities=[name])
+        duplicates = set(report['duplicates'])
+        # The deduplicated folder holds hard links, so it costs no extra disk space
+        output_folder = os.path.join(output_root, name)
+        shutil.rmtree(output_folder, ignore_errors=True)
+        os.makedirs(output_folder)
+        outputs = []
+        for path in _list_images(os.path.join(input_root, name)):
+            if path not in duplicates:
+                destination = os.path.join(output_folder, os.path.basename(path))
+                _link_or_copy(path, destination)
+                outputs.append(destination)
+        return outputs
+
+    def _augment(self, name, input_root, output_root):
+        shutil.rmtree(os.path.join(output_root, name), ignore_errors=True)
+        config = self.config
+        # Split first, so validation images are copied over but never augmented
+        held_out = validation_names(_list_images(os.path.join(input_root, name)), config['val_fraction'],
+                                    config['min_train_per_class'])
+        return sorted(augment_and_save(input_root, output_root, config['augmentations_per_image'],
+                                       config['augment_format'], config['augment_quality'],
+                                       config['augment_threads'], celebrities=[name],
+                                       target_per_class=config['target_per_class'],
+                                       holdout=lambda path: _original_name(path) in held_out))
+
+    def _run_pack(self, image_folder, images):
+        """Split every class into train and val and pack both into shards. Returns the stage key"""
+        start = time.perf_counter()
+        paths = [path for name in sorted(images) for path in images[name]]
+        key = _digest(['pack', self._stage_options('pack'), self.fingerprint(paths)])
+        outputs = self._cached_outputs('pack', 'all', key)
+        skipped = outputs is not None
+        if not skipped:
+            width, height = self.config['target_size']
+            # The same split the augment stage made, recomputed from the originals of every class
+            held_out = set()
+            for name in sorted(images):
+                try:
+                    names = validation_names(images[name], self.config['val_fraction'],
+                                             self.config['min_train_per_class'])
+                except PipelineError as e:
+                    raise PipelineError(f"Celebrity folder {name}: {e}") from None
+                held_out.update((name, original) for original in names)
+
+            def is_validation(path):
+                return (os.path.basename(os.path.dirname(path)), _original_name(path)) in held_out
+
+            includes = {
+                'train': lambda path: not is_validation(path),
+                'val': lambda path: is_validation(path) and not is_augmented(path),
+            }
+            outputs = []
+            for split, include in includes.items():
+                output_folder = os.path.join(self.folders['pack'], split)
+                shutil.rmtree(output_folder, ignore_errors=True)
+                pack_dataset(image_folder, output_folder, image_size=(height, width),
+                             shard_size=self.config['shard_size'], include=include)
+                outputs.append(os.path.join(output_folder, INDEX_NAME))
+            self._record('pack', 'all', key, outputs)
+        self.profile.record('pack', 'all', start, time.perf_counter(), len(paths), len(paths), skipped)
+        print(f"[pack] {len(paths)} images{' (unchanged, skipped)' if skipped else ''}")
+        return key
+
+    def _run_train(self, pack_key):
+        start = time.perf_counter()
+        key = _digest(['train', self._stage_options('train'), pack_key])
+        outputs = self._cached_outputs('train', 'all', key)
+        skipped = outputs is not None
+        train_config = trainer.load_config(overrides=dict(self.config['train'], shard_dir=self.folders['pack'],
+                                                          checkpoint_dir=self.folders['train']))
+        with open(os.path.join(self.folders['pack'], 'train', INDEX_NAME), 'r', encoding='utf-8') as f:
+            num_samples = json.load(f)['num_samples']
+        if not skipped:
+            trainer.train(train_config)
+            outputs = [os.path.join(self.folders['train'], trainer.FINAL_MODEL)]
+            self._record('train', 'all', key, outputs)
+        # Throughput of training is in images seen over all epochs
+        seen = num_samples * train_config['epochs']
+        self.profile.record('train', 'all', start, time.perf_counter(), seen, seen, skipped)
+        print(f"[train] {outputs[0]}{' (unchanged, skipped)' if skipped else ''}")
+
+    def _write_profile(self, wall_time):
+        summary = self.profile.summary()
+        print(f"\n{'stage':<12}{'tasks':>7}{'skipped':>9}{'failed':>8}{'busy s':>10}{'wall s':>10}"
+              f"{'items':>9}{'items/s':>10}")
+        for s in summary:
+            print(f"{s['stage']:<12}{s['tasks']:>7}{s['skipped']:>9}{s['failed']:>8}{s['busy_s']:>10.2f}"
+                  f"{s['wall_s']:>10.2f}{s['items_in']:>9}{s['items_per_sec']:>10.1f}")
+        print(f"Pipeline finished in {wall_time:.2f}s")
+
+        profile = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_time_s': wall_time,
+            'config': self.config,
+            'stages': summary,
+            'tasks': self.profile.tasks,
+        }
+        with open(os.path.join(self.config['work_dir'], PROFILE_NAME), 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+
+
+def run_pipeline(config):
+    """Run the pipeline described by a configuration from load_pipeline_config"""
+    return Pipeline(config).run()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the preprocess, dedup, augment, pack and train pipeline.")
+    parser.add_argument('dataset_folder', nargs='?', help="Folder with one sub-folder of raw images per celebrity")
+    parser.add_argument('--config', help="JSON file with pipeline options (see DEFAULT_CONFIG)")
+    parser.add_argument('--work-dir', dest='work_dir')
+    parser.add_argument('--stages', type=lambda value: [s.strip() for s in value.split(',') if s.strip()],
+                        help=f"Comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument('--force', type=lambda value: [s.strip() for s in value.split(',') if s.strip()],
+                        help="Comma-separated stages to rerun even if their inputs are unchanged")
+    parser.add_argument('--num-workers', dest='num_workers', type=int, help="Face detection processes")
+    parser.add_argument('--class-concurrency', dest='class_concurrency', type=int,
+                        help="Celebrity folders processed at the same time")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = {key: value for key, value in vars(args).items() if key != 'config'}
+    try:
+        run_pipeline(load_pipeline_config(args.config, overrides))
+    except PipelineError as e:
+        print(f"\n{e}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,177 +1,408 @@
 import os
 import cv2
+import json
 import numpy as np
 from PIL import Image
 import hashlib
 import mediapipe as mp
-from sklearn.cluster import DBSCAN
+from multiprocessing import Pool
+from dedup import HashIndex, average_hash, cosine_similarity_pairs, first_in_group, group_duplicates, \
+    histogram_features
 
 
 # file path =  C:\Users\USER\Desktop\Dataset
 # Configuration for more lenient duplicate detection
  # Lower confidence = detect more faces
 
-def preprocess_celebrity_images(dataset_folder, output_folder, target_size=(224, 224)):
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MANIFEST_NAME = '.preprocess_manifest.json'
+# Version 3: faces are aligned on the eyes and edge faces are padded instead of dropped
+MANIFEST_VERSION = 3
+
+# Large JPEGs are decoded at reduced scale for face detection, down to this longer side
+DETECTION_SIZE = 640
+_REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# MediaPipe detector owned by the current process (see _init_face_detection)
+_face_detection = None
+
+
+def preprocess_celebrity_images(dataset_folder, output_folder, target_size=(224, 224),
+                                num_workers=1, chunk_size=16, manifest_path=None, hash_radius=0,
+                                celebrities=None, pool=None):
     """
     Preprocess celebrity image dataset addressing key challenges:
     - Face detection and alignment using MediaPipe
     - Duplicate/near-duplicate removal
     - Standardized sizing and normalization
+
+    Face detection can be fanned out over a process pool, and every source image is
+    recorded in a manifest so that a rerun only processes new or changed files.
+
+    Args:
+        dataset_folder (str): Folder with one sub-folder of raw images per celebrity.
+        output_folder (str): Where the processed faces are written.
+        target_size (tuple): (width, height) of the saved face crops.
+        num_workers (int): Number of worker processes. Each worker owns its own
+                           MediaPipe FaceDetection instance; 1 runs everything in-process.
+        chunk_size (int): Number of images handed to a worker at a time.
+        manifest_path (str): Location of the resume manifest. Defaults to
+                             MANIFEST_NAME inside output_folder.
+        hash_radius (int): Hamming radius under which two face hashes count as duplicates
+                           (0 only drops exact hash matches).
+        celebrities (list): Only process these sub-folders. Manifest entries of the other
+                            celebrities are kept as they are.
+        pool (multiprocessing.Pool): Pool from face_detection_pool to use instead of
+                                     creating one, so that several calls can share it.
+                                     Concurrent calls need separate manifests.
     """
     os.makedirs(output_folder, exist_ok=True)
     processed_images = []
-    image_hashes = set()
-
-    # Initialize MediaPipe face detection
-    mp_face_detection = mp.solutions.face_detection
-    mp_drawing = mp.solutions.drawing_utils
+    image_hashes = HashIndex(radius=hash_radius)
+
+    if manifest_path is None:
+        manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    previous_entries = load_manifest(manifest_path, target_size)
+    manifest_entries = {}
+    if celebrities is not None:
+        manifest_entries = {img_path: entry for img_path, entry in previous_entries.items()
+                            if entry['celebrity'] not in celebrities}
+
+    # Hashes of faces kept by earlier runs still take part in duplicate detection
+    for img_path, entry in previous_entries.items():
+        if entry['outcome'] in ('saved', 'near_duplicate') and os.path.exists(img_path) \
+                and _is_entry_current(entry, os.stat(img_path)):
+            image_hashes.add(entry['hash'])
+
+    own_pool = pool is None
+    if own_pool and num_workers > 1:
+        pool = face_detection_pool(num_workers)
+    elif own_pool:
+        _init_face_detection()
 
-    for celebrity_folder in os.listdir(dataset_folder):
-        celebrity_path = os.path.join(dataset_folder, celebrity_folder)
-        if not os.path.isdir(celebrity_path):
-            continue
+    try:
+        for celebrity_folder in (os.listdir(dataset_folder) if celebrities is None else celebrities):
+            celebrity_path = os.path.join(dataset_folder, celebrity_folder)
+            if not os.path.isdir(celebrity_path):
+                continue
 
-        celebrity_output = os.path.join(output_folder, celebrity_folder)
-        os.makedirs(celebrity_output, exist_ok=True)
+            celebrity_output = os.path.join(output_folder, celebrity_folder)
+            os.makedirs(celebrity_output, exist_ok=True)
 
-        images_data = []
-        with mp_face_detection.FaceDetection(model_selection=0, min_detection_confidence=0.5) as face_detection:
+            # Split the folder into images we can reuse from the manifest and images to (re)process
+            kept_entries = []
+            pending = []
             for img_file in os.listdir(celebrity_path):
-                if img_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    img_path = os.path.join(celebrity_path, img_file)
-
-                    # Load and preprocess image
-                    processed_img = process_single_image(img_path, target_size, face_detection)
-                    if processed_img is not None:
-                        # Check for duplicates using perceptual hashing
-                        img_hash = get_image_hash(processed_img)
-                        if img_hash not in image_hashes:
-                            image_hashes.add(img_hash)
-                            images_data.append((processed_img, img_file))
-
-        # Remove near-duplicates using clustering
-        if len(images_data) > 1:
-            filtered_images = remove_near_duplicates(images_data)
-        else:
-            filtered_images = images_data
-
-        # Save processed images
-        for i, (img, original_name) in enumerate(filtered_images):
-            output_path = os.path.join(celebrity_output, f"processed_{i}_{original_name}")
-            cv2.imwrite(output_path, img)
-            processed_images.append({
-                'celebrity': celebrity_folder,
-                'path': output_path,
-                'original': original_name
-            })
+                if not img_file.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                img_path = os.path.join(celebrity_path, img_file)
+                stat = os.stat(img_path)
+                entry = previous_entries.get(img_path)
+                if _is_entry_current(entry, stat):
+                    manifest_entries[img_path] = entry
+                    if entry['outcome'] == 'saved':
+                        kept_entries.append(entry)
+                else:
+                    _remove_output(entry)
+                    pending.append((img_path, img_file, stat))
+
+            tasks = [(img_path, target_size) for img_path, _, _ in pending]
+            if pool is not None:
+                results = pool.imap(_process_image_task, tasks, chunksize=chunk_size)
+            else:
+                results = map(_process_image_task, tasks)
+
+            images_data = []
+            for (img_path, img_file, stat), processed_img in zip(pending, results):
+                entry = {
+                    'celebrity': celebrity_folder,
+                    'original': img_file,
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'outcome': 'no_face',
+                    'output': None,
+                    'hash': None,
+                }
+                manifest_entries[img_path] = entry
+                if processed_img is None:
+                    continue
+
+                # Check for duplicates using perceptual hashing
+                img_hash = get_image_hash(processed_img)
+                entry['hash'] = img_hash
+                if img_hash in image_hashes:
+                    entry['outcome'] = 'duplicate'
+                    continue
+                image_hashes.add(img_hash)
+                # Becomes 'saved' or 'near_duplicate' once the folder has been clustered
+                entry['outcome'] = 'candidate'
+                images_data.append((processed_img, img_file, entry))
+
+            # Remove near-duplicates using clustering. Faces kept by earlier runs come first
+            # so that they win over newly added look-alikes.
+            previous_data = []
+            for entry in kept_entries:
+                img = cv2.imread(entry['output'])
+                if img is not None:
+                    previous_data.append((img, entry['original']))
+            candidates = previous_data + [(img, name) for img, name, _ in images_data]
+            if len(candidates) > 1:
+                kept = {id(item) for item in remove_near_duplicates(candidates)}
+            else:
+                kept = {id(item) for item in candidates}
+
+            for entry in kept_entries:
+                processed_images.append({
+                    'celebrity': celebrity_folder,
+                    'path': entry['output'],
+                    'original': entry['original']
+                })
+
+            # Save processed images
+            next_index = max((entry['index'] for entry in kept_entries), default=-1) + 1
+            for item, (img, original_name, entry) in zip(candidates[len(previous_data):], images_data):
+                if id(item) not in kept:
+                    entry['outcome'] = 'near_duplicate'
+                    continue
+                output_path = os.path.join(celebrity_output, f"processed_{next_index}_{original_name}")
+                cv2.imwrite(output_path, img)
+                entry.update(outcome='saved', output=output_path, index=next_index)
+                next_index += 1
+                processed_images.append({
+                    'celebrity': celebrity_folder,
+                    'path': output_path,
+                    'original': original_name
+                })
+
+            # Persist progress after every folder so an interrupted run can resume
+            save_manifest(manifest_path, target_size, manifest_entries)
+    finally:
+        if own_pool and pool is not None:
+            pool.close()
+            pool.join()
+        elif own_pool:
+            _close_face_detection()
+
+    # Drop outputs whose source images have disappeared since the last run
+    for img_path, entry in previous_entries.items():
+        if img_path not in manifest_entries:
+            _remove_output(entry)
+    save_manifest(manifest_path, target_size, manifest_entries)
 
     return processed_images
 
 
-def process_single_image(img_path, target_size, face_detection):
-    """Process single image: face detection, alignment, and normalization using MediaPipe"""
+def load_manifest(manifest_path, target_size):
+    """Load the entries of a preprocessing manifest, or an empty dict if it is missing or stale"""
+    if not os.path.exists(manifest_path):
+        return {}
     try:
-        # Load image
-        image = cv2.imread(img_path)
-        if image is None:
-            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+    # A different version or target size invalidates every previous result
+    if manifest.get('version') != MANIFEST_VERSION or tuple(manifest.get('target_size', ())) != tuple(target_size):
+        return {}
+    return manifest.get('entries', {})
+
+
+def save_manifest(manifest_path, target_size, entries):
+    """Atomically write the preprocessing manifest"""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'target_size': list(target_size),
+        'entries': entries,
+    }
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-        # Detect faces using MediaPipe
-        results = face_detection.process(image_rgb)
+def _is_entry_current(entry, stat):
+    """Check whether a manifest entry still describes the file on disk"""
+    if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+        return False
+    return entry['outcome'] != 'saved' or os.path.exists(entry['output'])
 
-        if results.detections:
-            # Get the largest face if multiple detected
-            largest_detection = max(results.detections, key=lambda
-                x: x.location_data.relative_bounding_box.width * x.location_data.relative_bounding_box.height)
 
-            # Extract bounding box
-            bbox = largest_detection.location_data.relative_bounding_box
-            h, w, _ = image.shape
+def _remove_output(entry):
+    if entry and entry.get('output') and os.path.exists(entry['output']):
+        os.remove(entry['output'])
 
-            # Convert relative coordinates to absolute
-            x = int(bbox.xmin * w)
-            y = int(bbox.ymin * h)
-            width = int(bbox.width * w)
-            height = int(bbox.height * h)
 
-            # Validate bounding box dimensions
-            if width <= 0 or height <= 0 or x < 0 or y < 0 or x + width > w or y + height > h:
-                return None
+def face_detection_pool(num_workers):
+    """Process pool whose workers each own a MediaPipe face detector"""
+    return Pool(num_workers, initializer=_init_face_detection)
 
-            # Extract face region
-            face_image = image[y:y + height, x:x + width]
 
-            # Check if face_image is valid before resizing
-            if face_image.size == 0 or face_image.shape[0] == 0 or face_image.shape[1] == 0:
-                return None
+def _init_face_detection():
+    """Create the MediaPipe face detector owned by this process (also used as Pool initializer)"""
+    global _face_detection
+    _face_detection = mp.solutions.face_detection.FaceDetection(model_selection=0, min_detection_confidence=0.5)
 
-            # Resize to target size
-            face_image = cv2.resize(face_image, target_size)
 
-            # Keep as uint8 for cv2.imwrite compatibility
-            # Normalization can be done later during model training if needed
+def _close_face_detection():
+    global _face_detection
+    if _face_detection is not None:
+        _face_detection.close()
+        _face_detection = None
 
-            return face_image
-        else:
-            # No face detected
+
+def _process_image_task(task):
+    """Pool entry point: run process_single_image with this process's face detector"""
+    img_path, target_size = task
+    return process_single_image(img_path, target_size, _face_detection)
+
+
+def reduced_read_flag(img_path, detection_size=DETECTION_SIZE):
+    """
+    cv2.imread flag that decodes a JPEG at the smallest 1/2, 1/4 or 1/8 scale whose longer side
+    is still at least detection_size. Other formats and small JPEGs are read at full resolution.
+    """
+    if detection_size is None or not img_path.lower().endswith(('.jpg', '.jpeg')):
+        return cv2.IMREAD_COLOR
+    try:
+        # Opening with PIL only parses the header, the pixels are not decoded
+        with Image.open(img_path) as img:
+            longer_side = max(img.size)
+    except OSError:
+        return cv2.IMREAD_COLOR
+    for factor, flag in _REDUCED_READ_FLAGS:
+        if longer_side // factor >= detection_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def process_single_image(img_path, target_size, face_detection, detection_size=DETECTION_SIZE):
+    """
+    Process single image: face detection, alignment, and normalization using MediaPipe.
+
+    Large JPEGs are decoded at reduced resolution for detection (libjpeg scales during the
+    DCT, which is far cheaper than a full decode). The aligned crop is taken from that
+    reduced image when the face still covers target_size there, and from a full-resolution
+    decode otherwise.
+
+    Args:
+        img_path (str): Image file.
+        target_size (tuple): (width, height) of the returned face.
+        face_detection: MediaPipe FaceDetection instance.
+        detection_size (int): Smallest longer side of the image used for detection.
+                              None always decodes at full resolution.
+    """
+    try:
+        # Load image
+        read_flag = reduced_read_flag(img_path, detection_size)
+        image = cv2.imread(img_path, read_flag)
+        if image is None:
             return None
 
+        detection = detect_face(image, face_detection)
+        if detection is None:
+            return None
+
+        if read_flag != cv2.IMREAD_COLOR:
+            bbox = detection.location_data.relative_bounding_box
+            h, w = image.shape[:2]
+            if bbox.width * w < target_size[0] or bbox.height * h < target_size[1]:
+                # Too small at the reduced scale; the detection is relative, so it applies as is
+                image = cv2.imread(img_path)
+                if image is None:
+                    return None
+
+        return align_face(image, detection, target_size)
+
     except Exception as e:
         print(f"Error processing {img_path}: {e}")
         return None
 
 
-def get_image_hash(image):
-    """Generate perceptual hash for duplicate detection"""
-    # Ensure image is uint8 for proper hashing
-    if image.dtype == np.float32:
-        image = (image * 255).astype(np.uint8)
+def crop_face(image, target_size, face_detection):
+    """Detect the largest face in a decoded BGR image and return it aligned and resized to target_size, or None"""
+    detection = detect_face(image, face_detection)
+    if detection is None:
+        # No face detected
+        return None
+    return align_face(image, detection, target_size)
+
 
-    # Convert to grayscale and resize for hashing
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    resized = cv2.resize(gray, (8, 8))
+def detect_face(image, face_detection):
+    """Largest MediaPipe face detection in a decoded BGR image, or None"""
+    results = face_detection.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if not results.detections:
+        return None
+    return max(results.detections, key=lambda
+        x: x.location_data.relative_bounding_box.width * x.location_data.relative_bounding_box.height)
 
-    # Calculate hash
-    avg = resized.mean()
-    hash_bits = (resized > avg).astype(int)
-    hash_string = ''.join(hash_bits.flatten().astype(str))
-    return hash_string
 
+def align_face(image, detection, target_size):
+    """
+    Cut a detected face out of image, rotated so that the eyes are level, at target_size.
 
-def remove_near_duplicates(images_data, similarity_threshold=0.8):
-    """Remove near-duplicate images using feature similarity"""
-    if len(images_data) <= 1:
-        return images_data
+    The bounding box is rotated about its centre by the angle of the eye line and mapped onto
+    the output with a single warpAffine. Parts of the box that fall outside the image are
+    filled by replicating the border, so faces at the edge of a photo are kept.
 
-    # Extract features for clustering
-    features = []
-    for img, _ in images_data:
-        # Ensure image is uint8 for histogram calculation
-        if img.dtype == np.float32:
-            img = (img * 255).astype(np.uint8)
+    Args:
+        image (np.ndarray): BGR image, at any scale of the one the detection was made on.
+        detection: MediaPipe detection with relative bounding box and keypoints.
+        target_size (tuple): (width, height) of the output.
+
+    Returns:
+        np.ndarray: uint8 BGR face, or None for an empty bounding box.
+    """
+    h, w = image.shape[:2]
+    bbox = detection.location_data.relative_bounding_box
+    box_width = bbox.width * w
+    box_height = bbox.height * h
+    if box_width < 1 or box_height < 1:
+        return None
+    center = np.array([(bbox.xmin + bbox.width / 2) * w, (bbox.ymin + bbox.height / 2) * h])
+
+    angle = 0.0
+    keypoints = detection.location_data.relative_keypoints
+    if len(keypoints) >= 2:
+        # MediaPipe's first two keypoints are the right and left eye (from the subject's view)
+        right_eye, left_eye = keypoints[0], keypoints[1]
+        angle = np.arctan2((left_eye.y - right_eye.y) * h, (left_eye.x - right_eye.x) * w)
+
+    # output = scale * rotate(-angle) * (input - centre) + output centre
+    cos, sin = np.cos(angle), np.sin(angle)
+    linear = np.diag([target_size[0] / box_width, target_size[1] / box_height]) @ np.array([[cos, sin], [-sin, cos]])
+    offset = np.array(target_size, dtype=np.float64) / 2 - linear @ center
+    matrix = np.hstack([linear, offset[:, None]])
+
+    # Keep as uint8 for cv2.imwrite compatibility
+    # Normalization can be done later during model training if needed
+    return cv2.warpAffine(image, matrix, tuple(target_size), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REPLICATE)
 
-        # Simple feature: histogram
-        hist = cv2.calcHist([img], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
-        features.append(hist.flatten())
 
-    features = np.array(features)
+def get_image_hash(image):
+    """Generate perceptual hash (64-bit aHash packed into an int) for duplicate detection"""
+    return average_hash(image)
+
 
-    # Use DBSCAN to cluster similar images
-    clustering = DBSCAN(eps=0.3, min_samples=1, metric='cosine')
-    labels = clustering.fit_predict(features)
+def remove_near_duplicates(images_data, similarity_threshold=0.8):
+    """Remove near-duplicate images using feature similarity"""
+    if len(images_data) <= 1:
+        return images_data
 
-    # Keep one representative from each cluster
-    unique_images = []
-    seen_labels = set()
+    # Simple feature: histogram
+    features = histogram_features([img for img, _ in images_data])
 
-    for i, label in enumerate(labels):
-        if label not in seen_labels:
-            unique_images.append(images_data[i])
-            seen_labels.add(label)
+    # Group images whose cosine distance is within 0.3 of each other (transitively) and keep
+    # one representative from each group. This is the clustering DBSCAN(eps=0.3,
+    # min_samples=1, metric='cosine') produced. Every pair is still compared, but in blocked
+    # matrix products with bounded memory and without the scikit-learn dependency.
+    pairs = cosine_similarity_pairs(features, min_similarity=1 - 0.3)
+    keep = first_in_group(group_duplicates(len(images_data), pairs))
 
-    return unique_images
+    return [item for item, kept in zip(images_data, keep) if kept]
 
 # Example usage:
 # dataset_folder = 'path/to/celebrity/dataset'
@@ -0,0 +1,233 @@
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import cv2
+import numpy as np
+import mediapipe as mp
+from inference_runtime import InferenceModel
+from metrics import QUEUE_TIME, span
+from preprocessing import crop_face
+
+logger = logging.getLogger(__name__)
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+FACE_SIZE = (224, 224)
+
+
+class RecognizerBusy(Exception):
+    """Raised when the batching queue is full or a request waited too long for its result"""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests into batches processed by one worker thread.
+
+    A batch is closed as soon as it holds max_batch_size items or max_wait_ms after its first
+    item was submitted, whichever comes first, so a lone request waits at most max_wait_ms and
+    a burst of requests shares a single forward pass. Items whose caller gave up waiting are
+    dropped instead of being processed.
+
+    Args:
+        process_batch (callable): Receives a list of items and returns a list of results in the same order.
+        max_batch_size (int): Largest batch handed to process_batch.
+        max_wait_ms (float): How long the first item of a batch may wait for company.
+        max_queue (int): Pending items allowed before submit() rejects new ones.
+        name (str): Queue label of the queueing-time metric.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=5.0, max_queue=256, name='recognition'):
+        self.process_batch = process_batch
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Queue an item and block until its result is ready"""
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            raise RecognizerBusy("Too many pending recognition requests")
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Still queued, the worker will skip it
+            future.cancel()
+            raise RecognizerBusy("Timed out waiting for the recognition model")
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = None
+            while len(batch) < self.max_batch_size:
+                if deadline is None:
+                    entry = self._queue.get()
+                else:
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                # Marking the future running fails if its caller timed out and cancelled it
+                if entry[1].done() or not entry[1].set_running_or_notify_cancel():
+                    continue
+                batch.append(entry)
+                if deadline is None:
+                    # Measured from submission, so time spent in the queue counts against max_wait_ms
+                    deadline = entry[2] + self.max_wait
+
+            now = time.perf_counter()
+            for _, _, enqueued in batch:
+                QUEUE_TIME.labels(self.name).observe(now - enqueued)
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+
+class DetectorPool:
+    """
+    Fixed-size pool of objects that must not be shared between threads, such as MediaPipe graphs.
+
+    Instances are created lazily up to `size`. After that, a thread waits for one to be returned,
+    so the number of live graphs does not grow with the number of request threads.
+
+    Args:
+        factory (callable): Creates a new instance.
+        size (int): Maximum number of instances.
+    """
+
+    def __init__(self, factory, size=4):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        """Borrow an instance for the duration of the with block"""
+        try:
+            item = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    item = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                item = self._idle.get()
+        try:
+            yield item
+        finally:
+            self._idle.put(item)
+
+    def close(self):
+        """Close the idle instances that have a close() method"""
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if hasattr(item, 'close'):
+                item.close()
+
+
+class FaceRecognizer:
+    """
+    Serves a classifier checkpoint written by trainer.py (or feature_cache.py), or a folder
+    written by export_model.py.
+
+    Faces are cropped with the same MediaPipe pipeline as preprocessing.process_single_image
+    in the calling thread, using a detector borrowed from a fixed-size pool, then the forward
+    pass runs on micro-batches of concurrent requests.
+
+    Args:
+        model_path (str): Checkpoint with 'model' weights and 'classes', or an export folder.
+        backend (str): InferenceModel backend, 'auto' picks the fastest one available.
+        quantized (bool): Use the int8 artifacts of an export folder.
+        max_batch_size (int): Largest batch per forward pass.
+        max_wait_ms (float): Longest time a request waits for others to join its batch.
+        timeout (float): Seconds a request may wait for its result before RecognizerBusy is raised.
+        top_k (int): Number of predictions returned per image.
+        num_detectors (int): Size of the face detector pool, i.e. concurrent face detections.
+    """
+
+    def __init__(self, model_path, max_batch_size=16, max_wait_ms=5.0, timeout=10.0, top_k=3,
+                 backend='auto', quantized=False, num_detectors=4):
+        self.model = InferenceModel(model_path, backend=backend, quantized=quantized)
+        self.classes = self.model.classes
+        self.timeout = timeout
+        self.top_k = min(top_k, len(self.classes))
+        # MediaPipe graphs are not thread-safe, so each detection borrows one from the pool
+        self._detectors = DetectorPool(self._create_face_detection, num_detectors)
+        self._batcher = MicroBatcher(self._predict_batch, max_batch_size, max_wait_ms)
+
+    @staticmethod
+    def _create_face_detection():
+        return mp.solutions.face_detection.FaceDetection(model_selection=0, min_detection_confidence=0.5)
+
+    def preprocess(self, image_bytes):
+        """Decode an uploaded image and return the normalized CHW face array, or None if no face was found"""
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        with self._detectors.acquire() as face_detection:
+            face = crop_face(image, FACE_SIZE, face_detection)
+        if face is None:
+            return None
+        face = (cv2.cvtColor(face, cv2.COLOR_BGR2RGB).astype(np.float32) / 255 - IMAGENET_MEAN) / IMAGENET_STD
+        return face.transpose(2, 0, 1)
+
+    def _predict_batch(self, faces):
+        embeddings, logits = self.model(np.stack(faces))
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        indices = np.argsort(-probabilities, axis=1)[:, :self.top_k]
+        scores = np.take_along_axis(probabilities, indices, axis=1)
+        return [{
+            'predictions': [{'identity': self.classes[i], 'confidence': round(s, 4)} for s, i in zip(row_s, row_i)],
+            'embedding': embedding,
+        } for row_s, row_i, embedding in zip(scores.tolist(), indices.tolist(), embeddings)]
+
+    def analyze(self, image_bytes):
+        """
+        Run an encoded image through the model.
+
+        Returns:
+            dict: 'predictions' (top-k {'identity', 'confidence'}, best first) and 'embedding'
+                  (2048-d backbone embedding), or None if no face was found.
+        """
+        with span('face_detection'):
+            tensor = self.preprocess(image_bytes)
+        if tensor is None:
+            return None
+        with span('model'):
+            return self._batcher.submit(tensor, timeout=self.timeout)
+
+    def recognize(self, image_bytes):
+        """Top-k predictions for the face in an encoded image, or None if no face was found"""
+        analysis = self.analyze(image_bytes)
+        return analysis['predictions'] if analysis is not None else None
@@ -0,0 +1,146 @@
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.!?]+$')
+# Seconds between deletions of expired rows from the shared tier
+PURGE_INTERVAL = 300
+
+
+def normalize_message(text):
+    """Case- and whitespace-insensitive form of a message, without trailing punctuation"""
+    return _TRAILING_PUNCTUATION.sub('', _WHITESPACE.sub(' ', text).strip().casefold())
+
+
+def make_cache_key(messages, model, temperature):
+    """
+    Cache key of a chat completion request.
+
+    The system prompt only has its whitespace collapsed; user messages are fully normalized,
+    so "Hello JARVIS" and "hello jarvis!" share an entry.
+    """
+    normalized = [
+        (m['role'], normalize_message(m['content']) if m['role'] == 'user' else _WHITESPACE.sub(' ', m['content']).strip())
+        for m in messages
+    ]
+    payload = json.dumps([normalized, model, temperature], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of chat completions.
+
+    The first tier is an in-process LRU with a TTL. The optional second tier is a SQLite
+    database shared by every worker process on the host; entries found there are promoted
+    to the in-process tier.
+
+    Args:
+        max_entries (int): Capacity of the in-process LRU.
+        ttl (float): Seconds an entry stays valid.
+        sqlite_path (str): Optional SQLite file for the shared tier.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, sqlite_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sqlite_path = sqlite_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._next_purge = 0.0
+
+        if sqlite_path:
+            connection = self._connection()
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, expires REAL NOT NULL)')
+            connection.commit()
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(self.sqlite_path, timeout=1.0)
+        return self._local.connection
+
+    def get(self, key):
+        """Cached response for `key`, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self.sqlite_path:
+            try:
+                row = self._connection().execute(
+                    'SELECT response, expires FROM responses WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                with self._lock:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, response):
+        """Cache `response` under `key` in every tier"""
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, response, expires)
+
+        if self.sqlite_path:
+            try:
+                connection = self._connection()
+                connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, response, expires))
+                if self._purge_due():
+                    # Drop expired rows so the shared tier does not grow forever
+                    connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+                connection.commit()
+            except sqlite3.Error:
+                # The shared tier is best effort, e.g. when another worker holds the write lock
+                pass
+
+    def _purge_due(self):
+        """True at most once every PURGE_INTERVAL seconds per process"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return False
+            self._next_purge = now + PURGE_INTERVAL
+            return True
+
+    def _store(self, key, response, expires):
+        self._entries[key] = (response, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
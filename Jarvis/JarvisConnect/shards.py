@@ -0,0 +1,165 @@
+import os
+import json
+import argparse
+import time
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+INDEX_NAME = 'index.json'
+LABELS_NAME = 'labels.npy'
+SHARD_FORMAT_VERSION = 1
+
+
+def pack_dataset(image_folder, output_folder, image_size=(224, 224), shard_size=4096, include=None):
+    """
+    Decode an ImageFolder-style dataset once and pack it into fixed-size uint8 shards.
+
+    Each shard is a .npy array of shape (N, H, W, 3) in RGB order that can be memory-mapped.
+    labels.npy holds the label of every sample and index.json the class names and shard layout.
+
+    Args:
+        image_folder (str): Folder with one sub-folder of images per class (processed or augmented data).
+        output_folder (str): Where the shards are written.
+        image_size (tuple): (height, width) of the stored images. Images of another size are resized.
+        shard_size (int): Maximum number of images per shard.
+        include (callable): Optional predicate on image paths, only matching images are packed.
+
+    Returns:
+        dict: The written index.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    height, width = image_size
+
+    classes = sorted(entry.name for entry in os.scandir(image_folder) if entry.is_dir())
+    samples = []
+    for label, class_name in enumerate(classes):
+        class_path = os.path.join(image_folder, class_name)
+        for img_file in sorted(os.listdir(class_path)):
+            img_path = os.path.join(class_path, img_file)
+            if img_file.lower().endswith(IMAGE_EXTENSIONS) and (include is None or include(img_path)):
+                samples.append((img_path, label))
+
+    start_time = time.time()
+    shards = []
+    labels = []
+    for shard_idx, start in enumerate(range(0, len(samples), shard_size)):
+        chunk = samples[start:start + shard_size]
+        shard_file = f"shard_{shard_idx:05d}.npy"
+        array = np.lib.format.open_memmap(os.path.join(output_folder, shard_file), mode='w+',
+                                          dtype=np.uint8, shape=(len(chunk), height, width, 3))
+        count = 0
+        for img_path, label in chunk:
+            image = cv2.imread(img_path)
+            if image is None:
+                print(f"Skipping unreadable image {img_path}")
+                continue
+            if image.shape[:2] != (height, width):
+                image = cv2.resize(image, (width, height))
+            array[count] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            labels.append(label)
+            count += 1
+        array.flush()
+        del array
+        # Rows left over by unreadable images are ignored through 'count'
+        shards.append({'file': shard_file, 'count': count})
+
+    np.save(os.path.join(output_folder, LABELS_NAME), np.array(labels, dtype=np.int64))
+    index = {
+        'version': SHARD_FORMAT_VERSION,
+        'classes': classes,
+        'image_size': [height, width],
+        'num_samples': len(labels),
+        'shards': shards,
+    }
+    with open(os.path.join(output_folder, INDEX_NAME), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+
+    elapsed = time.time() - start_time
+    print(f"Packed {len(labels)} images from {len(classes)} classes into {len(shards)} shards "
+          f"in {elapsed:.2f}s ({len(labels) / max(elapsed, 1e-9):.1f} images/sec)")
+    return index
+
+
+def is_shard_folder(folder):
+    """Check whether a folder was written by pack_dataset"""
+    return os.path.isfile(os.path.join(folder, INDEX_NAME))
+
+
+class ShardDataset(Dataset):
+    """
+    Reads shards written by pack_dataset without decoding or copying.
+
+    Samples are uint8 HWC RGB tensors that share memory with the memory-mapped shard
+    (copy-on-write mapping, so torch.from_numpy gets a writable array). Normalization is left
+    to normalize_batch, which handles a whole batch at once after collation.
+
+    Args:
+        root (str): Folder written by pack_dataset.
+        hflip (bool): Randomly flip samples horizontally (p=0.5), for training.
+    """
+
+    def __init__(self, root, hflip=False):
+        self.root = root
+        self.hflip = hflip
+        with open(os.path.join(root, INDEX_NAME), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        if self.index.get('version') != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard format version in {root}")
+
+        self.classes = self.index['classes']
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.classes)}
+        self.labels = np.load(os.path.join(root, LABELS_NAME))
+        self.targets = self.labels.tolist()
+        counts = [shard['count'] for shard in self.index['shards']]
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        # Opened lazily so that every DataLoader worker maps the files itself
+        self._shards = None
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def _open(self):
+        self._shards = [np.load(os.path.join(self.root, shard['file']), mmap_mode='c')
+                        for shard in self.index['shards']]
+
+    def __getitem__(self, index):
+        if self._shards is None:
+            self._open()
+        shard = int(np.searchsorted(self._offsets, index, side='right')) - 1
+        image = torch.from_numpy(self._shards[shard][index - self._offsets[shard]])
+        if self.hflip and torch.rand(1).item() < 0.5:
+            image = image.flip(1)
+        return image, int(self.labels[index])
+
+    def __getstate__(self):
+        # Never pickle open memory maps into DataLoader workers
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+
+def normalize_batch(images, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """
+    Convert a collated uint8 NHWC batch from ShardDataset into a normalized float NCHW tensor.
+    The result keeps the NHWC layout in memory, i.e. it is already torch.channels_last.
+    """
+    images = images.permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(mean, dtype=images.dtype, device=images.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=images.dtype, device=images.device).view(1, 3, 1, 1)
+    return images.sub_(mean).div_(std)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack an image folder dataset into memory-mappable uint8 shards.")
+    parser.add_argument('image_folder', help="Folder with one sub-folder of images per class")
+    parser.add_argument('output_folder', help="Where to write the shards")
+    parser.add_argument('--image-size', type=int, default=224, help="Side of the stored square images")
+    parser.add_argument('--shard-size', type=int, default=4096, help="Images per shard")
+    args = parser.parse_args()
+
+    pack_dataset(args.image_folder, args.output_folder, (args.image_size, args.image_size), args.shard_size)
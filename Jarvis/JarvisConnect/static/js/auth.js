@@ -15,6 +15,9 @@ class AuthManager {
         this.selectedFile = null;
         this.isProcessing = false;
         
+        // The server enrolls first-time users and verifies everyone else
+        this.authenticateEndpoint = '/api/authenticate';
+        
         this.initEventListeners();
         this.checkExistingAuth();
     }
@@ -97,6 +100,7 @@ class AuthManager {
             const resizedDataURL = await resizeImageToBase64(file, 128, 128, 0.8);
             
             this.selectedFile = {
+                file: file,
                 name: file.name,
                 size: file.size,
                 type: file.type,
@@ -201,15 +205,19 @@ class AuthManager {
         try {
             const username = this.usernameInput.value.trim();
             
-            // Simulate authentication process
-            await new Promise(resolve => setTimeout(resolve, 2000));
+            // Verify the biometric scan against the enrolled gallery, enrolling first-time users
+            const recognition = await this.verifyFace(this.selectedFile.file, username);
             
             // Create auth data
             const authData = {
                 username: username,
                 avatar: this.selectedFile.dataURL,
+                recognition: recognition,
                 timestamp: new Date().toISOString(),
-                sessionId: 'session_' + Date.now()
+                // Keys the server-side conversation history, so it must not be guessable
+                sessionId: 'session_' + (window.crypto && crypto.randomUUID
+                    ? crypto.randomUUID()
+                    : Date.now() + '_' + Math.random().toString(36).slice(2))
             };
             
             // Store in session storage
@@ -229,13 +237,58 @@ class AuthManager {
             
         } catch (error) {
             console.error('Authentication error:', error);
-            showError('Authentication failed. Please try again.');
+            showError(error.userMessage || 'Authentication failed. Please try again.');
         } finally {
             this.isProcessing = false;
             setButtonLoading(this.submitBtn, false);
         }
     }
     
+    async verifyFace(file, username) {
+        // Rejected scans come back as an error with the server's message
+        const result = await this.postImage(this.authenticateEndpoint, file, username);
+        
+        // This deployment has no face recognition at all, continue without it
+        if (result === null) {
+            return null;
+        }
+        
+        return {
+            identity: result.identity,
+            confidence: result.confidence,
+            enrolled: true
+        };
+    }
+    
+    async postImage(endpoint, file, username) {
+        // Send the original upload, the resized avatar is too small for recognition
+        const formData = new FormData();
+        formData.append('image', file);
+        formData.append('username', username);
+        
+        const response = await fetch(endpoint, {
+            method: 'POST',
+            body: formData
+        });
+        
+        // Proxies and crashed workers may answer with something other than JSON
+        const data = await response.json().catch(() => ({}));
+        
+        // Only an explicit "not configured" skips the scan. Every other failure, including a
+        // busy recognizer, fails the sign-in instead of letting it through unchecked.
+        if (response.status === 501 && data.configured === false) {
+            return null;
+        }
+        
+        if (!response.ok || !data.success) {
+            const error = new Error(`HTTP error! status: ${response.status}`);
+            error.userMessage = data.error || 'Biometric verification is unavailable. Please try again.';
+            throw error;
+        }
+        
+        return data;
+    }
+    
     reset() {
         this.form.reset();
         this.selectedFile = null;
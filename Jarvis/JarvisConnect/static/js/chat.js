@@ -18,8 +18,9 @@ class ChatManager {
         this.messages = [];
         this.isTyping = false;
         
-        // API endpoint for chat messages
+        // API endpoints for chat messages
         this.apiEndpoint = '/api/chat';
+        this.streamEndpoint = '/api/chat/stream';
         
         this.initAuth();
         this.initEventListeners();
@@ -100,9 +101,10 @@ class ChatManager {
     
     addMessage(message) {
         this.messages.push(message);
-        this.renderMessage(message);
+        const messageDiv = this.renderMessage(message);
         this.saveMessages();
         scrollToBottom(this.messagesContainer);
+        return messageDiv;
     }
     
     renderMessage(message) {
@@ -141,6 +143,7 @@ class ChatManager {
         }
         
         this.messagesWrapper.appendChild(messageDiv);
+        return messageDiv;
     }
     
     renderAllMessages() {
@@ -198,39 +201,45 @@ class ChatManager {
             const requestData = {
                 message: userMessage,
                 username: this.authData.username,
+                // The server keeps the conversation history for this session
+                sessionId: this.authData.sessionId,
                 timestamp: new Date().toISOString()
             };
             
-            // Send POST request to Flask API
-            const response = await fetch(this.apiEndpoint, {
+            // Send POST request to the streaming endpoint
+            const response = await fetch(this.streamEndpoint, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
                 body: JSON.stringify(requestData)
             });
             
-            this.hideTypingIndicator();
-            
             if (!response.ok) {
+                this.hideTypingIndicator();
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const data = await response.json();
-            
-            if (data.success && data.response) {
-                const jarvisMessage = {
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.body || !contentType.includes('text/event-stream')) {
+                // Browsers without streaming fetch bodies get the whole reply at once
+                this.hideTypingIndicator();
+                const data = await response.json();
+                if (!data.success || !data.response) {
+                    throw new Error(data.error || 'Unknown error occurred');
+                }
+                this.addMessage({
                     id: 'jarvis_' + Date.now(),
                     content: data.response,
                     sender: 'jarvis',
                     timestamp: new Date()
-                };
-                
-                this.addMessage(jarvisMessage);
-            } else {
-                throw new Error(data.error || 'Unknown error occurred');
+                });
+                return;
             }
             
+            await this.readResponseStream(response);
+            
         } catch (error) {
             console.error('Error sending message to JARVIS:', error);
             this.hideTypingIndicator();
@@ -261,6 +270,79 @@ class ChatManager {
         }
     }
     
+    async readResponseStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let jarvisMessage = null;
+        let contentElement = null;
+        let renderScheduled = false;
+        
+        // Repaint at most once per frame, however fast tokens arrive
+        const render = () => {
+            renderScheduled = false;
+            contentElement.textContent = jarvisMessage.content;
+            scrollToBottom(this.messagesContainer);
+        };
+        
+        const handleEvent = (event, data) => {
+            if (event === 'error') {
+                throw new Error(data.error || 'Stream interrupted (503)');
+            }
+            if (event !== 'message' || !data.delta) return;
+            
+            if (!jarvisMessage) {
+                // First token: replace the typing indicator with the message bubble
+                this.hideTypingIndicator();
+                jarvisMessage = {
+                    id: 'jarvis_' + Date.now(),
+                    content: '',
+                    sender: 'jarvis',
+                    timestamp: new Date()
+                };
+                contentElement = this.addMessage(jarvisMessage).querySelector('.message-content');
+            }
+            jarvisMessage.content += data.delta;
+            if (!renderScheduled) {
+                renderScheduled = true;
+                requestAnimationFrame(render);
+            }
+        };
+        
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                
+                // Events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    
+                    let event = 'message';
+                    const dataLines = [];
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                    });
+                    if (dataLines.length) handleEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        } finally {
+            this.hideTypingIndicator();
+            if (jarvisMessage) {
+                if (renderScheduled) render();
+                this.saveMessages();
+            }
+        }
+        
+        if (!jarvisMessage) {
+            throw new Error('Empty response from JARVIS systems');
+        }
+    }
+    
     handleLogout() {
         // Confirm logout
         if (confirm('Are you sure you want to logout?')) {
@@ -0,0 +1,210 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+import mimetypes
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = 'static'
+DIST_DIR = os.path.join('static', 'dist')
+MANIFEST_NAME = 'manifest.json'
+PAGES = ('index.html', 'chat.html')
+ASSET_EXTENSIONS = ('.css', '.js')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# Strings are matched first, so a '/*' inside one does not start a comment
+_CSS_STRING_OR_COMMENT = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+_CSS_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,])\s*')
+_CSS_DELIMITER = re.compile(r'([{};])')
+_CSS_COLON = re.compile(r' ?: ?')
+# A comment that fills whole lines; it cannot contain '*/', so it never reaches into code
+_JS_BLOCK_COMMENT = re.compile(r'^[ \t]*/\*(?:[^*]|\*(?!/))*\*/[ \t]*$', re.M)
+
+
+def minify_css(css):
+    """
+    Strip comments and redundant whitespace, leaving quoted strings untouched.
+
+    Spaces around ':' are only dropped inside declarations. In selectors they are
+    significant: `a :hover` (any hovered descendant of a) is not `a:hover`.
+    """
+    strings = []
+
+    def hide(match):
+        if match.group(1) is None:
+            return ' '
+        strings.append(match.group(1))
+        return f"\x00{len(strings) - 1}\x00"
+
+    css = _CSS_PUNCTUATION.sub(r'\1', _CSS_SPACE.sub(' ', _CSS_STRING_OR_COMMENT.sub(hide, css)))
+    tokens = _CSS_DELIMITER.split(css)
+    # tokens alternates text and delimiters; text followed by '{' is a selector or at-rule prelude
+    for i in range(0, len(tokens), 2):
+        if i + 1 >= len(tokens) or tokens[i + 1] != '{':
+            tokens[i] = _CSS_COLON.sub(':', tokens[i])
+    css = ''.join(tokens).replace(';}', '}').strip()
+    return _CSS_PLACEHOLDER.sub(lambda match: strings[int(match.group(1))], css)
+
+
+def minify_js(js):
+    """
+    Conservative line-based JS minification: drops indentation, blank lines and comment-only
+    lines, but keeps line breaks (so automatic semicolon insertion is unaffected) and leaves
+    the inside of multi-line template literals alone.
+    """
+    try:
+        import rjsmin
+        return rjsmin.jsmin(js)
+    except ImportError:
+        pass
+
+    lines = []
+    in_template = False
+    for line in _JS_BLOCK_COMMENT.sub('', js).splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        # An odd number of unescaped backticks opens or closes a template literal
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+
+def _write_compressed(path, data):
+    """Write data plus .gz (and .br when brotli is installed) variants"""
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build_static_assets(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """
+    Minify, fingerprint and precompress the CSS/JS assets and rewrite the pages to use them.
+
+    Every asset is written as name.<content hash>.ext with .gz and .br siblings, so it can be
+    cached forever; the pages keep their names and reference the fingerprinted files.
+    manifest.json maps the original asset paths to the fingerprinted ones and holds the
+    ETag of every file.
+
+    Args:
+        static_dir (str): Source folder with the pages, css/ and js/.
+        dist_dir (str): Output folder, replaced on every build.
+
+    Returns:
+        dict: The manifest.
+    """
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+    manifest = {'assets': {}, 'etags': {}}
+    dist_name = os.path.basename(os.path.normpath(dist_dir))
+
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if d != dist_name]
+        for file_name in sorted(files):
+            if not file_name.endswith(ASSET_EXTENSIONS):
+                continue
+            source = os.path.join(root, file_name)
+            relative_path = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'r', encoding='utf-8') as f:
+                text = f.read()
+            data = (minify_css(text) if file_name.endswith('.css') else minify_js(text)).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            base, ext = os.path.splitext(relative_path)
+            fingerprinted = f"{base}.{digest[:10]}{ext}"
+
+            os.makedirs(os.path.join(dist_dir, os.path.dirname(fingerprinted)), exist_ok=True)
+            _write_compressed(os.path.join(dist_dir, fingerprinted), data)
+            manifest['assets'][relative_path] = fingerprinted
+            manifest['etags'][fingerprinted] = digest[:16]
+            print(f"{relative_path} -> {fingerprinted} ({len(text)} -> {len(data)} bytes)")
+
+    for page in PAGES:
+        with open(os.path.join(static_dir, page), 'r', encoding='utf-8') as f:
+            html = f.read()
+        for relative_path, fingerprinted in manifest['assets'].items():
+            html = re.sub(r'''((?:href|src)=["'])/?%s(["'])''' % re.escape(relative_path), r'\g<1>%s\g<2>' % fingerprinted,
+                          html)
+        data = html.encode('utf-8')
+        _write_compressed(os.path.join(dist_dir, page), data)
+        manifest['etags'][page] = hashlib.sha256(data).hexdigest()[:16]
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Built {len(manifest['assets'])} assets and {len(PAGES)} pages into {dist_dir}"
+          f"{'' if brotli else ' (brotli not installed, gzip only)'}")
+    return manifest
+
+
+class StaticAssets:
+    """
+    Serves the output of build_static_assets.
+
+    Fingerprinted files get an immutable Cache-Control; pages and requests by original name
+    are revalidated with their ETag. The brotli or gzip variant is sent when the client
+    accepts it.
+    """
+
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = os.path.abspath(dist_dir)
+        with open(os.path.join(dist_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.assets = manifest['assets']
+        self.etags = manifest['etags']
+
+    @classmethod
+    def load(cls, dist_dir=DIST_DIR):
+        """StaticAssets for dist_dir, or None if the assets have not been built"""
+        if not os.path.exists(os.path.join(dist_dir, MANIFEST_NAME)):
+            return None
+        return cls(dist_dir)
+
+    def send(self, relative_path):
+        """Response for a page or asset path relative to the static folder"""
+        immutable = relative_path in self.etags and relative_path not in PAGES
+        relative_path = self.assets.get(relative_path, relative_path)
+        if relative_path not in self.etags:
+            abort(404)
+        path = safe_join(self.dist_dir, relative_path)
+
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] > 0 and os.path.exists(path + suffix):
+                encoding = candidate
+                path += suffix
+                break
+
+        response = send_file(path, mimetype=mimetypes.guess_type(relative_path)[0], conditional=True,
+                             etag=f"{self.etags[relative_path]}-{encoding or 'identity'}")
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if immutable else 'no-cache'
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Minify, fingerprint and precompress the static assets.")
+    parser.add_argument('--static-dir', default=STATIC_DIR)
+    parser.add_argument('--dist-dir', default=DIST_DIR)
+    args = parser.parse_args()
+
+    build_static_assets(args.static_dir, args.dist_dir)
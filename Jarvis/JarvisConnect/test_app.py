@@ -0,0 +1,168 @@
+import io
+import json
+import numpy as np
+import pytest
+import app as app_module
+from conversation_store import ConversationStore
+from embedding_index import EmbeddingIndex
+from llm_backends import LLMBackendError, MockBackend
+from response_cache import ResponseCache
+
+# Every fake "image" is the name of a face, mapped to an orthogonal embedding
+FACES = {b'alice': 0, b'alice_again': 0, b'mallory': 1, b'bob': 2}
+
+
+class FakeRecognizer:
+    def analyze(self, image_bytes):
+        embedding = np.zeros(4, dtype=np.float32)
+        embedding[FACES[image_bytes]] = 1
+        return {'embedding': embedding, 'predictions': [{'identity': 'unknown', 'confidence': 0.5}]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, 'recognizer', FakeRecognizer())
+    monkeypatch.setattr(app_module, 'gallery', EmbeddingIndex(dim=4))
+    return app_module.app.test_client()
+
+
+def post_face(client, endpoint, username, face):
+    return client.post(endpoint, data={'username': username, 'image': (io.BytesIO(face), 'face.jpg')},
+                       content_type='multipart/form-data')
+
+
+def test_authenticate_enrolls_first_time_users_then_verifies(client):
+    first = post_face(client, '/api/authenticate', 'alice', b'alice')
+    assert first.status_code == 200 and first.get_json()['outcome'] == 'enrolled'
+
+    again = post_face(client, '/api/authenticate', 'alice', b'alice_again')
+    assert again.status_code == 200 and again.get_json()['outcome'] == 'verified'
+    # Verifying does not grow the gallery
+    assert len(app_module.gallery) == 1
+
+
+def test_authenticate_rejects_a_different_face(client):
+    post_face(client, '/api/authenticate', 'alice', b'alice')
+    response = post_face(client, '/api/authenticate', 'alice', b'mallory')
+    assert response.status_code == 401
+    assert not response.get_json()['success']
+
+
+def test_enroll_cannot_add_a_foreign_face_to_an_existing_user(client):
+    post_face(client, '/api/enroll', 'alice', b'alice')
+    response = post_face(client, '/api/enroll', 'alice', b'mallory')
+    assert response.status_code == 403
+    assert len(app_module.gallery) == 1
+
+    # So mallory still cannot sign in as alice
+    assert post_face(client, '/api/authenticate', 'alice', b'mallory').status_code == 401
+
+
+def test_enroll_accepts_more_faces_of_the_same_user(client):
+    post_face(client, '/api/enroll', 'alice', b'alice')
+    assert post_face(client, '/api/enroll', 'alice', b'alice_again').status_code == 200
+    assert post_face(client, '/api/enroll', 'bob', b'bob').status_code == 200
+    assert len(app_module.gallery) == 3
+
+
+def test_missing_recognizer_is_reported_as_not_configured(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'recognizer', None)
+    response = post_face(client, '/api/authenticate', 'alice', b'alice')
+    assert response.status_code == 501
+    assert response.get_json()['configured'] is False
+
+
+def test_busy_recognizer_is_not_reported_as_not_configured(client, monkeypatch):
+    from recognition import RecognizerBusy
+
+    class BusyRecognizer:
+        def analyze(self, image_bytes):
+            raise RecognizerBusy('queue full')
+
+    monkeypatch.setattr(app_module, 'RecognizerBusy', RecognizerBusy, raising=False)
+    monkeypatch.setattr(app_module, 'recognizer', BusyRecognizer())
+    response = post_face(client, '/api/authenticate', 'alice', b'alice')
+    assert response.status_code == 503
+    assert 'configured' not in response.get_json()
+
+
+class DroppedStreamBackend(MockBackend):
+    """Sends one delta, then loses the upstream connection"""
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        yield 'Good '
+        raise LLMBackendError('connection reset')
+
+
+class UnreachableBackend(MockBackend):
+    """Fails before the first delta, after every failover attempt"""
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        raise LLMBackendError('all models failed')
+        yield
+
+
+@pytest.fixture
+def chat_client(monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_backend', MockBackend(latency_ms=0, tokens_per_sec=0, response_tokens=6))
+    monkeypatch.setattr(app_module, 'response_cache', ResponseCache(16, 60))
+    monkeypatch.setattr(app_module, 'conversation_store', ConversationStore())
+    return app_module.app.test_client()
+
+
+def parse_events(body):
+    """(event name, JSON payload) of every Server-Sent Event in a response body"""
+    assert body.endswith('\n\n')
+    events = []
+    for block in body[:-2].split('\n\n'):
+        lines = block.split('\n')
+        name = lines[0][len('event: '):] if lines[0].startswith('event: ') else None
+        assert lines[-1].startswith('data: ') and len(lines) == (2 if name else 1)
+        events.append((name, json.loads(lines[-1][len('data: '):])))
+    return events
+
+
+def test_stream_sends_deltas_then_done(chat_client):
+    response = chat_client.post('/api/chat/stream', json={'message': 'Hello', 'username': 'alice', 'sessionId': 's'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    events = parse_events(response.get_data(as_text=True))
+    assert events[-1] == ('done', {'success': True})
+    deltas = [payload['delta'] for name, payload in events[:-1] if name is None]
+    assert len(deltas) == len(events) - 1 == 6
+    expected = app_module.llm_backend.complete([{'role': 'user', 'content': 'Hello'}])
+    assert ''.join(deltas) == expected
+    # The streamed response joins the session's history
+    assert app_module.conversation_store.build_messages('alice\x00s', 'system', 'next')[-2]['content'] == expected
+
+
+def test_stream_failing_midway_ends_with_an_error_event(chat_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_backend', DroppedStreamBackend())
+    response = chat_client.post('/api/chat/stream', json={'message': 'Hello'})
+    events = parse_events(response.get_data(as_text=True))
+    assert events[0] == (None, {'delta': 'Good '})
+    assert events[-1][0] == 'error' and events[-1][1]['success'] is False
+    assert len(events) == 2
+    # A partial response is never cached
+    assert app_module.response_cache.stats()['size'] == 0
+
+
+def test_stream_failing_before_the_first_delta_is_a_503(chat_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_backend', UnreachableBackend())
+    response = chat_client.post('/api/chat/stream', json={'message': 'Hello'})
+    assert response.status_code == 503
+    assert response.is_json and response.get_json()['success'] is False
+
+
+def test_stream_requires_a_message(chat_client):
+    assert chat_client.post('/api/chat/stream', json={}).status_code == 400
+
+
+def test_cached_response_is_replayed_as_one_delta(chat_client):
+    first = parse_events(chat_client.post('/api/chat/stream', json={'message': 'Hello'}).get_data(as_text=True))
+    expected = ''.join(payload['delta'] for name, payload in first if name is None)
+
+    replay = parse_events(chat_client.post('/api/chat/stream', json={'message': 'Hello'}).get_data(as_text=True))
+    assert replay == [(None, {'delta': expected}), ('done', {'success': True, 'cached': True})]
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import pytest
+from starlette.testclient import TestClient
+import asgi_app
+from asgi_app import ChatOverloaded, ConcurrencyLimiter, SlotStreamingResponse
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def upstream_deltas(state):
+    try:
+        for delta in ('Good ', 'evening'):
+            yield delta
+    finally:
+        state['upstream_closed'] = True
+
+
+async def events(first_delta, deltas):
+    yield f"data: {first_delta}\n\n".encode()
+    async for delta in deltas:
+        yield f"data: {delta}\n\n".encode()
+
+
+def test_queue_timeout_does_not_leak_a_permit():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(ChatOverloaded) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 503
+        limiter.release()
+        # The only permit is free again
+        await asyncio.wait_for(limiter.acquire(), 1)
+        assert (limiter.in_flight, limiter.waiting) == (1, 0)
+
+    run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_a_permit():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, queue_timeout=5)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # Free the permit and cancel the waiter in the same loop iteration
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(limiter.acquire(), 1)
+        assert (limiter.in_flight, limiter.waiting) == (1, 0)
+
+    run(scenario())
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=0, queue_timeout=1)
+        await limiter.acquire()
+        with pytest.raises(ChatOverloaded) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 429
+
+    run(scenario())
+
+
+async def stream(spec_version, receive, send):
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=0, queue_timeout=1)
+    await limiter.acquire()
+    state = {}
+    deltas = upstream_deltas(state)
+    # Like the endpoint, the upstream stream is already open when the response is built
+    first_delta = await anext(deltas)
+    response = SlotStreamingResponse(events(first_delta, deltas), limiter, deltas, media_type='text/event-stream')
+    scope = {'type': 'http', 'asgi': {'spec_version': spec_version}}
+    try:
+        await response(scope, receive, send)
+    except Exception:
+        pass
+    return limiter, state
+
+
+def test_slot_is_released_when_the_client_disconnects_before_the_body():
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        await asyncio.sleep(1)
+
+    limiter, state = run(stream('2.0', receive, send))
+    assert limiter.in_flight == 0
+    assert state['upstream_closed']
+
+
+def test_slot_is_released_when_sending_fails():
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    limiter, state = run(stream('2.4', receive, send))
+    assert limiter.in_flight == 0
+    assert state['upstream_closed']
+
+
+def test_slot_is_released_after_a_complete_stream():
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        sent.append(message)
+
+    limiter, state = run(stream('2.4', receive, send))
+    assert limiter.in_flight == 0
+    assert b''.join(m.get('body', b'') for m in sent) == b"data: Good \n\ndata: evening\n\n"
+
+
+def test_cache_and_history_calls_run_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def prepare_chat(user_message, username, session_id):
+        threads.append(threading.current_thread())
+        return [], 'key', 'Cached answer'
+
+    def remember_response(*args, **kwargs):
+        threads.append(threading.current_thread())
+
+    monkeypatch.setattr(asgi_app.flask_app, 'prepare_chat', prepare_chat)
+    monkeypatch.setattr(asgi_app.flask_app, 'remember_response', remember_response)
+    with TestClient(asgi_app.app) as client:
+        loop_thread = client.portal.call(threading.current_thread)
+        response = client.post('/api/chat', json={'message': 'Hello', 'sessionId': 's'})
+
+    assert response.json() == {'success': True, 'response': 'Cached answer', 'cached': True}
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+def test_stream_failing_after_the_first_delta_is_counted(monkeypatch):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    from llm_backends import LLMBackendError, MockBackend
+
+    class DroppedStreamBackend(MockBackend):
+        async def astream(self, messages, temperature=0.7, max_tokens=1024):
+            yield 'Good '
+            raise LLMBackendError('connection reset')
+
+    def stream_errors():
+        return prometheus_client.REGISTRY.get_sample_value(
+            'jarvis_errors_total', {'route': '/api/chat/stream', 'status': 'stream_error'}) or 0
+
+    monkeypatch.setattr(asgi_app, 'llm_backend', DroppedStreamBackend())
+    monkeypatch.setattr(asgi_app.flask_app, 'prepare_chat', lambda *args: ([], 'key', None))
+    before = stream_errors()
+    with TestClient(asgi_app.app) as client:
+        response = client.post('/api/chat/stream', json={'message': 'Hello'})
+
+    assert response.status_code == 200 and 'event: error' in response.text
+    assert stream_errors() == before + 1
@@ -0,0 +1,76 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from augmentation import ImageWriter, augment_and_save, compute_augmentation_budget, quality_params, spread_budget
+
+
+def write_images(folder, count):
+    os.makedirs(folder)
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        cv2.imwrite(os.path.join(folder, f"img_{i}.png"), rng.integers(0, 255, size=(16, 16, 3), dtype=np.uint8))
+
+
+def test_budget_fills_small_classes_up_to_the_target():
+    budget = compute_augmentation_budget({'few': 3, 'some': 8, 'many': 20}, target_per_class=10)
+    assert budget == {'few': 7, 'some': 2, 'many': 0}
+
+
+def test_budget_is_capped_per_image():
+    assert compute_augmentation_budget({'one': 1, 'two': 2}, 100, max_per_image=5) == {'one': 5, 'two': 10}
+
+
+def test_spread_budget_is_even_and_exact():
+    assert spread_budget(7, 3) == [3, 2, 2]
+    assert spread_budget(0, 2) == [0, 0]
+    assert spread_budget(5, 0) == []
+
+
+def test_budget_counts_only_training_images(tmp_path):
+    source, output = str(tmp_path / 'processed'), str(tmp_path / 'augmented')
+    write_images(os.path.join(source, 'ada'), 6)
+    held_out = {'img_0.png', 'img_1.png'}
+
+    written = augment_and_save(source, output, num_augmentations_per_image=10, num_threads=1,
+                               target_per_class=10, holdout=lambda path: os.path.basename(path) in held_out)
+
+    names = sorted(os.path.basename(path) for path in written)
+    assert sorted(os.listdir(os.path.join(output, 'ada'))) == names
+    augmented = [name for name in names if '_aug_' in name]
+    # 4 training images are topped up to 10, the 2 held-out ones are copied as they are
+    assert len(augmented) == 6
+    assert not any(name.startswith(('img_0_', 'img_1_')) for name in augmented)
+    assert len(names) == 6 + 6
+
+
+def test_quality_is_mapped_to_each_format():
+    assert quality_params('.jpg', 90) == [cv2.IMWRITE_JPEG_QUALITY, 90]
+    assert quality_params('.webp', 0) == [cv2.IMWRITE_WEBP_QUALITY, 1]
+    assert quality_params('.png', 100) == [cv2.IMWRITE_PNG_COMPRESSION, 0]
+    assert quality_params('.png', 0) == [cv2.IMWRITE_PNG_COMPRESSION, 9]
+    assert quality_params('.png', None) == []
+
+
+def test_out_of_range_quality_is_rejected_up_front():
+    with pytest.raises(ValueError):
+        ImageWriter(quality=101, num_threads=1)
+
+
+def test_one_quality_setting_writes_mixed_formats(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, size=(32, 32, 3), dtype=np.uint8)
+    paths = [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.png'), str(tmp_path / 'c.webp')]
+    with ImageWriter(quality=80, num_threads=1) as writer:
+        writer.submit([(path, image) for path in paths])
+    assert writer.images_written == 3
+    # PNG stays lossless whatever the quality
+    np.testing.assert_array_equal(cv2.imread(paths[1]), image)
+
+
+def test_close_stops_the_thread_pool_when_a_batch_fails(tmp_path):
+    writer = ImageWriter(num_threads=1)
+    writer.submit([(str(tmp_path / 'missing' / 'a.png'), np.zeros((4, 4, 3), dtype=np.uint8))])
+    with pytest.raises(Exception):
+        writer.close()
+    assert writer._executor._shutdown
+    assert not writer._pending
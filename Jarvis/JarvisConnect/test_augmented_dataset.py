@@ -0,0 +1,75 @@
+import os
+import cv2
+import numpy as np
+import torch
+import pytest
+from torch.utils.data import DataLoader
+import augmented_dataset
+from augmented_dataset import AugmentedFaceDataset
+
+
+@pytest.fixture
+def root(tmp_path):
+    rng = np.random.default_rng(0)
+    for class_name, count in (('alice', 2), ('bob', 5)):
+        os.makedirs(tmp_path / class_name)
+        for i in range(count):
+            cv2.imwrite(str(tmp_path / class_name / f"img_{i}.png"),
+                        rng.integers(0, 255, size=(40, 40, 3), dtype=np.uint8))
+    return str(tmp_path)
+
+
+def test_samples_per_image_repeats_the_folder(root):
+    dataset = AugmentedFaceDataset(root, samples_per_image=3, image_size=(32, 32))
+    assert dataset.classes == ['alice', 'bob'] and len(dataset) == 21
+    image, label = dataset[9]
+    assert image.shape == (3, 32, 32) and image.dtype == torch.float32
+    assert label == dataset.targets[9 % 7] == 1
+
+
+def test_an_epoch_is_reproducible_and_epochs_differ(root):
+    dataset = AugmentedFaceDataset(root, samples_per_image=2, image_size=(32, 32), seed=7)
+    first = [dataset[i][0] for i in range(len(dataset))]
+    again = [dataset[i][0] for i in range(len(dataset))]
+    for a, b in zip(first, again):
+        torch.testing.assert_close(a, b)
+
+    dataset.set_epoch(1)
+    assert any(not torch.equal(a, dataset[i][0]) for i, a in enumerate(first))
+
+
+def test_augmentations_do_not_depend_on_the_number_of_workers(root):
+    dataset = AugmentedFaceDataset(root, samples_per_image=2, image_size=(32, 32), seed=3)
+    serial = torch.cat([images for images, _ in DataLoader(dataset, batch_size=4)])
+    pooled = torch.cat([images for images, _ in DataLoader(dataset, batch_size=4, num_workers=2)])
+    torch.testing.assert_close(serial, pooled)
+
+
+def test_balanced_mode_gives_every_class_the_target(root, monkeypatch):
+    dataset = AugmentedFaceDataset(root, image_size=(32, 32), target_per_class=4)
+    assert len(dataset) == 8
+    assert dataset.targets == [0] * 4 + [1] * 4
+
+    read = []
+    imread = augmented_dataset.cv2.imread
+    monkeypatch.setattr(augmented_dataset.cv2, 'imread', lambda path: read.append(path) or imread(path))
+
+    def epoch_images(epoch):
+        dataset.set_epoch(epoch)
+        read.clear()
+        assert [dataset[i][1] for i in range(len(dataset))] == dataset.targets
+        return read[4:]
+
+    # alice has two images, so each is repeated under different augmentations
+    epoch_images(0)
+    assert sorted(os.path.basename(path) for path in read[:4]) == ['img_0.png', 'img_0.png', 'img_1.png', 'img_1.png']
+    # bob has five, so consecutive epochs show different subsets that together cover all of them
+    first, second = epoch_images(0), epoch_images(1)
+    assert set(first) != set(second)
+    assert len(set(first) | set(second)) == 5
+
+
+def test_balanced_mode_rejects_empty_classes(root):
+    os.makedirs(os.path.join(root, 'carol'))
+    with pytest.raises(ValueError, match='carol'):
+        AugmentedFaceDataset(root, target_per_class=4)
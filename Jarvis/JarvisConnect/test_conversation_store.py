@@ -0,0 +1,66 @@
+import conversation_store
+from conversation_store import ConversationStore, estimate_tokens, summarize_turn
+
+
+def test_history_stays_within_the_token_budget():
+    store = ConversationStore(history_tokens=100, summary_tokens=40)
+    for turn in range(50):
+        store.add_exchange('s', f"Question {turn}. " + 'x' * 80, f"Answer {turn}. " + 'y' * 80)
+        conversation = store._sessions['s']
+        assert conversation.history_tokens <= 100
+        assert sum(estimate_tokens(line) for line in conversation.summary) <= 40
+
+    messages = store.build_messages('s', 'system', 'next')
+    assert messages[0] == {'role': 'system', 'content': 'system'}
+    assert messages[1]['content'].startswith('Summary of the earlier conversation:')
+    # Turns are folded oldest first, so the summary ends where the verbatim turns begin
+    assert messages[1]['content'].endswith('JARVIS: Answer 47.')
+    assert messages[2]['content'].startswith('Question 48.')
+    assert messages[-2]['content'].startswith('Answer 49.')
+    assert messages[-1] == {'role': 'user', 'content': 'next'}
+
+
+def test_max_turns_bounds_short_turns():
+    store = ConversationStore(max_turns=4)
+    for turn in range(10):
+        store.add_exchange('s', f"q{turn}", f"a{turn}")
+    assert [content for _, content, _ in store._sessions['s'].turns] == ['q8', 'a8', 'q9', 'a9']
+
+
+def test_summary_is_the_shortened_first_sentence():
+    assert summarize_turn('user', 'Turn on the lights. Then play music.') == 'User: Turn on the lights.'
+    line = summarize_turn('assistant', 'z' * 500, max_chars=20)
+    assert line == 'JARVIS: ' + 'z' * 17 + '...'
+
+
+def test_unknown_sessions_get_only_the_system_prompt_and_message():
+    store = ConversationStore()
+    assert store.build_messages('nobody', 'system', 'hi') == [
+        {'role': 'system', 'content': 'system'}, {'role': 'user', 'content': 'hi'}]
+    # Reading does not create a session
+    assert len(store) == 0
+
+
+def test_idle_and_excess_sessions_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversation_store.time, 'monotonic', lambda: now[0])
+    store = ConversationStore(idle_timeout=60, max_sessions=2)
+    store.add_exchange('a', 'q', 'a')
+    store.add_exchange('b', 'q', 'a')
+    store.add_exchange('c', 'q', 'a')
+    # Beyond max_sessions the least recently active session goes
+    assert set(store._sessions) == {'b', 'c'}
+
+    now[0] += 30
+    store.add_exchange('b', 'q', 'a')
+    now[0] += 45
+    assert store.stats() == {'sessions': 1, 'turns': 4}
+    assert len(store.build_messages('c', 'system', 'hi')) == 2
+
+
+def test_clear_forgets_the_session():
+    store = ConversationStore()
+    store.add_exchange('s', 'q', 'a')
+    store.clear('s')
+    store.clear('missing')
+    assert len(store) == 0
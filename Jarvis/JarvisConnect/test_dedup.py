@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from dedup import (HashIndex, cosine_similarity_pairs, find_hash_pairs, first_in_group, group_duplicates,
+                   hamming_distance)
+from preprocessing import remove_near_duplicates
+
+EPS = 0.3
+
+
+def clustered_features(seed=0, num_clusters=12, per_cluster=5, dim=64):
+    """Non-negative histogram-like vectors, a few tight clusters plus scattered points"""
+    rng = np.random.default_rng(seed)
+    centers = rng.gamma(0.3, size=(num_clusters, dim))
+    features = [center + rng.gamma(0.3, size=(per_cluster, dim)) * 0.15 for center in centers]
+    features.append(rng.gamma(0.3, size=(20, dim)))
+    features = np.concatenate(features).astype(np.float32)
+    return features[rng.permutation(len(features))]
+
+
+def reference_clusters(features, eps):
+    """DBSCAN with min_samples=1: flood fill over pairs within cosine distance eps"""
+    unit = features / np.linalg.norm(features, axis=1, keepdims=True)
+    neighbours = 1 - unit @ unit.T <= eps
+    labels = np.full(len(features), -1)
+    for start in range(len(features)):
+        if labels[start] >= 0:
+            continue
+        labels[start] = start
+        stack = [start]
+        while stack:
+            for other in np.flatnonzero(neighbours[stack.pop()] & (labels < 0)):
+                labels[other] = start
+                stack.append(other)
+    return labels
+
+
+def same_partition(a, b):
+    """Two labelings group the items identically (the label values may differ)"""
+    return all(len(set(b[a == label])) == 1 for label in np.unique(a)) and len(np.unique(a)) == len(np.unique(b))
+
+
+def blocked_clusters(features, block_size=2048):
+    pairs = cosine_similarity_pairs(features, min_similarity=1 - EPS, block_size=block_size)
+    return group_duplicates(len(features), pairs)
+
+
+@pytest.mark.parametrize('block_size', [7, 2048])
+def test_grouping_matches_the_reference_clustering(block_size):
+    features = clustered_features()
+    labels = blocked_clusters(features, block_size)
+    assert same_partition(labels, reference_clusters(features, EPS))
+    # The fixture really has near-duplicates and singletons
+    assert 1 < len(np.unique(labels)) < len(features)
+
+
+def test_grouping_matches_dbscan():
+    cluster = pytest.importorskip('sklearn.cluster')
+    features = clustered_features(seed=1)
+    dbscan = cluster.DBSCAN(eps=EPS, min_samples=1, metric='cosine').fit(features)
+    assert same_partition(blocked_clusters(features), dbscan.labels_)
+
+
+def test_remove_near_duplicates_keeps_the_first_image_of_every_cluster():
+    rng = np.random.default_rng(2)
+    base = [rng.integers(0, 256, size=(24, 24, 3), dtype=np.uint8) for _ in range(4)]
+    images = []
+    for i in range(12):
+        noise = rng.integers(-4, 5, size=base[0].shape)
+        images.append((np.clip(base[i % 4].astype(int) + noise, 0, 255).astype(np.uint8), f"img_{i}"))
+
+    kept = [name for _, name in remove_near_duplicates(images)]
+    assert kept == ['img_0', 'img_1', 'img_2', 'img_3']
+
+
+def test_first_in_group():
+    np.testing.assert_array_equal(first_in_group(np.array([2, 0, 2, 1, 0])), [True, True, False, True, False])
+
+
+@pytest.mark.parametrize('radius', [0, 3, 8])
+def test_hash_pairs_and_index_match_brute_force(radius):
+    rng = np.random.default_rng(radius)
+    hashes = rng.integers(0, 2 ** 63, size=150, dtype=np.uint64)
+    # Plant near-duplicates by flipping a few bits
+    flips = rng.integers(0, 64, size=(50, 2))
+    hashes[100:] = hashes[:50] ^ (np.uint64(1) << flips[:, 0].astype(np.uint64)) \
+        ^ (np.uint64(1) << flips[:, 1].astype(np.uint64))
+
+    distances = hamming_distance(hashes[:, None], hashes[None, :])
+    expected = {(i, j) for i, j in zip(*np.nonzero(distances <= radius)) if i < j}
+    assert {tuple(pair) for pair in find_hash_pairs(hashes, radius).tolist()} == expected
+
+    index = HashIndex(radius=radius, capacity=4)
+    for value in hashes[:100]:
+        index.add(value)
+    for query in hashes[100:]:
+        found = set(index.query(query).tolist())
+        assert found == set(np.flatnonzero(hamming_distance(hashes[:100], query) <= radius).tolist())
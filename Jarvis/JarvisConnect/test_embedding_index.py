@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from embedding_index import EmbeddingIndex
+
+
+def build_index(num_rows=600, dim=32, dtype='float16', seed=0, path=None):
+    rng = np.random.default_rng(seed)
+    index = EmbeddingIndex(dim=dim, dtype=dtype, path=path, capacity=16)
+    vectors = rng.normal(size=(num_rows, dim)).astype(np.float32)
+    for row, vector in enumerate(vectors):
+        index.add(f"user_{row}", vector)
+    # Compare against what the index stores, so int8 rounding cannot reorder near ties
+    return index, index._dequantize(np.arange(num_rows))
+
+
+def brute_force(vectors, query, k):
+    query = query / np.linalg.norm(query)
+    scores = vectors @ query
+    top = np.argsort(-scores)[:k]
+    return [(f"user_{row}", float(scores[row])) for row in top]
+
+
+def test_scores_of_unsorted_rows_follow_the_given_order():
+    index = EmbeddingIndex(dim=4)
+    for row in range(4):
+        index.add(str(row), np.eye(4)[row])
+    scores = index._scores(np.array([0, 2, 1, 3]), np.eye(4)[1].astype(np.float32))
+    np.testing.assert_array_equal(scores, [0, 0, 1, 0])
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_exact_search_matches_brute_force(dtype):
+    index, vectors = build_index(dtype=dtype)
+    query = np.random.default_rng(1).normal(size=vectors.shape[1]).astype(np.float32)
+    expected = brute_force(vectors, query, 5)
+    result = index.search(query, k=5)
+    assert [label for label, _ in result] == [label for label, _ in expected]
+    np.testing.assert_allclose([s for _, s in result], [s for _, s in expected], atol=2e-2)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_ivf_search_probing_every_list_matches_brute_force(dtype):
+    index, vectors = build_index(dtype=dtype)
+    index.train_ivf(num_lists=12)
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        query = rng.normal(size=vectors.shape[1]).astype(np.float32)
+        expected = brute_force(vectors, query, 5)
+        result = index.search(query, k=5, nprobe=12)
+        assert [label for label, _ in result] == [label for label, _ in expected]
+
+
+def test_ivf_search_scores_are_exact_for_the_rows_it_returns():
+    index, vectors = build_index()
+    index.train_ivf(num_lists=12)
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        query = rng.normal(size=vectors.shape[1]).astype(np.float32)
+        unit_query = query / np.linalg.norm(query)
+        for label, score in index.search(query, k=5, nprobe=3):
+            row = int(label.split('_')[1])
+            assert score == pytest.approx(float(vectors[row] @ unit_query), abs=2e-3)
+
+
+def test_ivf_finds_enrolled_duplicates_and_late_enrollments():
+    index, vectors = build_index()
+    index.train_ivf(num_lists=12)
+    index.add('late', vectors[7])
+    for row in (0, 7, 599):
+        labels = [label for label, _ in index.search(vectors[row], k=2, nprobe=1)]
+        assert f"user_{row}" in labels
+    assert 'late' in [label for label, _ in index.search(vectors[7], k=2, nprobe=1)]
+
+
+def test_gallery_log_is_replayed(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    index, vectors = build_index(num_rows=20, path=path)
+    reloaded = EmbeddingIndex(dim=vectors.shape[1], path=path)
+    assert len(reloaded) == 20
+    assert reloaded.search(vectors[3], k=1)[0][0] == 'user_3'
+    assert reloaded.label_score('user_3', vectors[3]) == pytest.approx(1.0, abs=1e-3)
+    assert reloaded.label_score('nobody', vectors[3]) is None
@@ -0,0 +1,120 @@
+import os
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import feature_cache
+import trainer
+from feature_cache import FeatureCache, embedding_key, train_head, update_cache
+from hashing import content_hash
+
+COLORS = {'alice': (220, 40, 40), 'bob': (40, 40, 220)}
+
+
+class TinyBackbone(nn.Module):
+    """Mean colour of the face projected to EMBEDDING_DIM, so classes are linearly separable"""
+
+    def __init__(self):
+        super().__init__()
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.project = nn.Linear(3, feature_cache.EMBEDDING_DIM)
+
+    def forward(self, inputs):
+        return self.project(self.pool(inputs).flatten(1))
+
+
+@pytest.fixture
+def backbone_builds(monkeypatch):
+    builds = []
+    torch.manual_seed(0)
+    backbone = TinyBackbone().eval()
+    monkeypatch.setattr(feature_cache, 'build_backbone', lambda: builds.append(1) or backbone)
+    monkeypatch.setattr(feature_cache, 'build_model',
+                        lambda num_classes, pretrained=True: trainer.build_model(num_classes, pretrained=False))
+    return builds
+
+
+def write_face(path, color, seed):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    noise = np.random.default_rng(seed).integers(0, 20, size=(32, 32, 3))
+    cv2.imwrite(path, np.clip(np.array(color[::-1]) + noise, 0, 255).astype(np.uint8))
+    return path
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for phase, count in (('train', 4), ('val', 2)):
+        for class_name, color in COLORS.items():
+            for i in range(count):
+                write_face(str(tmp_path / 'data' / phase / class_name / f"{phase}_{i}.png"), color,
+                           seed=hash((phase, class_name, i)) % 1000)
+    return str(tmp_path / 'data')
+
+
+def chunk_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.json'))
+
+
+def test_only_new_images_go_through_the_backbone(data_dir, tmp_path, backbone_builds):
+    cache_dir = str(tmp_path / 'cache')
+    paths, _, _ = feature_cache._list_images(os.path.join(data_dir, 'train'))
+    cache = update_cache(cache_dir, paths, num_workers=0)
+    assert len(cache) == 8 and len(backbone_builds) == 1
+
+    # Everything is cached: no backbone, no new chunk
+    update_cache(cache_dir, paths, num_workers=0)
+    assert len(backbone_builds) == 1 and chunk_files(cache_dir) == ['chunk_00000.json']
+
+    new_face = write_face(str(tmp_path / 'new' / 'alice' / 'new.png'), COLORS['alice'], seed=99)
+    cache = update_cache(cache_dir, paths + [new_face], num_workers=0)
+    assert len(cache) == 9 and len(backbone_builds) == 2
+    assert chunk_files(cache_dir) == ['chunk_00000.json', 'chunk_00001.json']
+
+
+def test_reloaded_cache_serves_the_stored_embeddings(data_dir, tmp_path, backbone_builds):
+    cache_dir = str(tmp_path / 'cache')
+    paths, _, _ = feature_cache._list_images(os.path.join(data_dir, 'train'))
+    keys = [embedding_key(path) for path in paths]
+    stored = update_cache(cache_dir, paths, num_workers=0).get(keys)
+    # An interrupted write leaves an array without its key file, which is ignored
+    np.save(os.path.join(cache_dir, 'chunk_00001.npy'), np.zeros((1, feature_cache.EMBEDDING_DIM), np.float16))
+
+    reloaded = FeatureCache(cache_dir)
+    assert len(reloaded) == 8
+    np.testing.assert_array_equal(reloaded.get(keys), stored)
+    # float16 storage of what the backbone computed
+    image = feature_cache._ImagePathDataset(paths[:1])[0]
+    with torch.no_grad():
+        expected = feature_cache.build_backbone()(image[None]).numpy()
+    np.testing.assert_allclose(stored[:1], expected, rtol=1e-2, atol=1e-2)
+
+
+def test_keys_name_the_backbone(data_dir, tmp_path, backbone_builds):
+    cache_dir = str(tmp_path / 'cache')
+    paths, _, _ = feature_cache._list_images(os.path.join(data_dir, 'train'))
+    cache = update_cache(cache_dir, paths, num_workers=0)
+    assert embedding_key(paths[0]) == f"{feature_cache.BACKBONE_ID}:{content_hash(paths[0])}"
+    assert embedding_key(paths[0]) in cache
+    assert embedding_key(paths[0], backbone_id='resnet50/other-weights') not in cache
+
+
+def test_content_hash_matches_a_one_shot_digest(tmp_path):
+    import hashlib
+    path = tmp_path / 'blob.bin'
+    path.write_bytes(os.urandom(3000))
+    assert content_hash(str(path), chunk_size=1024) == hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def test_train_head_saves_a_loadable_model(data_dir, tmp_path, backbone_builds):
+    output = str(tmp_path / 'model_head.pt')
+    model = train_head(str(tmp_path / 'cache'), data_dir, output, epochs=200, lr=0.01, num_workers=0)
+
+    restored, classes = trainer.load_trained_model(output)
+    assert classes == ['alice', 'bob']
+    torch.testing.assert_close(restored.fc.weight, model.fc.weight)
+
+    val_paths, val_labels, _ = feature_cache._list_images(os.path.join(data_dir, 'val'), classes)
+    features = torch.from_numpy(FeatureCache(str(tmp_path / 'cache')).get([embedding_key(p) for p in val_paths]))
+    with torch.no_grad():
+        assert restored.fc(features).argmax(1).tolist() == val_labels
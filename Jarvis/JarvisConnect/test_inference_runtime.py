@@ -0,0 +1,66 @@
+import json
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import inference_runtime
+from export_model import EXPORT_META
+from inference_runtime import InferenceModel
+
+INPUT_SIZE = (8, 8)
+
+
+class TinyFaceModel(nn.Module):
+    """Same outputs as the exported face model: (embedding, logits)"""
+
+    def __init__(self):
+        super().__init__()
+        self.embed = nn.Linear(3 * INPUT_SIZE[0] * INPUT_SIZE[1], 16)
+        self.fc = nn.Linear(16, 3)
+
+    def forward(self, x):
+        embedding = self.embed(x.flatten(1))
+        return embedding, self.fc(embedding)
+
+
+@pytest.fixture
+def export_dir(tmp_path):
+    pytest.importorskip('onnx')
+    torch.manual_seed(0)
+    model = TinyFaceModel().eval()
+    example = torch.randn(1, 3, *INPUT_SIZE)
+    with torch.no_grad():
+        torch.jit.freeze(torch.jit.trace(model, example)).save(str(tmp_path / 'model.ts'))
+    torch.onnx.export(model, (example,), str(tmp_path / 'model.onnx'), input_names=['input'],
+                      output_names=['embedding', 'logits'], dynamic_axes={'input': {0: 'batch'}},
+                      opset_version=17, dynamo=False)
+    meta = {'classes': ['a', 'b', 'c'], 'input_size': list(INPUT_SIZE),
+            'artifacts': {'torchscript': 'model.ts', 'onnx': 'model.onnx'}}
+    with open(tmp_path / EXPORT_META, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return str(tmp_path)
+
+
+def test_auto_keeps_the_backend_that_timed_fastest(export_dir):
+    pytest.importorskip('onnxruntime')
+    model = InferenceModel(export_dir, backend='auto')
+    assert set(model.timings_ms) == {'onnxruntime', 'torchscript'}
+    assert model.backend == min(model.timings_ms, key=model.timings_ms.get)
+
+    # The kept backend gives the same answers as a fixed one
+    inputs = np.random.default_rng(0).normal(size=(2, 3, *INPUT_SIZE)).astype(np.float32)
+    expected = InferenceModel(export_dir, backend='torchscript')(inputs)
+    for got, want in zip(model(inputs), expected):
+        np.testing.assert_allclose(got, want, rtol=1e-4, atol=1e-5)
+
+
+def test_auto_without_onnxruntime_uses_torchscript(export_dir, monkeypatch):
+    monkeypatch.setattr(inference_runtime, 'onnxruntime_available', lambda: False)
+    model = InferenceModel(export_dir, backend='auto')
+    assert model.backend == 'torchscript'
+    assert list(model.timings_ms) == ['torchscript']
+
+
+def test_auto_needs_matching_artifacts(export_dir):
+    with pytest.raises(ValueError):
+        InferenceModel(export_dir, backend='auto', quantized=True)
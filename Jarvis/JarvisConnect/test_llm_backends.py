@@ -0,0 +1,174 @@
+import asyncio
+import time
+import pytest
+from llm_backends import HEDGE_FAN_OUT, FailoverBackend, LLMBackend, LLMBackendError, MockBackend
+
+MESSAGES = [{'role': 'user', 'content': 'Status report'}]
+
+
+class FailingBackend(MockBackend):
+    def __init__(self, name='failing'):
+        super().__init__(latency_ms=0, tokens_per_sec=0, failure_rate=1.0, name=name)
+
+
+class TrackedBackend(MockBackend):
+    """Mock whose async streams record whether they were closed"""
+
+    def __init__(self, latency_ms, name):
+        super().__init__(latency_ms=latency_ms, tokens_per_sec=0, response_tokens=5, name=name)
+        self.started = 0
+        self.closed = 0
+
+    async def astream(self, messages, temperature=0.7, max_tokens=1024):
+        self.started += 1
+        try:
+            async for token in super().astream(messages, temperature, max_tokens):
+                yield token
+        finally:
+            self.closed += 1
+
+
+def test_backends_must_implement_every_call():
+    class CompleteOnly(LLMBackend):
+        def complete(self, messages, temperature=0.7, max_tokens=1024):
+            return ''
+
+    with pytest.raises(TypeError):
+        CompleteOnly()
+
+
+def test_failover_moves_on_to_the_next_backend():
+    backend = FailoverBackend([FailingBackend(), MockBackend(latency_ms=0, tokens_per_sec=0)], backoff=0)
+    expected = MockBackend(latency_ms=0, tokens_per_sec=0).complete(MESSAGES)
+    assert backend.complete(MESSAGES) == expected
+    assert asyncio.run(backend.acomplete(MESSAGES)) == expected
+
+
+def test_all_backends_failing_raises():
+    backend = FailoverBackend([FailingBackend('a'), FailingBackend('b')], backoff=0)
+    with pytest.raises(LLMBackendError):
+        backend.complete(MESSAGES)
+    with pytest.raises(LLMBackendError):
+        asyncio.run(backend.acomplete(MESSAGES))
+
+
+def test_hedged_stream_closes_the_losing_stream():
+    slow, fast = TrackedBackend(300, 'slow'), TrackedBackend(0, 'fast')
+    backend = FailoverBackend([slow, fast], retries=0, hedge_after=0.01)
+
+    async def scenario():
+        deltas = [delta async for delta in backend.astream(MESSAGES)]
+        await asyncio.sleep(0.05)
+        return deltas
+
+    deltas = asyncio.run(scenario())
+    assert ''.join(deltas) == fast.complete(MESSAGES)
+    assert slow.started == slow.closed
+    assert fast.closed == 1
+
+
+def test_cancelled_caller_cancels_pending_attempts():
+    slow = MockBackend(latency_ms=10000, tokens_per_sec=0, name='slow')
+    slower = MockBackend(latency_ms=10000, tokens_per_sec=0, name='slower')
+    backend = FailoverBackend([slow, slower], retries=0, hedge_after=0.01)
+
+    async def scenario():
+        request = asyncio.ensure_future(backend.acomplete(MESSAGES))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_hedging_pool_is_sized_from_the_fan_out():
+    backend = FailoverBackend([MockBackend()], hedge_after=1.0, max_requests=8)
+    assert backend._executor._max_workers == 8 * HEDGE_FAN_OUT
+    assert FailoverBackend([MockBackend()])._executor is None
+    assert FailoverBackend([MockBackend()], attempt_timeout=5)._executor is not None
+
+
+class HungBackend(MockBackend):
+    """Never answers within a test's lifetime"""
+
+    def __init__(self, name='hung'):
+        super().__init__(latency_ms=2000, tokens_per_sec=0, name=name)
+
+
+class TrackedSyncBackend(MockBackend):
+    """Mock whose streams record whether they were closed"""
+
+    def __init__(self, latency_ms, name):
+        super().__init__(latency_ms=latency_ms, tokens_per_sec=0, response_tokens=5, name=name)
+        self.started = 0
+        self.closed = 0
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        self.started += 1
+        try:
+            yield from super().stream(messages, temperature, max_tokens)
+        finally:
+            self.closed += 1
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def test_attempt_timeout_fails_over_from_a_hung_backend():
+    fast = MockBackend(latency_ms=0, tokens_per_sec=0, name='fast')
+    backend = FailoverBackend([HungBackend(), fast], retries=0, backoff=0, attempt_timeout=0.1)
+    expected = fast.complete(MESSAGES)
+
+    result, elapsed = timed(lambda: backend.complete(MESSAGES))
+    assert result == expected and elapsed < 1
+    result, elapsed = timed(lambda: asyncio.run(backend.acomplete(MESSAGES)))
+    assert result == expected and elapsed < 1
+
+
+def test_every_attempt_timing_out_raises():
+    backend = FailoverBackend([HungBackend('a'), HungBackend('b')], retries=0, backoff=0, attempt_timeout=0.05)
+    with pytest.raises(LLMBackendError, match='did not answer'):
+        backend.complete(MESSAGES)
+    with pytest.raises(LLMBackendError, match='did not answer'):
+        asyncio.run(backend.acomplete(MESSAGES))
+
+
+def test_timed_out_async_stream_is_closed():
+    hung = TrackedBackend(2000, 'hung')
+    fast = MockBackend(latency_ms=0, tokens_per_sec=0, response_tokens=5, name='fast')
+    backend = FailoverBackend([hung, fast], retries=0, backoff=0, attempt_timeout=0.05)
+
+    async def scenario():
+        return ''.join([delta async for delta in backend.astream(MESSAGES)])
+
+    assert asyncio.run(scenario()) == fast.complete(MESSAGES)
+    assert hung.started == hung.closed == 1
+
+
+def test_sync_hedge_loser_is_closed_once_it_opens():
+    slow, fast = TrackedSyncBackend(200, 'slow'), TrackedSyncBackend(0, 'fast')
+    backend = FailoverBackend([slow, fast], retries=0, hedge_after=0.01)
+    assert ''.join(backend.stream(MESSAGES)) == fast.complete(MESSAGES)
+    time.sleep(0.4)
+    assert slow.started == slow.closed == 1
+    assert fast.closed == 1
+
+
+def test_abandoned_attempts_that_have_not_started_never_run():
+    runs = []
+    backend = FailoverBackend([HungBackend('a'), HungBackend('b')], retries=0, backoff=0, attempt_timeout=0.05,
+                              max_requests=1)
+    # Occupy every pool thread so the next attempts stay queued
+    blockers = [backend._executor.submit(time.sleep, 0.3) for _ in range(backend._executor._max_workers)]
+    with pytest.raises(LLMBackendError):
+        backend._run(lambda b: runs.append(b.name))
+    for blocker in blockers:
+        blocker.result()
+    backend._executor.submit(lambda: None).result()
+    assert runs == []
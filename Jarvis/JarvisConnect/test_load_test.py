@@ -0,0 +1,29 @@
+import asyncio
+import httpx
+import pytest
+from load_test import final_event, run_request, summarize
+
+
+def test_final_event_names():
+    assert final_event('data: {"delta": "Hi"}\n\nevent: done\ndata: {"success": true}\n\n') == 'done'
+    assert final_event('data: {"delta": "Hi"}\n\nevent: error\ndata: {}\n\n') == 'error'
+    assert final_event('data: {"delta": "Hi"}\n\n') == 'message'
+    assert final_event('') is None
+
+
+@pytest.mark.parametrize('body, status', [
+    ('data: {"delta": "Hi"}\n\nevent: done\ndata: {"success": true}\n\n', 200),
+    ('data: {"delta": "Hi"}\n\nevent: error\ndata: {"success": false}\n\n', 'stream_error'),
+    ('data: {"delta": "Hi"}\n\n', 'stream_incomplete'),
+])
+def test_streams_without_a_done_event_are_failures(body, status):
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await run_request(client, 'chat_stream', 0, 1)
+
+    sample = asyncio.run(scenario())
+    assert sample[0] == status
+    summary = summarize('chat_stream', [sample], 1.0, 1)
+    assert summary['error_rate'] == (0.0 if status == 200 else 1.0)
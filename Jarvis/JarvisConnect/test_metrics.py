@@ -0,0 +1,80 @@
+import contextvars
+import pytest
+import app as app_module
+import metrics
+from conversation_store import ConversationStore
+from llm_backends import LLMBackendError, MockBackend
+
+prometheus_client = pytest.importorskip('prometheus_client')
+
+
+class DroppedStreamBackend(MockBackend):
+    """Sends one delta, then loses the upstream connection"""
+
+    def stream(self, messages, temperature=0.7, max_tokens=1024):
+        yield 'Good '
+        raise LLMBackendError('connection reset')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_backend', MockBackend(latency_ms=0, tokens_per_sec=0, response_tokens=5))
+    monkeypatch.setattr(app_module, 'response_cache', None)
+    monkeypatch.setattr(app_module, 'conversation_store', ConversationStore())
+    return app_module.app.test_client()
+
+
+def errors(route, status):
+    return prometheus_client.REGISTRY.get_sample_value('jarvis_errors_total', {'route': route, 'status': status}) or 0
+
+
+def test_metrics_endpoint_exposes_request_latency(client):
+    client.post('/api/chat', json={'message': 'Hello'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'jarvis_request_seconds_count{method="POST",route="/api/chat",status="200"}' in body
+    assert 'jarvis_chat_tokens_bucket' in body
+
+
+def test_server_timing_header_lists_the_request_spans(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'REQUEST_TIMING', True)
+    response = client.post('/api/chat', json={'message': 'Hello'})
+    names = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert names == ['parse', 'context', 'llm', 'serialize', 'total']
+
+
+def test_server_timing_is_off_by_default(client):
+    assert 'Server-Timing' not in client.post('/api/chat', json={'message': 'Hello'}).headers
+
+
+def test_spans_belong_to_the_context_that_started_the_trace(monkeypatch):
+    monkeypatch.setattr(metrics, 'REQUEST_TIMING', True)
+
+    def request(name):
+        metrics.start_trace()
+        with metrics.span(name):
+            pass
+        return metrics.server_timing()
+
+    # Every request runs in its own context, as under the WSGI and ASGI servers
+    first = contextvars.copy_context().run(request, 'first')
+    second = contextvars.copy_context().run(request, 'second')
+    assert first.startswith('first;dur=') and second.startswith('second;dur=')
+    assert contextvars.copy_context().run(metrics.server_timing) is None
+
+
+def test_error_responses_are_counted(client):
+    before = errors('/api/chat', '400')
+    assert client.post('/api/chat', json={}).status_code == 400
+    assert errors('/api/chat', '400') == before + 1
+
+
+def test_stream_failing_after_the_first_delta_is_counted(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_backend', DroppedStreamBackend())
+    before = errors('/api/chat/stream', metrics.STREAM_ERROR_STATUS)
+    response = client.post('/api/chat/stream', json={'message': 'Hello'})
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200 and 'event: error' in body
+    assert errors('/api/chat/stream', metrics.STREAM_ERROR_STATUS) == before + 1
@@ -0,0 +1,97 @@
+import json
+import os
+import cv2
+import numpy as np
+import pytest
+from pipeline import (Pipeline, PipelineError, is_augmented, _original_name, load_pipeline_config,
+                      validation_names)
+from shards import INDEX_NAME
+
+
+def write_dataset(root, classes):
+    rng = np.random.default_rng(0)
+    for name, count in classes.items():
+        os.makedirs(os.path.join(root, name))
+        for i in range(count):
+            image = rng.integers(0, 255, size=(32, 32, 3), dtype=np.uint8)
+            cv2.imwrite(os.path.join(root, name, f"{name}_{i:03d}.png"), image)
+
+
+def make_config(tmp_path, **overrides):
+    options = dict(work_dir=str(tmp_path / 'work'), stages=['augment', 'pack'], target_size=[32, 32],
+                   augmentations_per_image=2, augment_threads=1, class_concurrency=1, val_fraction=0.3)
+    options.update(overrides)
+    return load_pipeline_config(overrides=dict(options, dataset_folder=str(tmp_path / 'raw')))
+
+
+def read_index(work_dir, split):
+    with open(os.path.join(work_dir, 'shards', split, INDEX_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_validation_names_are_deterministic_and_keep_the_training_minimum():
+    paths = [f"/data/a/img_{i}.jpg" for i in range(50)]
+    held_out = validation_names(paths, 0.3)
+    assert held_out == validation_names(list(reversed(paths)), 0.3)
+    assert 5 < len(held_out) < 25
+
+    # Augmented variants do not count and follow their original
+    assert validation_names(paths + ["/data/a/img_0_aug_3.jpg"], 0.3) == held_out
+
+    assert len(validation_names(paths[:3], 1.0, min_train=2)) == 1
+    with pytest.raises(PipelineError):
+        validation_names(paths[:1], 0.3, min_train=2)
+
+
+def test_validation_images_are_not_augmented(tmp_path):
+    write_dataset(str(tmp_path / 'raw'), {'ada': 12, 'bob': 9})
+    config = make_config(tmp_path)
+    result = Pipeline(config).run()
+
+    for name, paths in result['images'].items():
+        originals = [path for path in paths if not is_augmented(path)]
+        held_out = validation_names(originals, config['val_fraction'])
+        assert held_out
+        augmented_sources = {_original_name(path) for path in paths if is_augmented(path)}
+        assert not augmented_sources & held_out
+        assert len(augmented_sources) == len(originals) - len(held_out)
+
+    num_val = sum(len(validation_names(paths, config['val_fraction'])) for paths in result['images'].values())
+    assert read_index(config['work_dir'], 'val')['num_samples'] == num_val
+    assert read_index(config['work_dir'], 'train')['num_samples'] == (21 - num_val) * 3
+
+
+def test_unchanged_stages_are_skipped_and_renamed_classes_repack(tmp_path):
+    write_dataset(str(tmp_path / 'raw'), {'ada': 6, 'bob': 6})
+    config = make_config(tmp_path)
+    Pipeline(config).run()
+
+    rerun = {s['stage']: s for s in Pipeline(config).run()['profile']}
+    assert rerun['augment']['skipped'] == 2
+    assert rerun['pack']['skipped'] == 1
+
+    # Same images under another folder name means new labels, so pack has to run again
+    os.rename(tmp_path / 'raw' / 'bob', tmp_path / 'raw' / 'cy')
+    renamed = {s['stage']: s for s in Pipeline(config).run()['profile']}
+    assert renamed['pack']['skipped'] == 0
+    assert read_index(config['work_dir'], 'train')['classes'] == ['ada', 'cy']
+
+
+def test_class_below_the_training_minimum_fails(tmp_path):
+    write_dataset(str(tmp_path / 'raw'), {'ada': 6, 'bob': 1})
+    with pytest.raises(PipelineError):
+        Pipeline(make_config(tmp_path, min_train_per_class=2)).run()
+
+
+def test_on_the_fly_class_balancing_is_rejected_for_the_train_stage(tmp_path):
+    with pytest.raises(ValueError):
+        make_config(tmp_path, train={'target_per_class': 50})
+
+
+def test_class_balanced_budget_ignores_validation_images(tmp_path):
+    write_dataset(str(tmp_path / 'raw'), {'ada': 10})
+    config = make_config(tmp_path, target_per_class=12, augmentations_per_image=5)
+    paths = Pipeline(config).run()['images']['ada']
+    held_out = validation_names(paths, config['val_fraction'])
+    # Only the training images count towards the target, validation adds its originals on top
+    assert len(paths) == 12 + len(held_out)
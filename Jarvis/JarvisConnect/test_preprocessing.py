@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import pytest
+import preprocessing
+from preprocessing import load_manifest, preprocess_celebrity_images
+
+TARGET_SIZE = (32, 32)
+
+
+class FakeFaceDetection:
+    """Finds one face in the middle of every image, with level eyes"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def process(self, rgb):
+        box = SimpleNamespace(xmin=0.25, ymin=0.25, width=0.5, height=0.5)
+        eyes = [SimpleNamespace(x=0.4, y=0.4), SimpleNamespace(x=0.6, y=0.4)]
+        return SimpleNamespace(detections=[SimpleNamespace(
+            location_data=SimpleNamespace(relative_bounding_box=box, relative_keypoints=eyes))])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_mediapipe(monkeypatch):
+    # Pool workers are forked, so they inherit the fake detector
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip("needs fork so pool workers see the fake detector")
+    monkeypatch.setattr(preprocessing, 'mp', SimpleNamespace(
+        solutions=SimpleNamespace(face_detection=SimpleNamespace(FaceDetection=FakeFaceDetection))))
+
+
+def write_dataset(root):
+    """Two celebrities with five distinct faces each, an exact copy and a mirrored copy"""
+    rng = np.random.default_rng(0)
+    colours = rng.permutation(np.array([[b, g, r] for b in (0, 255) for g in (0, 128, 255) for r in (0, 255)]))
+    for c, celebrity in enumerate(('ada', 'bob')):
+        folder = os.path.join(root, celebrity)
+        os.makedirs(folder)
+        images = []
+        for i in range(5):
+            # Blocky two-colour pattern, colours differ between images so their histograms do too
+            pattern = rng.integers(0, 2, size=(6, 6))
+            palette = colours[[(c * 5 + i) % len(colours), (c * 5 + i + 6) % len(colours)]]
+            images.append(cv2.resize(palette[pattern].astype(np.uint8), (96, 96), interpolation=cv2.INTER_NEAREST))
+        images.append(images[0].copy())
+        # Same colours, so a near-duplicate by histogram, but a different hash
+        images.append(np.ascontiguousarray(images[1][::-1]))
+        for i, image in enumerate(images):
+            cv2.imwrite(os.path.join(folder, f"{celebrity}_{i}.png"), image)
+
+
+def run(dataset, output, num_workers):
+    manifest_path = os.path.join(output, 'manifest.json')
+    processed = preprocess_celebrity_images(dataset, output, TARGET_SIZE, num_workers=num_workers,
+                                            chunk_size=2, manifest_path=manifest_path)
+    outputs = {os.path.relpath(info['path'], output): cv2.imread(info['path']) for info in processed}
+    entries = {}
+    for img_path, entry in load_manifest(manifest_path, TARGET_SIZE).items():
+        entry = dict(entry)
+        if entry['output']:
+            entry['output'] = os.path.relpath(entry['output'], output)
+        entries[img_path] = entry
+    return outputs, entries
+
+
+def test_pooled_run_matches_the_serial_run(tmp_path):
+    dataset = str(tmp_path / 'raw')
+    write_dataset(dataset)
+
+    serial_outputs, serial_entries = run(dataset, str(tmp_path / 'serial'), num_workers=1)
+    pooled_outputs, pooled_entries = run(dataset, str(tmp_path / 'pooled'), num_workers=2)
+
+    assert sorted(serial_outputs) == sorted(pooled_outputs)
+    for name, image in serial_outputs.items():
+        np.testing.assert_array_equal(pooled_outputs[name], image)
+    assert pooled_entries == serial_entries
+
+    outcomes = sorted(entry['outcome'] for entry in serial_entries.values())
+    assert outcomes.count('saved') == 10
+    assert outcomes.count('duplicate') == 2
+    assert outcomes.count('near_duplicate') == 2
+    assert 'candidate' not in outcomes
+
+
+def test_rerun_reuses_the_manifest(tmp_path):
+    dataset, output = str(tmp_path / 'raw'), str(tmp_path / 'out')
+    write_dataset(dataset)
+    first_outputs, first_entries = run(dataset, output, num_workers=1)
+
+    calls = []
+    original = preprocessing.process_single_image
+    preprocessing.process_single_image = lambda *args, **kwargs: calls.append(args) or original(*args, **kwargs)
+    try:
+        second_outputs, second_entries = run(dataset, output, num_workers=1)
+    finally:
+        preprocessing.process_single_image = original
+    assert not calls
+    assert second_entries == first_entries
+    assert sorted(second_outputs) == sorted(first_outputs)
+
+
+def make_detection(xmin, ymin, width, height, eyes=((0.4, 0.4), (0.6, 0.4))):
+    """MediaPipe-like detection with a relative box and right/left eye keypoints"""
+    box = SimpleNamespace(xmin=xmin, ymin=ymin, width=width, height=height)
+    keypoints = [SimpleNamespace(x=x, y=y) for x, y in eyes]
+    return SimpleNamespace(location_data=SimpleNamespace(relative_bounding_box=box, relative_keypoints=keypoints))
+
+
+def centroid(image, colour):
+    ys, xs = np.nonzero(np.all(image == colour, axis=2))
+    return xs.mean(), ys.mean()
+
+
+@pytest.mark.parametrize('eyes', [((80, 110), (120, 90)), ((80, 90), (120, 110)), ((85, 100), (115, 100))])
+def test_alignment_levels_the_eyes(eyes):
+    image = np.full((200, 200, 3), 128, dtype=np.uint8)
+    right_eye, left_eye = eyes
+    cv2.circle(image, right_eye, 5, (0, 0, 255), -1)
+    cv2.circle(image, left_eye, 5, (255, 0, 0), -1)
+    detection = make_detection(0.25, 0.25, 0.5, 0.5, eyes=[(x / 200, y / 200) for x, y in eyes])
+
+    face = preprocessing.align_face(image, detection, (100, 100))
+    assert face.shape == (100, 100, 3)
+    right_x, right_y = centroid(face, (0, 0, 255))
+    left_x, left_y = centroid(face, (255, 0, 0))
+    assert right_y == pytest.approx(left_y, abs=0.5)
+    # The eyes stay on their side and centred on the box centre
+    assert right_x < 50 < left_x
+    assert (right_x + left_x) / 2 == pytest.approx(50, abs=1)
+
+
+def test_faces_at_the_edge_are_padded_with_the_border():
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    image[:, :] = (0, 200, 0)
+    image[:, 0] = (0, 0, 200)
+    # Half of the box lies left of the image
+    face = preprocessing.align_face(image, make_detection(-0.25, 0.25, 0.5, 0.5, eyes=[]), (40, 40))
+    assert face.shape == (40, 40, 3)
+    # The part outside the image repeats the edge column instead of being black
+    assert np.all(face[:, :19] == (0, 0, 200))
+    assert np.all(face[:, 22:] == (0, 200, 0))
+
+
+def write_jpeg(path, width, height):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    cv2.rectangle(image, (width // 4, height // 4), (3 * width // 4, 3 * height // 4), (40, 120, 200), -1)
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+@pytest.mark.parametrize('size, flag', [
+    ((3000, 2000), cv2.IMREAD_REDUCED_COLOR_4),
+    ((6000, 800), cv2.IMREAD_REDUCED_COLOR_8),
+    ((1400, 1000), cv2.IMREAD_REDUCED_COLOR_2),
+    ((1000, 1200), cv2.IMREAD_COLOR),
+])
+def test_reduced_read_keeps_the_detection_size(tmp_path, size, flag):
+    path = write_jpeg(tmp_path / 'photo.jpg', *size)
+    assert preprocessing.reduced_read_flag(path, detection_size=640) == flag
+    assert preprocessing.reduced_read_flag(path, detection_size=None) == cv2.IMREAD_COLOR
+
+
+def test_other_formats_and_broken_files_are_read_at_full_resolution(tmp_path):
+    png = tmp_path / 'photo.png'
+    cv2.imwrite(str(png), np.zeros((3000, 3000, 3), dtype=np.uint8))
+    assert preprocessing.reduced_read_flag(str(png)) == cv2.IMREAD_COLOR
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not a jpeg')
+    assert preprocessing.reduced_read_flag(str(broken)) == cv2.IMREAD_COLOR
+
+
+class FixedFaceDetection:
+    def __init__(self, detection):
+        self.detection = detection
+
+    def process(self, rgb):
+        return SimpleNamespace(detections=[self.detection])
+
+
+@pytest.mark.parametrize('box, full_reads', [(0.5, 0), (0.05, 1)])
+def test_small_faces_are_cropped_from_a_full_resolution_decode(tmp_path, monkeypatch, box, full_reads):
+    path = write_jpeg(tmp_path / 'photo.jpg', 2600, 2600)
+    detection = make_detection(0.5 - box / 2, 0.5 - box / 2, box, box)
+    flags = []
+    imread = cv2.imread
+    monkeypatch.setattr(cv2, 'imread', lambda p, flag=cv2.IMREAD_COLOR: flags.append(flag) or imread(p, flag))
+
+    face = preprocessing.process_single_image(path, (64, 64), FixedFaceDetection(detection), detection_size=640)
+    # Detection always runs on the 1/4 decode (650px); a 5% face is 32px there, less than 64
+    assert flags[0] == cv2.IMREAD_REDUCED_COLOR_4
+    assert flags[1:].count(cv2.IMREAD_COLOR) == full_reads
+    source = imread(path) if full_reads else imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+    np.testing.assert_array_equal(face, preprocessing.align_face(source, detection, (64, 64)))
@@ -0,0 +1,135 @@
+import threading
+import time
+import pytest
+from recognition import DetectorPool, MicroBatcher, RecognizerBusy
+
+
+class FakeDetector:
+    def __init__(self):
+        self.in_use = False
+        self.closed = False
+
+    def process(self):
+        # Fails if two threads ever share this detector
+        assert not self.in_use
+        self.in_use = True
+        time.sleep(0.001)
+        self.in_use = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_never_creates_more_than_size_instances_or_shares_one():
+    created = []
+
+    def factory():
+        created.append(FakeDetector())
+        return created[-1]
+
+    pool = DetectorPool(factory, size=3)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                with pool.acquire() as detector:
+                    detector.process()
+        except AssertionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert 1 <= len(created) <= 3
+    pool.close()
+    assert all(detector.closed for detector in created)
+
+
+def test_pool_reuses_an_idle_instance():
+    pool = DetectorPool(FakeDetector, size=4)
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        assert second is first
+
+
+def test_failed_creation_does_not_use_up_a_slot():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("model failed to load")
+        return FakeDetector()
+
+    pool = DetectorPool(factory, size=1)
+    with pytest.raises(RuntimeError):
+        with pool.acquire():
+            pass
+    with pool.acquire() as detector:
+        assert isinstance(detector, FakeDetector)
+
+
+class BlockingBatches:
+    """process_batch that records its batches and holds the first one until released"""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, items):
+        self.batches.append(items)
+        self.started.set()
+        self.release.wait(5)
+        return [item * 10 for item in items]
+
+
+def submit_in_thread(batcher, item, results, timeout=None):
+    def run():
+        try:
+            results[item] = batcher.submit(item, timeout=timeout)
+        except RecognizerBusy as e:
+            results[item] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_requests_that_timed_out_are_not_processed():
+    process = BlockingBatches()
+    batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=1)
+    results = {}
+    first = submit_in_thread(batcher, 1, results)
+    assert process.started.wait(5)
+
+    # Queued behind the running batch until its caller gives up
+    with pytest.raises(RecognizerBusy):
+        batcher.submit(2, timeout=0.05)
+    process.release.set()
+    first.join()
+    assert batcher.submit(3, timeout=5) == 30
+    assert results[1] == 10
+    assert process.batches == [[1], [3]]
+
+
+def test_time_spent_queued_counts_against_max_wait():
+    process = BlockingBatches()
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=200)
+    results = {}
+    threads = [submit_in_thread(batcher, 1, results)]
+    assert process.started.wait(5)
+    threads.append(submit_in_thread(batcher, 2, results))
+    # Item 2 has waited longer than max_wait_ms by the time the worker is free again
+    time.sleep(0.3)
+    released = time.perf_counter()
+    process.release.set()
+    for thread in threads:
+        thread.join()
+    assert results == {1: 10, 2: 20}
+    assert time.perf_counter() - released < 0.15
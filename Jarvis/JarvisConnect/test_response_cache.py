@@ -0,0 +1,57 @@
+import sqlite3
+import time
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+
+def test_equivalent_user_messages_share_a_key():
+    system = {'role': 'system', 'content': 'You are  JARVIS.'}
+    first = make_cache_key([system, {'role': 'user', 'content': 'Hello JARVIS'}], 'model', 0.7)
+    second = make_cache_key([system, {'role': 'user', 'content': '  hello   jarvis!'}], 'model', 0.7)
+    assert first == second
+    assert first != make_cache_key([system, {'role': 'user', 'content': 'Hello JARVIS'}], 'model', 0.2)
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1' and cache.get('c') == '3'
+
+
+def test_expired_entries_are_misses():
+    cache = ResponseCache(ttl=-1)
+    cache.set('a', '1')
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_shared_tier_is_read_by_another_process_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(sqlite_path=path).set('a', '1')
+    other = ResponseCache(sqlite_path=path)
+    assert other.get('a') == '1'
+    assert other.stats()['disk_hits'] == 1
+
+
+def count_rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+def test_expired_rows_are_purged_on_a_timer(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.db')
+    cache = ResponseCache(ttl=-1, sqlite_path=path)
+    # The first write purges and schedules the next purge PURGE_INTERVAL seconds later
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.set('c', '3')
+    assert count_rows(path) == 2
+
+    now = time.monotonic()
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now + response_cache.PURGE_INTERVAL + 1)
+    cache.set('d', '4')
+    assert count_rows(path) == 0
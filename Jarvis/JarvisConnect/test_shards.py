@@ -0,0 +1,82 @@
+import os
+import pickle
+import cv2
+import numpy as np
+import torch
+import pytest
+from shards import ShardDataset, is_shard_folder, normalize_batch, pack_dataset
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    images = {}
+    for class_name, count in (('alice', 3), ('bob', 4)):
+        os.makedirs(tmp_path / 'faces' / class_name)
+        for i in range(count):
+            path = str(tmp_path / 'faces' / class_name / f"img_{i}.png")
+            image = rng.integers(0, 255, size=(8, 6, 3), dtype=np.uint8)
+            cv2.imwrite(path, image)
+            images[path] = image
+    # Not an image, so not packed
+    (tmp_path / 'faces' / 'bob' / 'notes.txt').write_text('skip me')
+    return str(tmp_path / 'faces'), images
+
+
+def test_shards_hold_every_image_in_rgb(image_folder, tmp_path):
+    folder, images = image_folder
+    output = str(tmp_path / 'shards')
+    index = pack_dataset(folder, output, image_size=(8, 6), shard_size=3)
+    assert is_shard_folder(output) and not is_shard_folder(folder)
+    assert index['num_samples'] == 7 and [s['count'] for s in index['shards']] == [3, 3, 1]
+
+    dataset = ShardDataset(output)
+    assert dataset.classes == ['alice', 'bob'] and len(dataset) == 7
+    assert dataset.targets == [0, 0, 0, 1, 1, 1, 1]
+    for row, path in enumerate(sorted(images)):
+        image, label = dataset[row]
+        assert image.dtype == torch.uint8 and label == dataset.targets[row]
+        np.testing.assert_array_equal(image.numpy(), images[path][:, :, ::-1])
+
+
+def test_include_and_resize(image_folder, tmp_path):
+    folder, _ = image_folder
+    output = str(tmp_path / 'shards')
+    pack_dataset(folder, output, image_size=(4, 4), include=lambda path: not path.endswith('img_0.png'))
+    dataset = ShardDataset(output)
+    assert len(dataset) == 5
+    assert dataset[0][0].shape == (4, 4, 3)
+
+
+def test_unreadable_images_are_skipped(image_folder, tmp_path):
+    folder, _ = image_folder
+    with open(os.path.join(folder, 'alice', 'broken.png'), 'wb') as f:
+        f.write(b'not a png')
+    output = str(tmp_path / 'shards')
+    pack_dataset(folder, output, image_size=(8, 6), shard_size=4)
+    dataset = ShardDataset(output)
+    assert len(dataset) == 7 == len(dataset.labels)
+    # The row left by the broken image is not served, so labels line up with images
+    assert dataset[3][1] == 1 and dataset[6][1] == 1
+
+
+def test_dataset_pickles_without_its_memory_maps(image_folder, tmp_path):
+    folder, _ = image_folder
+    output = str(tmp_path / 'shards')
+    pack_dataset(folder, output, image_size=(8, 6))
+    dataset = ShardDataset(output, hflip=True)
+    dataset[0]
+    clone = pickle.loads(pickle.dumps(dataset))
+    assert clone._shards is None
+    assert clone[2][0].shape == (8, 6, 3)
+
+
+def test_normalize_batch_matches_per_image_normalization():
+    images = torch.randint(0, 256, (2, 5, 4, 3), dtype=torch.uint8)
+    batch = normalize_batch(images.clone())
+    assert batch.shape == (2, 3, 5, 4)
+    assert batch.is_contiguous(memory_format=torch.channels_last)
+    mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+    std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+    expected = (images.permute(0, 3, 1, 2).float() / 255 - mean) / std
+    torch.testing.assert_close(batch, expected)
@@ -0,0 +1,98 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import pytest
+from static_assets import build_static_assets, minify_css, minify_js
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SHIPPED_CSS = [os.path.join(STATIC_DIR, 'css', name) for name in sorted(os.listdir(os.path.join(STATIC_DIR, 'css')))]
+SHIPPED_JS = [os.path.join(STATIC_DIR, 'js', name) for name in sorted(os.listdir(os.path.join(STATIC_DIR, 'js')))]
+
+_CSS_TOKEN = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/|[^\s{}:;,()"']+|[{}:;,()]''', re.S)
+
+
+def css_tokens(css):
+    """Tokens of a stylesheet without comments or the optional ';' before '}'"""
+    tokens = [token for token in _CSS_TOKEN.findall(css) if not token.startswith('/*')]
+    return [token for i, token in enumerate(tokens) if not (token == ';' and tokens[i + 1:i + 2] == ['}'])]
+
+
+@pytest.fixture
+def line_based_js(monkeypatch):
+    """Use the built-in minifier even where rjsmin is installed"""
+    monkeypatch.setitem(sys.modules, 'rjsmin', None)
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_selector_whitespace_is_kept():
+    assert minify_css('a :hover { color : red ; }') == 'a :hover{color:red}'
+    assert minify_css('.card  .title::before , a > b {margin: 0 auto;}') == '.card .title::before,a > b{margin:0 auto}'
+    assert minify_css('@media (min-width: 600px) { nav :focus { top : 0 } }') == \
+        '@media (min-width: 600px){nav :focus{top:0}}'
+
+
+def test_css_strings_and_comments():
+    assert minify_css('a { content: "x :  /* y */" ; } /* gone */ b{c:d}') == 'a{content:"x :  /* y */"}b{c:d}'
+
+
+def test_js_comment_next_to_code_is_kept(line_based_js):
+    js = "/* setup */ init();\nrun();\n/* ok */\n  /* multi\n   line */\nfinish(); // done\n"
+    assert minify_js(js).splitlines() == ['/* setup */ init();', 'run();', 'finish(); // done']
+
+
+def test_js_template_literals_are_untouched(line_based_js):
+    js = "const html = `\n    <div>\n\n    </div>`;\n    next();\n"
+    assert minify_js(js) == "const html = `\n    <div>\n\n    </div>`;\nnext();\n"
+
+
+@pytest.mark.parametrize('path', SHIPPED_CSS, ids=os.path.basename)
+def test_shipped_css_round_trips(path):
+    css = read(path)
+    minified = minify_css(css)
+    assert len(minified) < len(css)
+    assert css_tokens(minified) == css_tokens(css)
+    assert minify_css(minified) == minified
+
+
+@pytest.mark.parametrize('path', SHIPPED_JS, ids=os.path.basename)
+def test_shipped_js_round_trips(path, line_based_js):
+    js = read(path)
+    minified = minify_js(js).splitlines()
+    # Every kept line is an original line without its indentation, and every dropped line
+    # is blank or a comment
+    kept, in_comment = 0, False
+    for line in js.splitlines():
+        stripped = line.strip()
+        if kept < len(minified) and minified[kept] in (stripped, line):
+            kept += 1
+        elif in_comment or stripped.startswith('/*'):
+            in_comment = '*/' not in stripped
+        else:
+            assert stripped == '' or stripped.startswith('//'), line
+    assert kept == len(minified)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason="node is not installed")
+@pytest.mark.parametrize('path', SHIPPED_JS, ids=os.path.basename)
+def test_shipped_js_still_parses(path, tmp_path):
+    output = tmp_path / os.path.basename(path)
+    output.write_text(minify_js(read(path)), encoding='utf-8')
+    subprocess.run(['node', '--check', str(output)], check=True)
+
+
+def test_build_fingerprints_assets_and_rewrites_pages(tmp_path):
+    static_dir = tmp_path / 'static'
+    shutil.copytree(STATIC_DIR, static_dir, ignore=shutil.ignore_patterns('dist'))
+    manifest = build_static_assets(str(static_dir), str(static_dir / 'dist'))
+    assert set(manifest['assets']) == {'css/theme.css', 'js/auth.js', 'js/chat.js', 'js/common.js'}
+    for fingerprinted in manifest['assets'].values():
+        assert os.path.exists(static_dir / 'dist' / fingerprinted)
+        assert os.path.exists(static_dir / 'dist' / (fingerprinted + '.gz'))
+    index = read(static_dir / 'dist' / 'index.html')
+    assert manifest['assets']['css/theme.css'] in index
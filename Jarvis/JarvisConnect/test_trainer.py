@@ -0,0 +1,119 @@
+import os
+import socket
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import numpy as np
+from PIL import Image
+import trainer
+
+
+@pytest.mark.parametrize('overrides', [
+    {'target_per_class': 10, 'shard_dir': 'shards'},
+    {'target_per_class': 10, 'augment_on_the_fly': False},
+])
+def test_class_balancing_needs_on_the_fly_augmentation(overrides):
+    with pytest.raises(ValueError):
+        trainer.build_datasets(trainer.load_config(overrides=overrides))
+
+
+def test_eval_transform_feeds_the_whole_face_like_recognition():
+    import recognition
+    face = np.random.default_rng(0).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+    tensor = trainer.build_eval_transform()(Image.fromarray(face))
+    # recognition.py normalizes the uncropped 224px face the same way
+    expected = ((face.astype(np.float32) / 255 - recognition.IMAGENET_MEAN) / recognition.IMAGENET_STD).transpose(2, 0, 1)
+    np.testing.assert_allclose(tensor.numpy(), expected, atol=1e-5)
+
+    # Larger faces are resized, not cropped: a border marker survives
+    face = np.zeros((448, 448, 3), dtype=np.uint8)
+    face[:, :16] = 255
+    tensor = trainer.build_eval_transform()(Image.fromarray(face))
+    assert tensor.shape == (3, 224, 224)
+    assert tensor[:, :, 0].min() > 2
+
+
+def _resume_worker(rank, world_size, port, checkpoint_dirs, results):
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        path = os.path.join(checkpoint_dirs[rank], trainer.LATEST_CHECKPOINT)
+        checkpoint = trainer.load_resume_checkpoint(path, distributed=True)
+        torch.save(None if checkpoint is None else checkpoint['epoch'], results[rank])
+    finally:
+        dist.destroy_process_group()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_every_rank_resumes_from_the_checkpoint_rank_0_found(tmp_path):
+    # Only rank 0's checkpoint directory has a checkpoint, as on nodes without shared storage
+    checkpoint_dirs = [str(tmp_path / 'node0'), str(tmp_path / 'node1')]
+    for folder in checkpoint_dirs:
+        os.makedirs(folder)
+    torch.save({'epoch': 4}, os.path.join(checkpoint_dirs[0], trainer.LATEST_CHECKPOINT))
+    results = [str(tmp_path / f"rank{rank}.pt") for rank in range(2)]
+
+    mp.spawn(_resume_worker, args=(2, free_port(), checkpoint_dirs, results), nprocs=2)
+    assert [torch.load(path) for path in results] == [4, 4]
+
+
+# Per-sample losses and correctness of an odd-sized validation set, which ranks cannot split evenly
+LOSSES = [0.5, 1.25, 2.0, 0.25, 3.0, 0.75, 1.5]
+CORRECT = [1, 0, 1, 1, 0, 1, 0]
+
+
+def phase_sums(indices):
+    return (torch.tensor([LOSSES[i] for i in indices], dtype=torch.float64).sum(),
+            torch.tensor([CORRECT[i] for i in indices]).sum(), torch.tensor(len(indices)))
+
+
+def _metrics_worker(rank, world_size, port, results):
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        sampler = trainer.DistributedEvalSampler(LOSSES, rank, world_size)
+        torch.save(trainer.reduce_metrics(*phase_sums(list(sampler)), distributed=True), results[rank])
+    finally:
+        dist.destroy_process_group()
+
+
+def test_distributed_metrics_count_every_sample_once(tmp_path):
+    serial = trainer.reduce_metrics(*phase_sums(range(len(LOSSES))))
+    assert serial == pytest.approx((sum(LOSSES) / 7, 4 / 7, 7))
+
+    results = [str(tmp_path / f"rank{rank}.pt") for rank in range(2)]
+    mp.spawn(_metrics_worker, args=(2, free_port(), results), nprocs=2)
+    for path in results:
+        assert torch.load(path) == pytest.approx(serial)
+
+
+def test_checkpoint_round_trip_restores_weights_and_rng_state(tmp_path):
+    torch.manual_seed(0)
+    model = trainer.build_model(3, pretrained=False)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=7)
+    path = str(tmp_path / trainer.LATEST_CHECKPOINT)
+    config = trainer.load_config(overrides={'epochs': 2})
+    trainer.save_checkpoint(path, model, optimizer, scheduler, 1, ['a', 'b', 'c'], config)
+    expected_draw = torch.rand(4)
+
+    # Both loaders use weights_only=True, so the checkpoint must only hold plain data and tensors
+    checkpoint = trainer.load_resume_checkpoint(path)
+    assert checkpoint['epoch'] == 1 and checkpoint['config'] == config
+    torch.set_rng_state(checkpoint['rng_state'])
+    assert torch.equal(torch.rand(4), expected_draw)
+
+    restored, classes = trainer.load_trained_model(path)
+    assert classes == ['a', 'b', 'c']
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(restored.state_dict()[name], tensor)
+
+
+def test_missing_checkpoint_starts_from_scratch(tmp_path):
+    assert trainer.load_resume_checkpoint(str(tmp_path / trainer.LATEST_CHECKPOINT)) is None
@@ -0,0 +1,418 @@
+import os
+import json
+import argparse
+import time
+from contextlib import nullcontext
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.optim import lr_scheduler
+from torch.utils.data import DataLoader, DistributedSampler, Sampler
+from torchvision import datasets, models, transforms
+from augmented_dataset import AugmentedFaceDataset
+from shards import ShardDataset, normalize_batch
+
+DEFAULT_CONFIG = {
+    # Folder with 'train' and 'val' sub-folders in ImageFolder layout
+    'data_dir': r'C:\Users\USER\Desktop\Python\train_test',
+    # Optional folder with 'train' and 'val' packed by shards.py, takes precedence over data_dir
+    'shard_dir': None,
+    # Augment the training images on the fly (augmented_dataset.py) instead of a fixed flip
+    'augment_on_the_fly': True,
+    # With on-the-fly augmentation, draw this many samples per class every epoch instead of
+    # one per image (class-balanced, see AugmentedFaceDataset)
+    'target_per_class': None,
+    'batch_size': 32,
+    'num_workers': 4,
+    'epochs': 10,
+    'lr': 0.001,
+    'step_size': 7,
+    'gamma': 0.1,
+    # Number of batches whose gradients are summed before every optimizer step
+    'accumulation_steps': 1,
+    # 'fp32' or 'bf16' (autocast, fastest on CPUs with AVX512-BF16/AMX)
+    'precision': 'fp32',
+    'channels_last': True,
+    'compile': False,
+    'pretrained': True,
+    'checkpoint_dir': 'checkpoints',
+    # Save a resumable checkpoint every N epochs
+    'checkpoint_every': 1,
+    # Continue from the latest checkpoint in checkpoint_dir if there is one
+    'resume': False,
+    'seed': 0,
+    # Process group backend when launched with torchrun ('gloo' for CPU nodes)
+    'dist_backend': 'gloo',
+    # Intra-op threads per process, None keeps PyTorch's default. Set it to cores / processes
+    # when running several processes on one machine.
+    'num_threads': None,
+}
+
+# (height, width) of the aligned faces written by preprocessing.py, fed to the model uncropped
+FACE_SIZE = (224, 224)
+LATEST_CHECKPOINT = 'checkpoint_latest.pt'
+FINAL_MODEL = 'model_final.pt'
+
+
+def load_config(config_path=None, overrides=None):
+    """
+    Build the training configuration: DEFAULT_CONFIG, then the JSON file at config_path,
+    then any non-None value from overrides.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown training options in {config_path}: {sorted(unknown)}")
+        config.update(file_config)
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = value
+    return config
+
+
+def build_eval_transform():
+    """
+    Transform applied to validation images. The aligned faces are used whole at FACE_SIZE,
+    with no center crop, exactly like the on-the-fly and shard datasets and recognition.py.
+    """
+    return transforms.Compose([
+        transforms.Resize(FACE_SIZE),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+
+
+def build_datasets(config):
+    """Create the 'train' and 'val' datasets described by the configuration"""
+    if config['target_per_class'] is not None:
+        # Class balancing draws augmented samples on the fly from the image folders
+        if config['shard_dir']:
+            raise ValueError("target_per_class cannot be used with shard_dir, shards hold a fixed set of images")
+        if not config['augment_on_the_fly']:
+            raise ValueError("target_per_class requires augment_on_the_fly")
+    if config['shard_dir']:
+        return {x: ShardDataset(os.path.join(config['shard_dir'], x), hflip=(x == 'train')) for x in ['train', 'val']}
+
+    data_transforms = {
+        'train': transforms.Compose([
+            transforms.Resize(FACE_SIZE),
+            transforms.RandomHorizontalFlip(),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+        'val': build_eval_transform(),
+    }
+    image_datasets = {x: datasets.ImageFolder(os.path.join(config['data_dir'], x), data_transforms[x])
+                      for x in ['train', 'val']}
+    if config['augment_on_the_fly']:
+        image_datasets['train'] = AugmentedFaceDataset(os.path.join(config['data_dir'], 'train'),
+                                                       seed=config['seed'],
+                                                       target_per_class=config['target_per_class'])
+    return image_datasets
+
+
+def build_model(num_classes, pretrained=True):
+    """ResNet-50 with its final layer replaced by a num_classes classifier"""
+    weights = models.ResNet50_Weights.DEFAULT if pretrained else None
+    model = models.resnet50(weights=weights)
+    model.fc = nn.Linear(model.fc.in_features, num_classes)
+    return model
+
+
+def load_trained_model(path, map_location='cpu'):
+    """Rebuild the model saved in a checkpoint. Returns (model in eval mode, class names)"""
+    checkpoint = torch.load(path, map_location=map_location, weights_only=True)
+    model = build_model(len(checkpoint['classes']), pretrained=False)
+    model.load_state_dict(checkpoint['model'])
+    return model.eval(), checkpoint['classes']
+
+
+def save_checkpoint(path, model, optimizer, scheduler, epoch, classes, config):
+    """Atomically save everything needed to resume training or serve the model"""
+    checkpoint = {
+        'epoch': epoch,
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict() if optimizer is not None else None,
+        'scheduler': scheduler.state_dict() if scheduler is not None else None,
+        'classes': classes,
+        'config': config,
+        # Restored on resume, so shuffling and random augmentations continue the same sequence
+        'rng_state': torch.get_rng_state(),
+    }
+    tmp_path = path + '.tmp'
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def init_distributed(backend='gloo'):
+    """
+    Join the process group set up by torchrun (WORLD_SIZE, RANK, MASTER_ADDR, ... in the
+    environment). Returns (rank, world_size), which is (0, 1) when not launched by torchrun.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', '1'))
+    if world_size <= 1:
+        return 0, 1
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return dist.get_rank(), world_size
+
+
+def load_resume_checkpoint(path, distributed=False):
+    """
+    Checkpoint to resume from, or None to start from scratch.
+
+    Only rank 0 looks at `path`; in distributed runs it broadcasts what it found, so every
+    rank resumes from the same epoch and weights even when checkpoint_dir is not on storage
+    shared by all nodes.
+    """
+    checkpoint = None
+    if not distributed or dist.get_rank() == 0:
+        if os.path.exists(path):
+            checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+    if distributed:
+        objects = [checkpoint]
+        dist.broadcast_object_list(objects, src=0)
+        checkpoint = objects[0]
+    return checkpoint
+
+
+class DistributedEvalSampler(Sampler):
+    """
+    Gives every rank a disjoint slice of the dataset. Unlike DistributedSampler it does not
+    pad the slices to equal length, so metrics summed over ranks count every sample once.
+    """
+
+    def __init__(self, dataset, rank, world_size):
+        self.indices = range(rank, len(dataset), world_size)
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+def reduce_metrics(loss_sum, corrects, count, distributed=False):
+    """
+    Mean loss and accuracy of a phase from the running sums of every process.
+
+    Args:
+        loss_sum (torch.Tensor): Sum of the per-sample losses seen by this process.
+        corrects (torch.Tensor): Number of correct predictions of this process.
+        count (torch.Tensor): Number of samples seen by this process.
+        distributed (bool): Sum over all processes of the default process group.
+
+    Returns:
+        tuple: (mean loss, accuracy, total number of samples)
+    """
+    # Single device-to-host sync (and one all-reduce across processes) per phase
+    totals = torch.stack([loss_sum.double(), corrects.double(), count.double()])
+    if distributed:
+        dist.all_reduce(totals)
+    total_loss, total_corrects, total_count = totals.tolist()
+    return total_loss / max(total_count, 1), total_corrects / max(total_count, 1), total_count
+
+
+def train(config):
+    """
+    Fine-tune ResNet-50 on the configured dataset.
+
+    Loss and accuracy are accumulated on-device and only read back once per epoch, so the
+    training loop never waits for the model to finish a step just to print a number.
+
+    When launched with torchrun, every process trains a DistributedDataParallel replica on
+    its share of the data (batch_size is per process) and gradients are averaged with the
+    configured backend (gloo for CPUs). Loss and accuracy are summed over all processes,
+    and only rank 0 prints and writes checkpoints.
+
+    Returns:
+        torch.nn.Module: The trained model.
+    """
+    if config['num_threads']:
+        torch.set_num_threads(config['num_threads'])
+    rank, world_size = init_distributed(config['dist_backend'])
+    distributed = world_size > 1
+    is_main = rank == 0
+
+    try:
+        return _train(config, rank, world_size, distributed, is_main)
+    finally:
+        if distributed:
+            dist.destroy_process_group()
+
+
+def _train(config, rank, world_size, distributed, is_main):
+    torch.manual_seed(config['seed'])
+    image_datasets = build_datasets(config)
+    classes = image_datasets['train'].classes
+    num_classes = len(classes)
+
+    samplers = {'train': None, 'val': None}
+    if distributed:
+        samplers = {
+            'train': DistributedSampler(image_datasets['train'], num_replicas=world_size, rank=rank, shuffle=True,
+                                        seed=config['seed']),
+            'val': DistributedEvalSampler(image_datasets['val'], rank, world_size),
+        }
+    dataloaders = {x: DataLoader(image_datasets[x], batch_size=config['batch_size'],
+                                 shuffle=(x == 'train' and samplers[x] is None), sampler=samplers[x],
+                                 num_workers=config['num_workers'], pin_memory=torch.cuda.is_available(),
+                                 persistent_workers=False)
+                   for x in ['train', 'val']}
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() and not distributed else "cpu")
+    memory_format = torch.channels_last if config['channels_last'] else torch.contiguous_format
+    model = build_model(num_classes, config['pretrained']).to(device, memory_format=memory_format)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+    scheduler = lr_scheduler.StepLR(optimizer, step_size=config['step_size'], gamma=config['gamma'])
+
+    if is_main:
+        os.makedirs(config['checkpoint_dir'], exist_ok=True)
+    latest_path = os.path.join(config['checkpoint_dir'], LATEST_CHECKPOINT)
+    start_epoch = 0
+    checkpoint = load_resume_checkpoint(latest_path, distributed) if config['resume'] else None
+    if checkpoint is not None:
+        if checkpoint['classes'] != classes:
+            raise ValueError(f"Checkpoint {latest_path} was trained on different classes")
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        if checkpoint.get('rng_state') is not None:
+            torch.set_rng_state(checkpoint['rng_state'])
+        start_epoch = checkpoint['epoch'] + 1
+        if is_main:
+            print(f"Resuming from {latest_path} at epoch {start_epoch + 1}")
+
+    # Training goes through the DDP wrapper, which averages gradients across processes.
+    # Validation uses the plain module: it needs no collectives, so ranks may run different
+    # numbers of validation batches.
+    train_model = DistributedDataParallel(model) if distributed else model
+    # The compiled wrappers share parameters with `model`, which is what gets checkpointed
+    forward_models = {'train': train_model, 'val': model}
+    if config['compile']:
+        forward_models = {x: torch.compile(m) for x, m in forward_models.items()}
+    use_bf16 = config['precision'] == 'bf16'
+    accumulation_steps = max(1, config['accumulation_steps'])
+    if is_main and distributed:
+        print(f"Distributed training on {world_size} processes ({config['dist_backend']}), "
+              f"effective batch size {config['batch_size'] * world_size * accumulation_steps}")
+
+    num_epochs = config['epochs']
+    for epoch in range(start_epoch, num_epochs):
+        if is_main:
+            print(f'Epoch {epoch + 1}/{num_epochs}')
+            print('-' * 10)
+
+        if isinstance(image_datasets['train'], AugmentedFaceDataset):
+            image_datasets['train'].set_epoch(epoch)
+        if samplers['train'] is not None:
+            samplers['train'].set_epoch(epoch)
+
+        for phase in ['train', 'val']:
+            is_train = phase == 'train'
+            model.train(is_train)
+            forward_model = forward_models[phase]
+
+            running_loss = torch.zeros((), dtype=torch.float64, device=device)
+            running_corrects = torch.zeros((), dtype=torch.int64, device=device)
+            running_count = torch.zeros((), dtype=torch.int64, device=device)
+
+            # Start timer for epoch duration
+            start_time = time.time()
+            optimizer.zero_grad(set_to_none=True)
+            num_batches = len(dataloaders[phase])
+
+            for step, (inputs, labels) in enumerate(dataloaders[phase]):
+                if config['shard_dir']:
+                    inputs = normalize_batch(inputs)
+                inputs = inputs.to(device, non_blocking=True, memory_format=memory_format)
+                labels = labels.to(device, non_blocking=True)
+
+                optimizer_step = is_train and ((step + 1) % accumulation_steps == 0 or step + 1 == num_batches)
+                # Gradients are only all-reduced on the micro-batch that ends an accumulation window
+                sync_context = train_model.no_sync() if distributed and is_train and not optimizer_step \
+                    else nullcontext()
+
+                with sync_context:
+                    with torch.set_grad_enabled(is_train), \
+                            torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                        outputs = forward_model(inputs)
+                        loss = criterion(outputs, labels)
+
+                    if is_train:
+                        (loss / accumulation_steps).backward()
+
+                if optimizer_step:
+                    optimizer.step()
+                    optimizer.zero_grad(set_to_none=True)
+
+                running_loss += loss.detach() * inputs.size(0)
+                running_corrects += (outputs.detach().argmax(1) == labels).sum()
+                running_count += inputs.size(0)
+
+            if is_train:
+                scheduler.step()
+
+            epoch_loss, epoch_acc, total_count = reduce_metrics(running_loss, running_corrects, running_count,
+                                                                distributed)
+
+            epoch_time = time.time() - start_time
+            if is_main:
+                print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} in {epoch_time:.2f}s '
+                      f'({total_count / max(epoch_time, 1e-9):.1f} images/sec)')
+
+        if is_main and ((epoch + 1) % config['checkpoint_every'] == 0 or epoch + 1 == num_epochs):
+            save_checkpoint(latest_path, model, optimizer, scheduler, epoch, classes, config)
+
+    if is_main:
+        save_checkpoint(os.path.join(config['checkpoint_dir'], FINAL_MODEL), model, None, None,
+                        num_epochs - 1, classes, config)
+        print('\nTraining complete!')
+    if distributed:
+        # Nobody leaves before rank 0 has written the final model
+        dist.barrier()
+    return model
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fine-tune ResNet-50 on the celebrity face dataset.")
+    parser.add_argument('--config', help="JSON file with training options (see DEFAULT_CONFIG)")
+    parser.add_argument('--data-dir', dest='data_dir')
+    parser.add_argument('--shard-dir', dest='shard_dir')
+    parser.add_argument('--no-augment', dest='augment_on_the_fly', action='store_false', default=None,
+                        help="Use a plain random flip instead of the on-the-fly augmentation pipeline")
+    parser.add_argument('--target-per-class', dest='target_per_class', type=int,
+                        help="Class-balanced on-the-fly augmentation: samples per class and epoch")
+    parser.add_argument('--batch-size', dest='batch_size', type=int)
+    parser.add_argument('--num-workers', dest='num_workers', type=int)
+    parser.add_argument('--epochs', type=int)
+    parser.add_argument('--lr', type=float)
+    parser.add_argument('--accumulation-steps', dest='accumulation_steps', type=int)
+    parser.add_argument('--precision', choices=['fp32', 'bf16'])
+    parser.add_argument('--no-channels-last', dest='channels_last', action='store_false', default=None)
+    parser.add_argument('--compile', action='store_true', default=None, help="Wrap the model with torch.compile")
+    parser.add_argument('--checkpoint-dir', dest='checkpoint_dir')
+    parser.add_argument('--checkpoint-every', dest='checkpoint_every', type=int)
+    parser.add_argument('--resume', action='store_true', default=None,
+                        help="Continue from the latest checkpoint in the checkpoint directory")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--dist-backend', dest='dist_backend', choices=['gloo', 'mpi'])
+    parser.add_argument('--num-threads', dest='num_threads', type=int, help="Intra-op threads per process")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = {key: value for key, value in vars(args).items() if key != 'config'}
+    train(load_config(args.config, overrides))
+
+
+if __name__ == '__main__':
+    main()